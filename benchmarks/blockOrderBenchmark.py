@@ -0,0 +1,143 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Upstream cache hit rate and total time of a feature + prediction export for each block order.
+
+Pipeline::
+
+    raw -> (read counter) -> OpBlockedArrayCache -> (lookup counter) -> OpPixelFeaturesPresmoothed
+        -> OpReorderAxes -> OpVectorwiseClassifierPredict -> BigRequestStreamer
+
+The RAM for caches is restricted to a few raw cache blocks, so the order in which the export
+blocks are requested decides how often raw blocks (shared via the filter halos) are evicted
+before they are used again.
+
+Example:
+
+    python benchmarks/blockOrderBenchmark.py --shape 256 --cache-block 64 --export-block 32 --cache-blocks 8
+"""
+
+import argparse
+
+import numpy
+import vigra
+
+from lazyflow.classifiers import VigraRfLazyflowClassifierFactory
+from lazyflow.graph import Graph
+from lazyflow.operators import cacheMemoryManager
+from lazyflow.operators.classifierOperators import OpVectorwiseClassifierPredict
+from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+from lazyflow.operators.opPixelFeaturesPresmoothed import OpPixelFeaturesPresmoothed
+from lazyflow.operators.opReorderAxes import OpReorderAxes
+from lazyflow.roi import BLOCK_ORDERS, getIntersectingBlocks
+from lazyflow.utility import BigRequestStreamer, Memory, Timer
+from lazyflow.utility.testing import OpArrayPiperWithAccessCount
+
+
+def build_pipeline(raw, cache_blockshape):
+    graph = Graph()
+    op_reads = OpArrayPiperWithAccessCount(graph=graph)
+    op_reads.Input.setValue(raw)
+
+    op_cache = OpBlockedArrayCache(graph=graph)
+    op_cache.BlockShape.setValue(cache_blockshape)
+    op_cache.Input.connect(op_reads.Output)
+
+    op_lookups = OpArrayPiperWithAccessCount(graph=graph)
+    op_lookups.Input.connect(op_cache.Output)
+
+    op_features = OpPixelFeaturesPresmoothed(graph=graph)
+    op_features.Scales.setValue([1.0, 3.5])
+    op_features.FeatureIds.setValue(["GaussianSmoothing", "GaussianGradientMagnitude"])
+    op_features.SelectionMatrix.setValue(numpy.ones((2, 2), dtype=bool))
+    op_features.ComputeIn2d.setValue([False, False])
+    op_features.Input.connect(op_lookups.Output)
+
+    op_reorder = OpReorderAxes(graph=graph, Input=op_features.Output, AxisOrder="tzyxc")
+
+    # Train on a small corner of the volume with random labels, we only care about the runtime
+    features = op_reorder.Output[:, :16, :16, :16, :].wait()
+    X = features.reshape(-1, features.shape[-1])
+    y = numpy.random.randint(1, 3, size=len(X))
+    classifier = VigraRfLazyflowClassifierFactory(10).create_and_train(X, y)
+
+    op_predict = OpVectorwiseClassifierPredict(graph=graph)
+    op_predict.Image.connect(op_reorder.Output)
+    op_predict.LabelsCount.setValue(2)
+    op_predict.Classifier.setValue(classifier)
+    return op_reads, op_cache, op_lookups, op_predict
+
+
+def count_block_lookups(rois, cache_blockshape):
+    return sum(len(getIntersectingBlocks(cache_blockshape, (roi.start, roi.stop))) for roi in rois)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare block orders for a blockwise export")
+    parser.add_argument("--shape", type=int, default=256, help="Edge length of the 3D raw volume")
+    parser.add_argument("--cache-block", type=int, default=64, help="Edge length of the raw cache blocks")
+    parser.add_argument("--export-block", type=int, default=32, help="Edge length of the export blocks")
+    parser.add_argument("--cache-blocks", type=int, default=8, help="Number of raw cache blocks that fit in RAM")
+    parser.add_argument("--orders", nargs="+", default=list(BLOCK_ORDERS), choices=BLOCK_ORDERS)
+    args = parser.parse_args()
+
+    raw = numpy.random.random((1, 1) + (args.shape,) * 3).astype(numpy.float32)
+    raw = vigra.taggedView(raw, "tczyx")
+    cache_blockshape = (1, 1) + (args.cache_block,) * 3
+    export_blockshape = (1,) + (args.export_block,) * 3 + (2,)
+    slab_shape = (1,) + (args.cache_block,) * 3 + (0,)
+
+    Memory.setAvailableRamCaches(args.cache_blocks * numpy.prod(cache_blockshape) * raw.dtype.itemsize)
+    cacheMemoryManager.setRefreshInterval(0.01)
+
+    print("{:>8} {:>10} {:>12} {:>10} {:>10}".format("order", "time [s]", "raw reads", "minimum", "hit rate"))
+    try:
+        for order in args.orders:
+            op_reads, op_cache, op_lookups, op_predict = build_pipeline(raw, cache_blockshape)
+            op_cache.freeMemory()
+            op_reads.clear()
+            op_lookups.clear()
+
+            total_roi = ((0,) * 5, op_predict.PMaps.meta.shape)
+            streamer = BigRequestStreamer(
+                op_predict.PMaps, total_roi, export_blockshape, blockOrder=order, slabShape=slab_shape
+            )
+            with Timer() as timer:
+                streamer.execute()
+
+            minimum = len(getIntersectingBlocks(cache_blockshape, ((0,) * 5, raw.shape)))
+            lookups = count_block_lookups(op_lookups.requests, cache_blockshape)
+            hit_rate = 1.0 - op_reads.accessCount / max(lookups, 1)
+            print(
+                "{:>8} {:>10.2f} {:>12} {:>10} {:>10.1%}".format(
+                    order, timer.seconds(), op_reads.accessCount, minimum, hit_rate
+                )
+            )
+    finally:
+        Memory.setAvailableRamCaches(-1)
+        cacheMemoryManager.setRefreshInterval(cacheMemoryManager.default_refresh_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Connected components backends of OpLabelVolume.
+
+Labels a volume of random blobs with each of the given methods ('vigra' labels every time/channel
+slice with a single vigra call, 'lazy' grows the labeling from the requested chunks, 'twopass'
+labels blocks in parallel and merges them) for each of the given thread pool sizes.
+
+Example:
+
+    python benchmarks/labelVolumeBenchmark.py --shape 512 512 256 --block-shape 128 128 128 --workers 1 4 8
+"""
+
+import argparse
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper, OpLabelVolume
+from lazyflow.request import Request
+from lazyflow.utility import Timer
+
+
+def make_volume(shape, density, sigma):
+    noise = numpy.random.rand(*shape).astype(numpy.float32)
+    smooth = vigra.filters.gaussianSmoothing(noise, sigma)
+    threshold = numpy.percentile(smooth, 100 * (1 - density))
+    return vigra.taggedView((smooth > threshold).astype(numpy.uint8), "xyz")
+
+
+def run(volume, method, block_shape):
+    graph = Graph()
+    op_raw = OpArrayPiper(graph=graph)
+    op_raw.Input.setValue(volume)
+    op_raw.Output.meta.ideal_blockshape = tuple(block_shape)
+
+    op_label = OpLabelVolume(graph=graph)
+    op_label.Method.setValue(method)
+    op_label.Input.connect(op_raw.Output)
+
+    with Timer() as timer:
+        labels = op_label.Output[...].wait()
+    return timer.seconds(), labels.max()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the connected components backends of OpLabelVolume")
+    parser.add_argument("--shape", type=int, nargs=3, default=[512, 512, 256], help="Volume shape (x y z)")
+    parser.add_argument("--block-shape", type=int, nargs=3, default=[128, 128, 128], help="Block shape (x y z)")
+    parser.add_argument("--density", type=float, default=0.3, help="Fraction of foreground pixels")
+    parser.add_argument("--sigma", type=float, default=2.0, help="Smoothing of the random blobs")
+    parser.add_argument("--methods", nargs="+", default=["vigra", "lazy", "twopass"], help="Labeling methods")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Worker counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of this many runs")
+    args = parser.parse_args()
+
+    volume = make_volume(args.shape, args.density, args.sigma)
+
+    print("{:>8} {:>10} {:>10} {:>10}".format("workers", "method", "time [s]", "objects"))
+    for num_workers in args.workers:
+        Request.reset_thread_pool(num_workers)
+        for method in args.methods:
+            results = [run(volume, method, args.block_shape) for _ in range(args.repeat)]
+            seconds = min(r[0] for r in results)
+            print("{:>8} {:>10} {:>10.2f} {:>10}".format(num_workers, method, seconds, results[0][1]))
+
+    Request.reset_thread_pool()
+
+
+if __name__ == "__main__":
+    main()
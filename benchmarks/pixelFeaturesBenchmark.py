@@ -0,0 +1,95 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Filter time of OpPixelFeaturesPresmoothed with and without ShareDerivatives.
+
+All default features are selected at the seven scales offered by ilastik, and the results of both
+paths are compared to make sure they agree.
+
+Example:
+
+    python benchmarks/pixelFeaturesBenchmark.py --shape 128 --workers 0 4 8 --repeat 3
+"""
+
+import argparse
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators.opPixelFeaturesPresmoothed import OpPixelFeaturesPresmoothed
+from lazyflow.request import Request
+from lazyflow.utility import Timer
+
+SCALES = [0.3, 0.7, 1.0, 1.6, 3.5, 5.0, 10.0]
+
+
+def build_features(raw, share_derivatives, in2d):
+    op = OpPixelFeaturesPresmoothed(graph=Graph())
+    op.Input.setValue(raw)
+    op.Scales.setValue(SCALES)
+    op.SelectionMatrix.setValue(numpy.ones((len(op.FeatureIds.value), len(SCALES)), dtype=bool))
+    op.ComputeIn2d.setValue([in2d] * len(SCALES))
+    op.ShareDerivatives.setValue(share_derivatives)
+    return op
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OpPixelFeaturesPresmoothed with and without ShareDerivatives")
+    parser.add_argument("--shape", type=int, default=128, help="Edge length of the 3D raw volume")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 4], help="Thread pool sizes to try")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the fastest one is reported")
+    parser.add_argument("--in2d", action="store_true", help="Compute all features in 2D")
+    args = parser.parse_args()
+
+    raw = numpy.random.random((1, 1) + (args.shape,) * 3).astype(numpy.float32)
+    raw = vigra.taggedView(raw, "tczyx")
+
+    print("{:>8} {:>12} {:>12} {:>10} {:>12}".format("workers", "per filter", "shared", "speedup", "max diff"))
+    try:
+        for workers in args.workers:
+            Request.reset_thread_pool(workers)
+            seconds = {}
+            results = {}
+            for share_derivatives in (False, True):
+                op = build_features(raw, share_derivatives, args.in2d)
+                times = []
+                for _ in range(args.repeat):
+                    with Timer() as timer:
+                        results[share_derivatives] = op.Output[:].wait()
+                    times.append(timer.seconds())
+                seconds[share_derivatives] = min(times)
+
+            max_diff = numpy.abs(results[True] - results[False]).max()
+            print(
+                "{:>8} {:>12.2f} {:>12.2f} {:>10.2f} {:>12.2e}".format(
+                    workers, seconds[False], seconds[True], seconds[False] / seconds[True], max_diff
+                )
+            )
+    finally:
+        Request.reset_thread_pool()
+
+
+if __name__ == "__main__":
+    main()
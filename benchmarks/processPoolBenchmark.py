@@ -0,0 +1,104 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Threads vs. processes for a GIL-bound operator.
+
+OpDetectMissing computes a histogram for every (small) patch of every slice, which is dominated by
+python and numpy call overhead and hardly scales with more threads.  This runs the operator over a
+volume with BigRequestStreamer, once with the histograms computed in the request threads and once
+with the histograms offloaded to the process pool (lazyflow.request.processPool).
+
+Example:
+
+    python benchmarks/processPoolBenchmark.py --shape 64 512 512 --patch-size 16 --workers 1 2 4
+"""
+
+import argparse
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.operators.opDetectMissingData import OpDetectMissing
+from lazyflow.request import Request, processPool
+from lazyflow.utility import BigRequestStreamer, Timer
+
+
+def build_pipeline(raw, patch_size):
+    graph = Graph()
+    op_raw = OpArrayPiper(graph=graph)
+    op_raw.Input.setValue(raw)
+
+    op_detect = OpDetectMissing(graph=graph)
+    op_detect.InputVolume.connect(op_raw.Output)
+    op_detect.PatchSize.setValue(patch_size)
+    op_detect.HaloSize.setValue(0)
+    op_detect.DetectionMethod.setValue("classic")
+    return op_detect
+
+
+def run(op_detect, block_depth):
+    shape = op_detect.Output.meta.shape
+    blockshape = (block_depth,) + tuple(shape[1:])
+    streamer = BigRequestStreamer(op_detect.Output, [(0,) * len(shape), shape], blockshape)
+    with Timer() as timer:
+        streamer.execute()
+    return timer.seconds()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare threads and processes for a GIL-bound operator")
+    parser.add_argument("--shape", type=int, nargs=3, default=[64, 512, 512], help="Volume shape (z y x)")
+    parser.add_argument("--patch-size", type=int, default=16, help="OpDetectMissing patch size")
+    parser.add_argument("--block-depth", type=int, default=4, help="Number of slices per request")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of this many runs")
+    args = parser.parse_args()
+
+    raw = numpy.random.randint(0, 256, size=args.shape).astype(numpy.uint8)
+    raw = vigra.taggedView(raw, "zyx")
+    op_detect = build_pipeline(raw, args.patch_size)
+
+    print("{:>8} {:>12} {:>14} {:>8}".format("workers", "threads [s]", "processes [s]", "speedup"))
+    for num_workers in args.workers:
+        Request.reset_thread_pool(num_workers)
+        seconds = {}
+        for use_processes in (False, True):
+            if use_processes:
+                processPool.enable(num_workers)
+            seconds[use_processes] = min(run(op_detect, args.block_depth) for _ in range(args.repeat))
+            processPool.disable()
+
+        print(
+            "{:>8} {:>12.2f} {:>14.2f} {:>8.2f}".format(
+                num_workers, seconds[False], seconds[True], seconds[False] / seconds[True]
+            )
+        )
+
+    Request.reset_thread_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+"""
+Per-request overhead of cache hits on small rois.
+
+Measures
+  * the construction of a regular request and of an inline request (see Request.inline), and
+  * cache hits on a fully populated OpUnblockedArrayCache, waited for from within a request,
+    once with inline requests for resident data (the default) and once with regular requests
+    (by disabling the operator's ``isResident`` check).
+
+Example:
+
+    python benchmarks/slotGetOverheadBenchmark.py --tiles 1 8 32 128 --iterations 20000
+"""
+
+import argparse
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators.opArrayPiper import OpArrayPiper
+from lazyflow.operators.opUnblockedArrayCache import OpUnblockedArrayCache
+from lazyflow.request import Request
+from lazyflow.utility import Timer
+
+
+def within_request(fn):
+    """
+    Run fn in a worker thread of the request thread pool and return its result.
+    """
+    req = Request(fn)
+    req.submit()
+    return req.wait()
+
+
+def time_construction(make_request, iterations):
+    def run():
+        fn = int
+        with Timer() as timer:
+            for _ in range(iterations):
+                make_request(fn)
+        return timer.seconds() / iterations
+
+    return within_request(run)
+
+
+def time_hits(op_cache, tile, iterations):
+    shape = op_cache.Output.meta.shape
+    starts = numpy.random.randint(0, shape[0] - tile, size=(iterations, 2))
+
+    def run():
+        with Timer() as timer:
+            for start in starts:
+                op_cache.Output(tuple(start), tuple(start + tile)).wait()
+        return timer.seconds() / iterations
+
+    return within_request(run)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-request overhead of cache hits")
+    parser.add_argument("--shape", type=int, default=1024, help="Edge length of the cached 2D image")
+    parser.add_argument("--tiles", type=int, nargs="+", default=[1, 8, 32, 128], help="Tile edge lengths")
+    parser.add_argument("--iterations", type=int, default=10000, help="Requests per measurement")
+    args = parser.parse_args()
+
+    graph = Graph()
+    op_source = OpArrayPiper(graph=graph)
+    op_source.Input.setValue(vigra.taggedView(numpy.random.random((args.shape, args.shape)).astype("f4"), "yx"))
+    op_cache = OpUnblockedArrayCache(graph=graph)
+    op_cache.Input.connect(op_source.Output)
+
+    # Populate the cache with a single block, so that every request below is a hit.
+    op_cache.Output[:].wait()
+
+    full = time_construction(Request, args.iterations)
+    inline = time_construction(Request.inline, args.iterations)
+    print("{:>6} {:>14} {:>14} {:>8}".format("", "request [us]", "inline [us]", "speedup"))
+    print("{:>6} {:>14.2f} {:>14.2f} {:>8.2f}".format("new", full * 1e6, inline * 1e6, full / inline))
+
+    print("{:>6} {:>14} {:>14} {:>8}".format("tile", "request [us]", "inline [us]", "speedup"))
+    for tile in args.tiles:
+        op_cache.isResident = lambda *args: False
+        full = time_hits(op_cache, tile, args.iterations)
+        del op_cache.isResident
+        inline = time_hits(op_cache, tile, args.iterations)
+        print("{:>6} {:>14.1f} {:>14.1f} {:>8.2f}".format(tile, full * 1e6, inline * 1e6, full / inline))
+
+
+if __name__ == "__main__":
+    main()
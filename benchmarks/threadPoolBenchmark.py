@@ -0,0 +1,115 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+"""
+Throughput benchmark for the request thread pools.
+
+Runs the same workload with the default ThreadPool (one shared queue) and the
+WorkStealingThreadPool (per-worker queues), for several worker counts:
+
+- 'flat': many small requests submitted from the main thread
+- 'fanout': a few parent requests that each spawn and wait for many children
+
+Example:
+
+    python benchmarks/threadPoolBenchmark.py --workers 4 8 16 32 --tasks 20000
+"""
+
+import argparse
+import multiprocessing
+
+import numpy
+
+from lazyflow.request import Request, RequestPool
+from lazyflow.utility import Timer
+
+
+def _work(size):
+    # numpy releases the GIL for this, so the workers can actually run in parallel.
+    a = numpy.ones((size, size), dtype=numpy.float32)
+    return float(a.dot(a).sum())
+
+
+def run_flat(num_tasks, size):
+    pool = RequestPool()
+    for _ in range(num_tasks):
+        pool.add(Request(lambda: _work(size)))
+    pool.wait()
+
+
+def run_fanout(num_tasks, size, num_parents=16):
+    def parent():
+        children = [Request(lambda: _work(size)) for _ in range(num_tasks // num_parents)]
+        for child in children:
+            child.submit()
+        for child in children:
+            child.block()
+
+    pool = RequestPool()
+    for _ in range(num_parents):
+        pool.add(Request(parent))
+    pool.wait()
+
+
+WORKLOADS = {"flat": run_flat, "fanout": run_fanout}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare request throughput of the thread pool implementations")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=sorted({1, 4, 8, multiprocessing.cpu_count()}), help="Worker counts"
+    )
+    parser.add_argument("--tasks", type=int, default=10000, help="Number of requests per run")
+    parser.add_argument("--size", type=int, default=32, help="Matrix size of each request's workload")
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of this many runs")
+    args = parser.parse_args()
+
+    print(
+        "{:>8} {:>8} {:>14} {:>16} {:>8}".format("workload", "workers", "shared [req/s]", "stealing [req/s]", "speedup")
+    )
+    for workload_name, workload in WORKLOADS.items():
+        for num_workers in args.workers:
+            throughput = {}
+            for work_stealing in (False, True):
+                Request.reset_thread_pool(num_workers, work_stealing=work_stealing)
+                best = float("inf")
+                for _ in range(args.repeat):
+                    with Timer() as timer:
+                        workload(args.tasks, args.size)
+                    best = min(best, timer.seconds())
+                throughput[work_stealing] = args.tasks / best
+
+            print(
+                "{:>8} {:>8} {:>14.0f} {:>16.0f} {:>8.2f}".format(
+                    workload_name,
+                    num_workers,
+                    throughput[False],
+                    throughput[True],
+                    throughput[True] / throughput[False],
+                )
+            )
+
+    Request.reset_thread_pool()
+
+
+if __name__ == "__main__":
+    main()
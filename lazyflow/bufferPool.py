@@ -0,0 +1,220 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Pool of reusable buffers for request results.
+
+Slots allocate a new array for the result of every request that is not given a destination
+(see ``ArrayLike.allocateDestination``).  Blockwise exports and feature computations allocate
+and free buffers of identical sizes over and over, which fragments the heap.  Instead,
+:py:func:`allocate` carves arrays from buffers that are kept in a pool, keyed by their size in bytes
+(i.e. by shape and dtype).  A buffer returns to the pool once the array and all views of it
+have been garbage collected, e.g. when ``Request.clean()`` drops the last reference to a result.
+The pool holds at most :py:func:`maxBytes` bytes of unused buffers; the least recently used are
+released first.  Unused buffers count towards the cache memory budget (see ``Memory.getAvailableRamCaches``):
+the cache memory manager releases them before it evicts any cache blocks.
+
+The pool is disabled by default, :py:func:`enable` turns it on.
+
+Example:
+
+>>> from lazyflow import bufferPool
+>>> bufferPool.enable()
+>>> a = bufferPool.allocate((256, 256), "float32")
+>>> a.shape, a.dtype
+((256, 256), dtype('float32'))
+>>> del a  # back to the pool
+>>> stats = bufferPool.getStatistics()
+"""
+
+import collections
+import ctypes
+import threading
+import weakref
+
+import numpy
+
+#: Arrays smaller than this are allocated directly with numpy, the pool wouldn't pay off for them.
+MIN_BYTES = 64 * 1024
+
+#: Default for the amount of memory in unused buffers the pool may hold
+DEFAULT_MAX_BYTES = 64 * 1024**2
+
+# Reentrant: the garbage collector may return a buffer while we hold the lock
+_lock = threading.RLock()
+_enabled = False
+_max_bytes = DEFAULT_MAX_BYTES
+
+# nbytes -> [unused buffers], least recently returned sizes first
+_free = collections.OrderedDict()
+_free_bytes = 0
+_outstanding_bytes = 0
+
+
+def _newStatistics():
+    return {
+        "allocations": 0,  # arrays carved from the pool (hits + misses)
+        "hits": 0,  # ... from a reused buffer
+        "misses": 0,  # ... from a new buffer
+        "unpooled": 0,  # arrays allocated directly (too small, or pool disabled)
+        "returned": 0,  # buffers returned to the pool
+        "released": 0,  # buffers released to the system (evicted, or pool full)
+        "peak_outstanding_bytes": 0,
+    }
+
+
+_statistics = _newStatistics()
+
+
+def enable(maxBytes=DEFAULT_MAX_BYTES):
+    """
+    Enable the pool, holding at most maxBytes of unused buffers.
+    """
+    global _enabled, _max_bytes
+    with _lock:
+        _enabled = True
+        _max_bytes = maxBytes
+        _evict()
+
+
+def disable():
+    """
+    Disable the pool (the default) and release all unused buffers.  From now on, arrays are allocated directly.
+    """
+    global _enabled
+    with _lock:
+        _enabled = False
+        _evict()
+
+
+def isEnabled():
+    return _enabled
+
+
+def maxBytes():
+    return _max_bytes
+
+
+def freeBytes():
+    """
+    Memory held in unused buffers of the pool, in bytes.
+    """
+    return _free_bytes
+
+
+def trim(maxBytes=0):
+    """
+    Release unused buffers, least recently used first, until at most maxBytes are left in the pool.
+    Returns the number of bytes released.
+    """
+    with _lock:
+        before = _free_bytes
+        _evict(maxBytes)
+        return before - _free_bytes
+
+
+def allocate(shape, dtype):
+    """
+    Return an uninitialized array with the given shape and dtype, like numpy.ndarray(shape, dtype).
+    """
+    global _free_bytes, _outstanding_bytes
+    dtype = numpy.dtype(dtype)
+    nbytes = int(numpy.prod(shape)) * dtype.itemsize
+    if not _enabled or nbytes < MIN_BYTES or dtype.hasobject:
+        # Not under the lock: this is the common path, and an approximate count will do.
+        _statistics["unpooled"] += 1
+        return numpy.ndarray(shape, dtype=dtype)
+
+    with _lock:
+        buffers = _free.get(nbytes)
+        if buffers:
+            buffer = buffers.pop()
+            if not buffers:
+                del _free[nbytes]
+            _free_bytes -= nbytes
+            _statistics["hits"] += 1
+        else:
+            buffer = None
+            _statistics["misses"] += 1
+        _statistics["allocations"] += 1
+        _outstanding_bytes += nbytes
+        _statistics["peak_outstanding_bytes"] = max(_statistics["peak_outstanding_bytes"], _outstanding_bytes)
+
+    if buffer is None:
+        # Uninitialized, like numpy.ndarray (a bytearray would be zero-filled).  The ctypes array keeps
+        # the numpy array alive; a memoryview wouldn't do, numpy would take the array behind it as base.
+        buffer = (ctypes.c_char * nbytes).from_buffer(numpy.empty(nbytes, dtype=numpy.uint8))
+
+    # The array is a view of the (non-ndarray) buffer, so numpy doesn't collapse the bases of views of
+    # this array to the buffer: the array is alive as long as any view of it is.
+    array = numpy.ndarray(shape, dtype=dtype, buffer=buffer)
+    weakref.finalize(array, _return, buffer)
+    return array
+
+
+def _return(buffer):
+    global _free_bytes, _outstanding_bytes
+    nbytes = len(buffer)
+    with _lock:
+        _outstanding_bytes -= nbytes
+        if not _enabled or nbytes > _max_bytes:
+            _statistics["released"] += 1
+            return
+        _free.setdefault(nbytes, []).append(buffer)
+        _free.move_to_end(nbytes)
+        _free_bytes += nbytes
+        _statistics["returned"] += 1
+        _evict()
+
+
+def _evict(limit=None):
+    # Must be called with _lock held
+    global _free_bytes
+    if limit is None:
+        limit = _max_bytes if _enabled else 0
+    while _free_bytes > limit:
+        nbytes, buffers = next(iter(_free.items()))
+        buffers.pop(0)
+        if not buffers:
+            del _free[nbytes]
+        _free_bytes -= nbytes
+        _statistics["released"] += 1
+
+
+def getStatistics():
+    """
+    Allocation statistics since the last reset, plus the current
+    "free_bytes" (unused buffers in the pool) and "outstanding_bytes" (arrays in use).
+    """
+    with _lock:
+        stats = dict(_statistics)
+        stats["free_bytes"] = _free_bytes
+        stats["outstanding_bytes"] = _outstanding_bytes
+    return stats
+
+
+def resetStatistics():
+    global _statistics
+    with _lock:
+        _statistics = _newStatistics()
+        _statistics["peak_outstanding_bytes"] = _outstanding_bytes
@@ -25,6 +25,7 @@ import logging
 import threading
 import sys
 import inspect
+import time
 
 from abc import ABCMeta
 from contextlib import contextmanager
@@ -32,6 +33,7 @@ from traceback import walk_tb, FrameSummary, format_list
 
 # lazyflow
 from lazyflow.slot import InputSlot, OutputSlot, Slot
+from lazyflow import operatorStatistics
 
 
 class InputDict(collections.OrderedDict):
@@ -240,6 +242,7 @@ class Operator(metaclass=OperatorMetaClass):
         self._condition = threading.Condition()
         self._executionCount = 0
         self._settingUp = False
+        self._statistics_key = None  # Assigned by lazyflow.operatorStatistics
 
         self._instantiate_slots()
 
@@ -583,6 +586,8 @@ class Operator(metaclass=OperatorMetaClass):
             )
 
     def call_execute(self, slot, subindex, roi, result, **kwargs):
+        if operatorStatistics.enabled:
+            return self._call_execute_with_statistics(slot, subindex, roi, result, **kwargs)
         try:
             # We are executing the operator. Incremement the execution
             # count to protect against simultaneous setupOutputs()
@@ -592,6 +597,19 @@ class Operator(metaclass=OperatorMetaClass):
         finally:
             self._decrementOperatorExecutionCount()
 
+    def _call_execute_with_statistics(self, slot, subindex, roi, result, **kwargs):
+        start = time.perf_counter()
+        try:
+            self._incrementOperatorExecutionCount()
+            result_op = self.execute(slot, subindex, roi, result, **kwargs)
+        finally:
+            self._decrementOperatorExecutionCount()
+        seconds = time.perf_counter() - start
+
+        produced = result if result_op is None else result_op
+        operatorStatistics.recordExecution(self, slot, seconds, getattr(produced, "nbytes", 0))
+        return result_op
+
     def execute(self, slot, subindex, roi, result):
         """ This method of the operator is called when a connected
         operator or an outside user of the graph wants to retrieve the
@@ -611,6 +629,29 @@ class Operator(metaclass=OperatorMetaClass):
 
         raise NotImplementedError("Operator {} does not implement" " execute()".format(self.name))
 
+    def isResident(self, slot, subindex, roi):
+        """Return True if the data for ``roi`` of the given output slot is
+        already available (e.g. stored in a cache), so that producing it
+        is cheap.
+
+        In that case, ``Slot.get()`` returns an inline request (see
+        ``Request.inline()``), which is executed in the context of the
+        caller when it is waited for.
+        The default implementation returns False.
+        """
+        return False
+
+    def readOnlyView(self, slot, subindex, roi):
+        """Return a read-only array with the data for ``roi`` of the given
+        output slot if it can be provided without computing or copying
+        anything (e.g. a view into a cache), otherwise None.
+
+        ``Slot.get()`` uses it for requests that don't write into a given
+        destination, to skip allocating and filling a result array.
+        The default implementation returns None.
+        """
+        return None
+
     def setInSlot(self, slot, subindex, roi, value):
         raise NotImplementedError(
             "Can't use __setitem__ with Operator {}" " because it doesn't implement" " setInSlot()".format(self.name)
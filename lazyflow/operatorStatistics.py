@@ -0,0 +1,299 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+"""
+Process-wide execution statistics per operator instance and output slot.
+
+Disabled by default.  While disabled, the only cost is one module attribute check per
+``Operator.execute()`` call (and per cache lookup).  While enabled, every execution of an
+operator's output slot records the wall time of ``execute()``, a histogram of those times,
+and the bytes produced.  Cache operators additionally report hits and misses.
+
+Example:
+
+>>> from lazyflow import operatorStatistics
+>>> operatorStatistics.enable()
+>>> # ... run your workflow ...
+>>> operatorStatistics.disable()
+>>> table = operatorStatistics.formatTable(sortBy="total_time", limit=20)
+>>> json_text = operatorStatistics.toJson()
+
+Note: The execution time is *inclusive*: it contains the time an operator spends waiting
+for its upstream operators.
+
+Every thread records into its own entries (no lock on the hot path); they are merged when
+the statistics are read.
+"""
+
+import itertools
+import json
+import math
+import threading
+
+#: Whether statistics are collected.  Use enable()/disable() to change it.
+enabled = False
+
+#: Execution times are collected in logarithmic buckets: bucket ``i`` counts times in
+#: ``[2**(i-1), 2**i)`` microseconds (bucket 0: below 1 microsecond; the last bucket is open-ended).
+NUM_HISTOGRAM_BUCKETS = 32
+
+# Protects _thread_entries, _generation and the assignment of operator keys
+_lock = threading.Lock()
+# The entries dict of every thread that recorded something since the last reset()
+_thread_entries = []
+# Incremented by reset(), so that threads start over with a new entries dict
+_generation = 0
+_local = threading.local()
+_operator_keys = itertools.count()
+
+
+class SlotStatistics(object):
+    """
+    Statistics of one output slot of one operator instance.
+    """
+
+    __slots__ = (
+        "operator_key",
+        "operator_name",
+        "operator_path",
+        "slot_name",
+        "calls",
+        "total_time",
+        "max_time",
+        "histogram",
+        "bytes",
+        "cache_hits",
+        "cache_misses",
+    )
+
+    def __init__(self, operator_key, operator_name, operator_path, slot_name):
+        self.operator_key = operator_key
+        self.operator_name = operator_name
+        self.operator_path = operator_path
+        self.slot_name = slot_name
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * NUM_HISTOGRAM_BUCKETS
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+    @property
+    def hit_ratio(self):
+        """
+        Fraction of cache lookups that were hits, or None if this is not a cache (or it wasn't accessed).
+        """
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else None
+
+    def copy(self):
+        other = SlotStatistics(self.operator_key, self.operator_name, self.operator_path, self.slot_name)
+        for name in self.__slots__[4:]:
+            setattr(other, name, getattr(self, name))
+        other.histogram = list(self.histogram)
+        return other
+
+    def merge(self, other):
+        """
+        Add the statistics of another entry for the same slot (recorded by another thread).
+        """
+        self.calls += other.calls
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        self.bytes += other.bytes
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+
+    def toDict(self):
+        d = {name: getattr(self, name) for name in self.__slots__}
+        d["mean_time"] = self.mean_time
+        d["hit_ratio"] = self.hit_ratio
+        return d
+
+    def __repr__(self):
+        return "<SlotStatistics {}.{}: {} calls, {:.3f}s>".format(
+            self.operator_path, self.slot_name, self.calls, self.total_time
+        )
+
+
+def histogramBucket(seconds):
+    """
+    Return the index of the histogram bucket for the given execution time.
+    """
+    microseconds = seconds * 1e6
+    if microseconds < 1.0:
+        return 0
+    # frexp(x) = (m, e) with x = m * 2**e and 0.5 <= m < 1, i.e. 2**(e-1) <= x < 2**e
+    return min(math.frexp(microseconds)[1], NUM_HISTOGRAM_BUCKETS - 1)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def isEnabled():
+    return enabled
+
+
+def reset():
+    """
+    Discard all collected statistics.
+    """
+    global _thread_entries, _generation
+    with _lock:
+        _thread_entries = []
+        _generation += 1
+
+
+def _operator_path(operator):
+    names = []
+    while operator is not None:
+        names.append(operator.name)
+        operator = operator.parent
+    return "/".join(reversed(names))
+
+
+def _get_thread_entries():
+    entries = getattr(_local, "entries", None)
+    if entries is None or _local.generation != _generation:
+        entries = _local.entries = {}
+        with _lock:
+            _local.generation = _generation
+            _thread_entries.append(entries)
+    return entries
+
+
+def _get_entry(operator, slot_name):
+    # Returns the entry of the calling thread
+    operator_key = operator._statistics_key
+    if operator_key is None:
+        with _lock:
+            if operator._statistics_key is None:
+                operator._statistics_key = next(_operator_keys)
+        operator_key = operator._statistics_key
+    key = (operator_key, slot_name)
+    entries = _get_thread_entries()
+    entry = entries.get(key)
+    if entry is None:
+        entry = entries[key] = SlotStatistics(operator_key, operator.name, _operator_path(operator), slot_name)
+    return entry
+
+
+def recordExecution(operator, slot, seconds, nbytes):
+    """
+    Record one (successful) execution of the given output slot.  Called by ``Operator.call_execute()``.
+    """
+    entry = _get_entry(operator, slot.name)
+    entry.calls += 1
+    entry.total_time += seconds
+    entry.max_time = max(entry.max_time, seconds)
+    entry.histogram[histogramBucket(seconds)] += 1
+    entry.bytes += nbytes
+
+
+def recordCacheAccess(operator, slot, hit):
+    """
+    Record a cache lookup for the given output slot of a cache operator.
+    Cheap no-op while statistics are disabled.
+    """
+    if not enabled:
+        return
+    entry = _get_entry(operator, slot.name)
+    if hit:
+        entry.cache_hits += 1
+    else:
+        entry.cache_misses += 1
+
+
+def getStatistics(sortBy="total_time"):
+    """
+    Return a snapshot of all entries, as a list of :py:class:`SlotStatistics`,
+    sorted by the given attribute (descending), e.g. 'total_time', 'calls', 'bytes' or 'mean_time'.
+    """
+    with _lock:
+        thread_entries = list(_thread_entries)
+    merged = {}
+    for entries in thread_entries:
+        # (Other threads may add entries meanwhile, so iterate over a copy.)
+        for key, entry in list(entries.items()):
+            if key in merged:
+                merged[key].merge(entry)
+            else:
+                merged[key] = entry.copy()
+    entries = list(merged.values())
+    if sortBy is not None:
+        entries.sort(key=lambda entry: getattr(entry, sortBy), reverse=True)
+    return entries
+
+
+def formatTable(sortBy="total_time", limit=None):
+    """
+    Return the statistics as a human-readable table.
+    """
+    entries = getStatistics(sortBy)
+    if limit is not None:
+        entries = entries[:limit]
+
+    header = ("operator", "slot", "calls", "total [s]", "mean [ms]", "max [ms]", "MB", "hit ratio")
+    rows = []
+    for entry in entries:
+        hit_ratio = entry.hit_ratio
+        rows.append(
+            (
+                entry.operator_path,
+                entry.slot_name,
+                str(entry.calls),
+                "{:.3f}".format(entry.total_time),
+                "{:.3f}".format(entry.mean_time * 1e3),
+                "{:.3f}".format(entry.max_time * 1e3),
+                "{:.1f}".format(entry.bytes / 2.0**20),
+                "-" if hit_ratio is None else "{:.1%}".format(hit_ratio),
+            )
+        )
+
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    lines = []
+    for row in [header] + rows:
+        # Left-align the names, right-align the numbers
+        cells = [row[0].ljust(widths[0]), row[1].ljust(widths[1])]
+        cells += [cell.rjust(width) for cell, width in zip(row[2:], widths[2:])]
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+def toJson(sortBy="total_time", **kwargs):
+    """
+    Return the statistics as a JSON list of objects.  Extra keyword arguments are passed to ``json.dumps``.
+    """
+    return json.dumps([entry.toDict() for entry in getStatistics(sortBy)], **kwargs)
@@ -0,0 +1,281 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+"""
+Eviction policies for the cache memory manager.
+
+A policy keeps an incrementally updated ranking of all cache blocks that are
+reported to it, so that the memory manager can ask for the next block to
+evict without collecting and sorting every block of every cache.
+
+Block keys are opaque to the policies (the memory manager uses
+``(id(cache), block_id)`` tuples).  Policies are not threadsafe; the memory
+manager serializes all calls.
+"""
+
+# Python
+import collections
+import heapq
+import itertools
+import time
+from abc import ABCMeta, abstractmethod
+
+
+class EvictionPolicy(metaclass=ABCMeta):
+    """
+    Interface for cache eviction policies.
+    """
+
+    @abstractmethod
+    def blockAccessed(self, key, size, computeTime=None):
+        """
+        record that a block was stored in or read from a cache
+
+        :param key: hashable id of the block
+        :param size: memory used by the block, in bytes
+        :param computeTime: seconds it took to compute the block upstream
+                            (only known when the block is stored)
+        """
+
+    @abstractmethod
+    def blockRemoved(self, key):
+        """
+        forget about a block that was freed by its cache
+
+        Unknown keys (e.g. blocks that were already returned by popVictim())
+        must be ignored.
+        """
+
+    @abstractmethod
+    def popVictim(self):
+        """
+        remove the block that should be evicted next from the ranking and return its key
+
+        @return None if no blocks are known
+        """
+
+    @abstractmethod
+    def keys(self):
+        """
+        get a list of keys of all blocks that are currently ranked
+        """
+
+    def __len__(self):
+        return len(self.keys())
+
+
+class _BlockStats(object):
+    __slots__ = ("size", "computeTime", "accessCount", "lastAccessTime", "entry")
+
+    def __init__(self):
+        self.size = 0
+        self.computeTime = None
+        self.accessCount = 0
+        self.lastAccessTime = 0.0
+        self.entry = None
+
+
+class HeapEvictionPolicy(EvictionPolicy):
+    """
+    Base class for policies that rank blocks by a scalar priority (lowest is evicted first).
+
+    Each access pushes a new heap entry and invalidates the previous one;
+    stale entries are skipped when popping and dropped when the heap is compacted.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._heap = []
+        self._counter = itertools.count()
+        # Priority of the most recently evicted block, for policies with "aging"
+        self._inflation = 0.0
+
+    @abstractmethod
+    def _priority(self, stats):
+        """
+        compute the priority of a block from its statistics (lowest is evicted first)
+        """
+
+    def blockAccessed(self, key, size, computeTime=None):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _BlockStats()
+        else:
+            stats.entry[-1] = False
+
+        stats.size = size
+        if computeTime is not None:
+            stats.computeTime = computeTime
+        stats.accessCount += 1
+        stats.lastAccessTime = time.time()
+
+        stats.entry = [self._priority(stats), next(self._counter), key, True]
+        heapq.heappush(self._heap, stats.entry)
+
+        if len(self._heap) > 2 * len(self._stats) + 1024:
+            self._compact()
+
+    def blockRemoved(self, key):
+        stats = self._stats.pop(key, None)
+        if stats is not None:
+            stats.entry[-1] = False
+
+    def popVictim(self):
+        while self._heap:
+            priority, _, key, valid = heapq.heappop(self._heap)
+            if valid:
+                del self._stats[key]
+                self._inflation = max(self._inflation, priority)
+                return key
+        return None
+
+    def keys(self):
+        return list(self._stats.keys())
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[-1]]
+        heapq.heapify(self._heap)
+
+
+class LRUEvictionPolicy(HeapEvictionPolicy):
+    """
+    Evict the least recently used block first.
+    """
+
+    def _priority(self, stats):
+        return stats.lastAccessTime
+
+
+class LFUEvictionPolicy(HeapEvictionPolicy):
+    """
+    Evict the least frequently used block first.
+
+    Uses dynamic aging (LFU-DA): new blocks start at the priority of the most
+    recently evicted block, so that blocks which were popular a long time ago
+    can't stay in the cache forever.
+    """
+
+    def _priority(self, stats):
+        return self._inflation + stats.accessCount
+
+
+class CostAwareEvictionPolicy(HeapEvictionPolicy):
+    """
+    Evict the block that is cheapest to recompute per byte first.
+
+    This is the GreedyDual-Size-Frequency policy: the priority of a block is
+    ``inflation + accessCount * computeTime / size``.  Blocks that took long to
+    compute upstream (e.g. expensive features) are kept longer than cheap ones
+    (e.g. raw data) of the same size.  Blocks with unknown cost are treated as
+    if they took ``defaultComputeTime`` seconds to compute.
+    """
+
+    def __init__(self, defaultComputeTime=0.0):
+        super(CostAwareEvictionPolicy, self).__init__()
+        self._default_compute_time = defaultComputeTime
+
+    def _priority(self, stats):
+        cost = stats.computeTime if stats.computeTime is not None else self._default_compute_time
+        return self._inflation + stats.accessCount * cost / max(stats.size, 1)
+
+
+class ARCEvictionPolicy(EvictionPolicy):
+    """
+    Adaptive replacement (ARC-style) policy.
+
+    Blocks that were accessed only once live in a recency list (T1), blocks that
+    were accessed again are promoted to a frequency list (T2).  Evicted keys are
+    remembered in ghost lists (B1, B2).  When an evicted block is stored again,
+    a hit in B1 grows the byte budget of T1 and a hit in B2 shrinks it, so the
+    policy adapts to scans (favor T2) and to shifting working sets (favor T1).
+    """
+
+    def __init__(self, maxGhosts=10000):
+        self._t1 = collections.OrderedDict()
+        self._t2 = collections.OrderedDict()
+        self._b1 = collections.OrderedDict()
+        self._b2 = collections.OrderedDict()
+        self._t1_bytes = 0
+        self._t2_bytes = 0
+        self._b1_bytes = 0
+        self._b2_bytes = 0
+        # Target size of T1, in bytes
+        self._p = 0
+        self._max_ghosts = maxGhosts
+
+    def blockAccessed(self, key, size, computeTime=None):
+        if key in self._t1:
+            self._t1_bytes -= self._t1.pop(key)
+            self._t2[key] = size
+            self._t2_bytes += size
+        elif key in self._t2:
+            self._t2_bytes += size - self._t2[key]
+            self._t2[key] = size
+            self._t2.move_to_end(key)
+        elif key in self._b1:
+            self._b1_bytes -= self._b1.pop(key)
+            delta = size * max(self._b2_bytes / max(self._b1_bytes, 1), 1)
+            self._p = min(self._p + delta, self._t1_bytes + self._t2_bytes + size)
+            self._t2[key] = size
+            self._t2_bytes += size
+        elif key in self._b2:
+            self._b2_bytes -= self._b2.pop(key)
+            delta = size * max(self._b1_bytes / max(self._b2_bytes, 1), 1)
+            self._p = max(self._p - delta, 0)
+            self._t2[key] = size
+            self._t2_bytes += size
+        else:
+            self._t1[key] = size
+            self._t1_bytes += size
+
+    def blockRemoved(self, key):
+        if key in self._t1:
+            self._t1_bytes -= self._t1.pop(key)
+        elif key in self._t2:
+            self._t2_bytes -= self._t2.pop(key)
+
+    def popVictim(self):
+        if self._t1 and (self._t1_bytes > self._p or not self._t2):
+            key, size = self._t1.popitem(last=False)
+            self._t1_bytes -= size
+            self._remember(self._b1, key, size)
+            self._b1_bytes += size
+        elif self._t2:
+            key, size = self._t2.popitem(last=False)
+            self._t2_bytes -= size
+            self._remember(self._b2, key, size)
+            self._b2_bytes += size
+        else:
+            return None
+        return key
+
+    def keys(self):
+        return list(self._t1.keys()) + list(self._t2.keys())
+
+    def _remember(self, ghosts, key, size):
+        ghosts[key] = size
+        if len(ghosts) > self._max_ghosts:
+            _, forgotten = ghosts.popitem(last=False)
+            if ghosts is self._b1:
+                self._b1_bytes -= forgotten
+            else:
+                self._b2_bytes -= forgotten
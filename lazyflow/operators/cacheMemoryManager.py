@@ -23,6 +23,7 @@ from __future__ import division
 ###############################################################################
 
 # Python
+import collections
 import gc
 import threading
 import weakref
@@ -32,9 +33,11 @@ import warnings
 
 
 # lazyflow
+from lazyflow import bufferPool
 from lazyflow.utility import OrderedSignal
 from lazyflow.utility import log_exception
 from lazyflow.utility import Memory
+from lazyflow.operators.cacheEvictionPolicies import LRUEvictionPolicy
 
 
 import logging
@@ -72,10 +75,26 @@ class _CacheMemoryManager(threading.Thread):
 
     the interval is measured in seconds. Each change of refresh interval
     triggers cleanup.
+
+    Blocked caches report their block accesses to the manager (see
+    ManagedBlockedCache.reportBlockAccess()) without taking a lock.  The
+    cleanup thread passes the reports to an eviction policy (see
+    cacheEvictionPolicies.py), which keeps the blocks ranked.  Cleanup evicts blocks
+    in the order chosen by the policy, without collecting and sorting all
+    blocks.  Only if that is not enough, the remaining caches and blocks are
+    freed in least-recently-used order.  Unused buffers of the buffer pool
+    (see bufferPool.py) count towards the limit and are released before
+    any blocks are evicted.  The policy (LRU by default) can be
+    replaced at startup::
+
+        cache_mem_manager.setEvictionPolicy(CostAwareEvictionPolicy())
     """
 
     totalCacheMemory = OrderedSignal()
 
+    #: Queued block reports are passed to the eviction policy right away if there are more than this
+    max_queued_block_reports = 100000
+
     def __init__(self):
         threading.Thread.__init__(self)
         self.daemon = True
@@ -92,6 +111,16 @@ class _CacheMemoryManager(threading.Thread):
         self._refresh_interval = default_refresh_interval
         self._first_class_caches_lock = threading.Lock()
 
+        self._policy_lock = threading.Lock()
+        self._eviction_policy = LRUEvictionPolicy()
+        # id(cache) -> weakref, for caches that reported blocks to the eviction policy
+        self._tracked_caches = {}
+        # ids of tracked caches that have been garbage collected (appended by weakref callbacks)
+        self._dead_caches = []
+        # Block accesses and frees reported by caches, in order, until they are passed to the eviction policy
+        # (see _drainBlockReports).  Appending to a deque is threadsafe, so reporting doesn't take any lock.
+        self._block_reports = collections.deque()
+
         # maximum fraction of *allowed memory* used
         self._max_usage = 1.0
         # target usage fraction
@@ -153,6 +182,105 @@ class _CacheMemoryManager(threading.Thread):
         elif isinstance(cache, ManagedCache):
             self._managed_caches.add(cache)
 
+    def setEvictionPolicy(self, policy):
+        """
+        replace the eviction policy for blocks of managed blocked caches
+
+        Blocks that were reported to the previous policy are still freed by the
+        least-recently-used fallback, so this is best called at startup.
+        """
+        with self._policy_lock:
+            self._drainBlockReports()
+            self._eviction_policy = policy
+            self._tracked_caches = {}
+
+    def reportBlockAccess(self, cache, block_id, size, computeTime=None):
+        """
+        tell the eviction policy that a block of a managed blocked cache was stored or read
+
+        The access is queued and passed to the eviction policy by the cleanup thread,
+        so concurrent cache hits don't serialize on the policy.
+
+        :param size: memory used by the block, in bytes
+        :param computeTime: seconds it took to compute the block upstream (if it was just computed)
+        """
+        # (weakref.ref() returns the same reference object for repeated calls)
+        self._block_reports.append((weakref.ref(cache), block_id, size, computeTime))
+        if len(self._block_reports) > self.max_queued_block_reports:
+            with self._policy_lock:
+                self._drainBlockReports()
+
+    def reportBlocksFreed(self, cache, block_ids):
+        """
+        tell the eviction policy that blocks of a managed blocked cache were freed
+        """
+        self._block_reports.append((id(cache), list(block_ids), None, None))
+
+    def _drainBlockReports(self):
+        """
+        Pass the queued block reports to the eviction policy.
+        Must be called with self._policy_lock held.
+        """
+        reports = self._block_reports
+        for _ in range(len(reports)):
+            cache, block, size, computeTime = reports.popleft()
+            if isinstance(cache, int):
+                # Blocks were freed
+                for block_id in block:
+                    self._eviction_policy.blockRemoved((cache, block_id))
+                continue
+
+            cache = cache()
+            if cache is None:
+                continue
+            cache_id = id(cache)
+            ref = self._tracked_caches.get(cache_id)
+            if ref is None or ref() is not cache:
+                if ref is not None:
+                    # A dead cache had the same id, forget its blocks
+                    self._discardCacheBlocks(cache_id)
+                dead_caches = self._dead_caches
+
+                def on_collected(ref, cache_id=cache_id):
+                    dead_caches.append(cache_id)
+
+                self._tracked_caches[cache_id] = weakref.ref(cache, on_collected)
+            self._eviction_policy.blockAccessed((cache_id, block), size, computeTime)
+
+    def _discardCacheBlocks(self, cache_id):
+        """
+        Remove all blocks of the given cache from the eviction policy.
+        Must be called with self._policy_lock held.
+        """
+        for key in self._eviction_policy.keys():
+            if key[0] == cache_id:
+                self._eviction_policy.blockRemoved(key)
+
+    def _popEvictionVictim(self):
+        """
+        get the next (cache, block_id) to evict from the eviction policy
+
+        @return None if the policy doesn't know any more blocks
+        """
+        with self._policy_lock:
+            self._drainBlockReports()
+            while self._dead_caches:
+                cache_id = self._dead_caches.pop()
+                ref = self._tracked_caches.get(cache_id)
+                if ref is not None and ref() is None:
+                    del self._tracked_caches[cache_id]
+                    self._discardCacheBlocks(cache_id)
+
+            while True:
+                key = self._eviction_policy.popVictim()
+                if key is None:
+                    return None
+                cache_id, block_id = key
+                ref = self._tracked_caches.get(cache_id)
+                cache = ref() if ref is not None else None
+                if cache is not None:
+                    return cache, block_id
+
     def run(self):
         """
         main loop
@@ -173,6 +301,10 @@ class _CacheMemoryManager(threading.Thread):
         from lazyflow.operators.opCache import ObservableCache
 
         try:
+            # rank the blocks that were accessed since the last cleanup
+            with self._policy_lock:
+                self._drainBlockReports()
+
             # notify subscribed functions about current cache memory
             total = 0
 
@@ -186,6 +318,9 @@ class _CacheMemoryManager(threading.Thread):
             self.totalCacheMemory(total)
             cache = None
 
+            # Unused buffers of the buffer pool count towards the cache budget
+            total += bufferPool.freeBytes()
+
             # check current memory state
             cache_memory = Memory.getAvailableRamCaches()
             cache_pct = 0.0
@@ -204,16 +339,37 @@ class _CacheMemoryManager(threading.Thread):
             if total <= self._max_usage * cache_memory:
                 return
 
+            # Unused pool buffers are released first, they are cheap to allocate again
+            mem = bufferPool.trim()
+            if mem:
+                logger.debug(f"Released unused pool buffers ({Memory.format(mem)})")
+            total -= mem
+
+            # Evict blocks in the order chosen by the eviction policy
+            while total > self._target_usage * cache_memory:
+                victim = self._popEvictionVictim()
+                if victim is None:
+                    break
+                cache, blockKey = victim
+                mem = cache.freeBlock(blockKey)
+                logger.debug(f"Cleaned up {cache.name}: {blockKey} ({Memory.format(mem)})")
+                total -= mem
+            victim = None
+            cache = None
+
+            # Fallback: free unblocked caches and blocks unknown to the policy in least-recently-used order
             cache_entries = []
-            cache_entries += [
-                (cache.lastAccessTime(), cache.name, cache.freeMemory) for cache in list(self._managed_caches)
-            ]
-            cache_entries += [
-                (lastAccessTime, f"{cache.name}: {blockKey}", functools.partial(cache.freeBlock, blockKey))
-                for cache in list(self._managed_blocked_caches)
-                for blockKey, lastAccessTime in cache.getBlockAccessTimes()
-            ]
-            cache_entries.sort(key=lambda entry: entry[0])
+            cleanupFun = None
+            if total > self._target_usage * cache_memory:
+                cache_entries += [
+                    (cache.lastAccessTime(), cache.name, cache.freeMemory) for cache in list(self._managed_caches)
+                ]
+                cache_entries += [
+                    (lastAccessTime, f"{cache.name}: {blockKey}", functools.partial(cache.freeBlock, blockKey))
+                    for cache in list(self._managed_blocked_caches)
+                    for blockKey, lastAccessTime in cache.getBlockAccessTimes()
+                ]
+                cache_entries.sort(key=lambda entry: entry[0])
 
             for lastAccessTime, info, cleanupFun in cache_entries:
                 if total <= self._target_usage * cache_memory:
@@ -300,3 +456,15 @@ def addFirstClassCache(cache):
 
 def setRefreshInterval(seconds):
     _cache_memory_manager.setRefreshInterval(seconds)
+
+
+def setEvictionPolicy(policy):
+    _cache_memory_manager.setEvictionPolicy(policy)
+
+
+def reportBlockAccess(cache, block_id, size, computeTime=None):
+    _cache_memory_manager.reportBlockAccess(cache, block_id, size, computeTime)
+
+
+def reportBlocksFreed(cache, block_ids):
+    _cache_memory_manager.reportBlocksFreed(cache, block_ids)
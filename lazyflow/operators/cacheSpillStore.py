@@ -0,0 +1,190 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Disk tier for array caches.
+
+Blocks that are evicted from a cache's memory can be spilled into a
+DiskSpillStore, which keeps them as ``.npy`` files in a scratch directory.
+If the block is needed again, it is read back from disk (a cheap sequential
+read) instead of being recomputed upstream.
+"""
+
+# Python
+import collections
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+# SciPy
+import numpy
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DiskSpillStore(object):
+    """
+    Stores arrays in ``.npy`` files in a private scratch directory, up to a size budget.
+
+    When storing a block would exceed the budget, the least recently used
+    blocks are deleted from disk.  Blocks are read back as read-only memory
+    maps.  The scratch directory is removed when the store is closed or
+    garbage collected.
+
+    Threadsafe.
+    """
+
+    def __init__(self, maxBytes, directory=None):
+        """
+        :param maxBytes: maximum number of bytes to keep on disk
+        :param directory: parent directory of the scratch directory (defaults to the system temp directory)
+        """
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._directory = tempfile.mkdtemp(prefix="lazyflow-spill-", dir=directory or None)
+        self._max_bytes = maxBytes
+        self._lock = threading.Lock()
+        # key -> (filename, nbytes), in least-recently-used order
+        self._entries = collections.OrderedDict()
+        self._used_bytes = 0
+        self._file_counter = itertools.count()
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self._directory, True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def maxBytes(self):
+        return self._max_bytes
+
+    def usedBytes(self):
+        return self._used_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def put(self, key, data):
+        """
+        write an array to disk
+
+        If the key is already stored, it is only marked as recently used
+        (blocks in a cache are never modified, only invalidated via discard()).
+
+        @return True if the array is stored on disk afterwards
+        """
+        if isinstance(data, numpy.ma.MaskedArray):
+            # The mask would be lost
+            return False
+        data = numpy.asarray(data)
+        nbytes = data.nbytes
+        if nbytes > self._max_bytes or data.dtype.hasobject:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True
+            filename = os.path.join(self._directory, "block-{}.npy".format(next(self._file_counter)))
+
+        try:
+            numpy.save(filename, data, allow_pickle=False)
+        except (OSError, ValueError):
+            logger.warning("Could not spill block {} to {}".format(key, filename), exc_info=True)
+            self._remove_file(filename)
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                # Somebody else stored the same block while we were writing
+                self._remove_file(filename)
+                self._entries.move_to_end(key)
+                return True
+
+            self._entries[key] = (filename, nbytes)
+            self._used_bytes += nbytes
+            while self._used_bytes > self._max_bytes:
+                _, (old_filename, old_nbytes) = self._entries.popitem(last=False)
+                self._used_bytes -= old_nbytes
+                self._remove_file(old_filename)
+        return True
+
+    def get(self, key):
+        """
+        get a read-only memory map of a stored array
+
+        @return None if the key is not stored
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            # Open the file while holding the lock, so it can't be deleted under our feet.
+            # (The mapping stays valid after the file is unlinked.)
+            return numpy.load(entry[0], mmap_mode="r", allow_pickle=False)
+
+    def discard(self, key):
+        """
+        delete a stored array (if it exists)
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._used_bytes -= entry[1]
+                self._remove_file(entry[0])
+
+    def clear(self):
+        with self._lock:
+            for filename, _ in self._entries.values():
+                self._remove_file(filename)
+            self._entries.clear()
+            self._used_bytes = 0
+
+    def close(self):
+        """
+        delete all stored arrays and the scratch directory
+        """
+        with self._lock:
+            self._entries.clear()
+            self._used_bytes = 0
+        self._cleanup()
+
+    @staticmethod
+    def _remove_file(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
@@ -0,0 +1,240 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Pixel features assembled from shared Gaussian derivative images.
+
+The feature operators in filterOperators each make their own vigra call, and each call does its own
+separable convolution passes, although e.g. the Hessian eigenvalues and the Laplacian of Gaussian
+of a scale need the same second derivatives, and the gradient magnitude and the structure tensor the
+same first derivatives.  :py:class:`GaussianDerivatives` computes the derivative images of one image
+at one scale and shares the 1d passes between them: derivatives that only differ in their orders for
+the leading axes reuse the passes along the trailing axes.  The features are then computed from the
+derivative images with numpy, and the eigenvalues of the Hessian and structure tensor with vigra's
+tensorEigenvalues.
+
+The 1d passes are vigra's (convolveOneDimension with the Gaussian kernels of the filter functions),
+so the results agree with the vigra filter functions up to float rounding.
+"""
+
+from functools import partial
+
+import numpy
+import vigra
+
+from lazyflow.request import Request, RequestPool
+
+#: Feature ids (see OpPixelFeaturesPresmoothed.FeatureIds) that can be computed from shared derivatives
+SUPPORTED_FEATURES = (
+    "GaussianSmoothing",
+    "LaplacianOfGaussian",
+    "GaussianGradientMagnitude",
+    "DifferenceOfGaussians",
+    "StructureTensorEigenvalues",
+    "HessianOfGaussianEigenvalues",
+)
+
+
+def gaussianKernel(sigma, order, window_size):
+    """
+    vigra's Gaussian (derivative) kernel, as used by the filter functions (reflective border treatment).
+    """
+    kernel = vigra.filters.Kernel1D()
+    if order == 0:
+        kernel.initGaussian(sigma, 1.0, window_size)
+    else:
+        kernel.initGaussianDerivative(sigma, order, 1.0, window_size)
+    return kernel
+
+
+def convolveAxis(image, axis, kernel):
+    """
+    Convolve along one axis of the (up to 3d, single channel) image with the given vigra.filters.Kernel1D.
+    """
+    # Tagged such that vigra's axis order is the order of the array, so dimension `axis` is the array's axis.
+    tagged = vigra.taggedView(numpy.require(image, dtype=numpy.float32)[..., numpy.newaxis], "xyz"[: image.ndim] + "c")
+    result = vigra.filters.convolveOneDimension(tagged, axis, kernel)
+    return result.withAxes(*"xyz"[: image.ndim]).view(numpy.ndarray)
+
+
+class GaussianDerivatives(object):
+    """
+    Gaussian derivative images of one image at one scale, over the given axes (the other axes
+    are processed independently, e.g. z when filtering a stack in 2d).
+    The 1d convolution passes are cached, so every pass is done at most once.
+    """
+
+    def __init__(self, image, sigma, axes, window_size):
+        self.image = numpy.require(image, dtype=numpy.float32)
+        self.sigma = sigma
+        self.axes = tuple(axes)
+        self.window_size = window_size
+        self._kernels = {}
+        self._passes = {}
+
+    @property
+    def ndim(self):
+        return len(self.axes)
+
+    def _kernel(self, sigma, order):
+        key = (sigma, order)
+        if key not in self._kernels:
+            self._kernels[key] = gaussianKernel(sigma, order, self.window_size)
+        return self._kernels[key]
+
+    def derivative(self, orders, sigma=None):
+        """
+        The derivative with the given order per axis (e.g. (0, 1, 1) for d^2/dy dx in 3d).
+        """
+        assert len(orders) == self.ndim
+        sigma = self.sigma if sigma is None else sigma
+        # Convolve along the last axis first: derivatives that only differ in their leading orders share passes.
+        for i in reversed(range(self.ndim)):
+            self._pass((sigma, tuple(orders[i:])))
+        return self._passes[(sigma, tuple(orders))]
+
+    def _pass(self, key):
+        """
+        The pass along axis ndim - len(orders), for the key (sigma, orders of this and the following axes).
+        """
+        if key not in self._passes:
+            sigma, orders = key
+            source = self.image if len(orders) == 1 else self._passes[(sigma, orders[1:])]
+            axis = self.axes[self.ndim - len(orders)]
+            self._passes[key] = convolveAxis(source, axis, self._kernel(sigma, orders[0]))
+        return self._passes[key]
+
+    def precompute(self, derivatives):
+        """
+        Compute the given derivatives (a list of (orders, sigma)) in parallel:
+        the passes along each axis only depend on the passes along the following axis,
+        so all passes along one axis run concurrently.
+        """
+        for length in range(1, self.ndim + 1):
+            keys = {(sigma, tuple(orders[-length:])) for orders, sigma in derivatives}
+            keys = [key for key in keys if key not in self._passes]
+            if len(keys) == 1:
+                self._pass(keys[0])
+            elif keys:
+                pool = RequestPool()
+                for key in keys:
+                    pool.add(Request(partial(self._pass, key)))
+                pool.wait()
+
+    def _unit(self, *axis_indices):
+        orders = [0] * self.ndim
+        for i in axis_indices:
+            orders[i] += 1
+        return tuple(orders)
+
+    def smoothed(self, sigma=None):
+        return self.derivative((0,) * self.ndim, sigma)
+
+    def gradient(self):
+        return [self.derivative(self._unit(i)) for i in range(self.ndim)]
+
+    def hessian(self):
+        """
+        The second derivatives, as a dict (i, j) -> image for i <= j
+        """
+        return {(i, j): self.derivative(self._unit(i, j)) for i in range(self.ndim) for j in range(i, self.ndim)}
+
+    def smooth(self, image, sigma):
+        """
+        Gaussian smoothing of another image (of the same shape) over our axes.
+        """
+        for axis in reversed(self.axes):
+            image = convolveAxis(image, axis, self._kernel(sigma, 0))
+        return image
+
+
+def _symmetricEigenvalues(entries, axes):
+    """
+    Eigenvalues (in descending order) of the symmetric matrices given as dict (i, j) -> image for i <= j,
+    over the given axes of the images (the other axes are processed independently),
+    as array of shape (ndim,) + image shape.
+    """
+    ndim = len(axes)
+    batch_axes = [axis for axis in range(entries[(0, 0)].ndim) if axis not in axes]
+    # vigra's tensor layout: the upper triangle of the matrix, row by row, in the channel axis
+    tensor = numpy.stack([entries[(i, j)] for i in range(ndim) for j in range(i, ndim)], axis=-1)
+    tensor = numpy.moveaxis(tensor, batch_axes, range(len(batch_axes)))
+    eigenvalues = numpy.empty(tensor.shape[:-1] + (ndim,), dtype=numpy.float32)
+    for index in numpy.ndindex(*tensor.shape[: len(batch_axes)]):
+        # Tagged such that vigra's axis order is the order of the array, as in convolveAxis()
+        tagged = vigra.taggedView(tensor[index], "xyz"[:ndim] + "c")
+        eigenvalues[index] = vigra.filters.tensorEigenvalues(tagged).withAxes(*"xyz"[:ndim], "c")
+    eigenvalues = numpy.moveaxis(eigenvalues, range(len(batch_axes)), batch_axes)
+    return numpy.moveaxis(eigenvalues, -1, 0)
+
+
+def requiredDerivatives(featureId, derivatives, **params):
+    """
+    The derivatives that computeFeature() needs for the given feature, as list of (orders, sigma)
+    (see GaussianDerivatives.precompute()).
+    """
+    d = derivatives
+    zero = (0,) * d.ndim
+    if featureId == "GaussianSmoothing":
+        return [(zero, d.sigma)]
+    elif featureId == "DifferenceOfGaussians":
+        return [(zero, d.sigma), (zero, params["sigma1"])]
+    elif featureId in ("GaussianGradientMagnitude", "StructureTensorEigenvalues"):
+        return [(d._unit(i), d.sigma) for i in range(d.ndim)]
+    elif featureId == "LaplacianOfGaussian":
+        return [(d._unit(i, i), d.sigma) for i in range(d.ndim)]
+    elif featureId == "HessianOfGaussianEigenvalues":
+        return [(d._unit(i, j), d.sigma) for i in range(d.ndim) for j in range(i, d.ndim)]
+    else:
+        raise ValueError("Unsupported feature: {}".format(featureId))
+
+
+def computeFeature(featureId, derivatives, **params):
+    """
+    Compute a feature from the shared derivatives.
+    The parameters are those of the corresponding filter operator
+    (e.g. sigma0 and sigma1 for DifferenceOfGaussians), the first of them must be derivatives.sigma.
+
+    Returns an array of shape (channels,) + image shape.
+    """
+    d = derivatives
+    if featureId == "GaussianSmoothing":
+        return d.smoothed()[None]
+    elif featureId == "LaplacianOfGaussian":
+        return sum(d.derivative(d._unit(i, i)) for i in range(d.ndim))[None]
+    elif featureId == "GaussianGradientMagnitude":
+        return numpy.sqrt(sum(g * g for g in d.gradient()))[None]
+    elif featureId == "DifferenceOfGaussians":
+        return (d.smoothed() - d.smoothed(params["sigma1"]))[None]
+    elif featureId == "HessianOfGaussianEigenvalues":
+        return _symmetricEigenvalues(d.hessian(), d.axes)
+    elif featureId == "StructureTensorEigenvalues":
+        gradient = d.gradient()
+        tensor = {
+            (i, j): d.smooth(gradient[i] * gradient[j], params["outerScale"])
+            for i in range(d.ndim)
+            for j in range(i, d.ndim)
+        }
+        return _symmetricEigenvalues(tensor, d.axes)
+    else:
+        raise ValueError("Unsupported feature: {}".format(featureId))
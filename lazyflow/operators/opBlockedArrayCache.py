@@ -49,6 +49,9 @@ class OpBlockedArrayCache(Operator, ManagedBlockedCache):
     # If not provided, will be set to Input.meta.shape
     BypassModeEnabled = InputSlot(value=False)
     CompressionEnabled = InputSlot(value=False)
+    SpillBudget = InputSlot(value=0)  # Bytes of disk space for blocks evicted from RAM (0 disables the disk tier)
+    SpillDirectory = InputSlot(value="")  # Where to create the scratch directory for spilled blocks ('' means tmp)
+    ZeroCopyEnabled = InputSlot(value=False)  # If True, cache hits may be returned as read-only views (no copy)
 
     Output = OutputSlot(allow_mask=True)
     CleanBlocks = OutputSlot()  # A list of slicings indicating which blocks are stored in the cache and clean.
@@ -75,6 +78,9 @@ class OpBlockedArrayCache(Operator, ManagedBlockedCache):
         self._opSimpleBlockedArrayCache = OpSimpleBlockedArrayCache(parent=self)
         self._opSimpleBlockedArrayCache.Input.connect(self._opCacheFixer.Output)
         self._opSimpleBlockedArrayCache.CompressionEnabled.connect(self.CompressionEnabled)
+        self._opSimpleBlockedArrayCache.SpillBudget.connect(self.SpillBudget)
+        self._opSimpleBlockedArrayCache.SpillDirectory.connect(self.SpillDirectory)
+        self._opSimpleBlockedArrayCache.ZeroCopyEnabled.connect(self.ZeroCopyEnabled)
         self._opSimpleBlockedArrayCache.Input.connect(self._opCacheFixer.Output)
         self._opSimpleBlockedArrayCache.BlockShape.connect(self.BlockShape)
         self._opSimpleBlockedArrayCache.BypassModeEnabled.connect(self.BypassModeEnabled)
@@ -201,6 +201,26 @@ class ManagedBlockedCache(ManagedCache):
         """
         raise NotImplementedError("No default implementation for freeBlock()")
 
+    def reportBlockAccess(self, block_id, size, computeTime=None):
+        """
+        tell the memory manager that a block was stored or read
+
+        Caches should call this whenever a block is stored or served, so that
+        the eviction policy of the memory manager can rank the block without
+        polling getBlockAccessTimes().
+
+        @param size memory used by the block in bytes
+        @param computeTime seconds it took to compute the block upstream
+                           (pass it when the block has just been computed)
+        """
+        cacheMemoryManager.reportBlockAccess(self, block_id, size, computeTime)
+
+    def reportBlocksFreed(self, block_ids):
+        """
+        tell the memory manager that blocks were removed from the cache
+        """
+        cacheMemoryManager.reportBlocksFreed(self, block_ids)
+
 
 class MemInfoNode(object):
     """
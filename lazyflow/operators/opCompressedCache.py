@@ -42,6 +42,7 @@ from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.roi import TinyVector, getIntersectingBlocks, getBlockBounds, roiToSlice, getIntersection
 from lazyflow.operators.opCache import ManagedBlockedCache
 from lazyflow.utility.chunkHelpers import chooseChunkShape
+from lazyflow.utility.compressedArray import CompressedArray
 
 logger = logging.getLogger(__name__)
 
@@ -52,12 +53,27 @@ def get_storage_size(h5dataset):
 
     (shorthand for the hidden h5py functionality)
     """
+    if isinstance(h5dataset, CompressedArray):
+        return h5dataset.storage_size
     return h5py.h5d.DatasetID.get_storage_size(h5dataset.id)
 
 
+class _CodecBlock(dict):
+    """
+    Takes the place of a block's in-memory hdf5 file if the cache uses a Codec:
+    "data" (and "mask" for masked data) are CompressedArrays, "fill_value" is a 0-d numpy array.
+    """
+
+    def close(self):
+        self.clear()
+
+
 class OpUnmanagedCompressedCache(Operator):
     """
     A blockwise cache that stores each block as a separate in-memory hdf5 file with a compressed dataset.
+    Alternatively (if the Codec slot is given), each block is stored as chunks of compressed bytes
+    (see lazyflow.utility.compressedArray), which avoids the global hdf5 lock and lets chunks be
+    (de)compressed in parallel.
 
     The files for each block have an internal chunk-shape, which corresponds to
     the amount of data that has to be decompressed for a single pixel lookup.
@@ -83,6 +99,10 @@ class OpUnmanagedCompressedCache(Operator):
     # shape of internal in-memory hdf5 files (defaults to the whole volume)
     BlockShape = InputSlot(optional=True)
 
+    # name of a codec from lazyflow.utility.compressionCodecs (if not given, in-memory hdf5 files are used)
+    # If the codec is changed, all cache data is lost.
+    Codec = InputSlot(optional=True)
+
     # Output as numpy arrays
     Output = OutputSlot(allow_mask=True)
 
@@ -95,18 +115,37 @@ class OpUnmanagedCompressedCache(Operator):
     def __init__(self, *args, **kwargs):
         super(OpUnmanagedCompressedCache, self).__init__(*args, **kwargs)
         self._lock = RequestLock()
+        self._cacheFiles = {}
+        self._codec = None
         self._init_cache(None)
         self._block_id_counter = itertools.count()  # Used to ensure unique in-memory file names
         self._ignore_ideal_blockshape = False
 
     def _init_cache(self, new_blockshape):
         with self._lock:
+            freed_blocks = list(self._cacheFiles.keys())
             self._blockshape = new_blockshape
             self._cacheFiles = {}
             self._dirtyBlocks = set()
             self._blockLocks = {}
             self._chunkshape = self._chooseChunkshape(self._blockshape)
             self._last_access_times = collections.defaultdict(float)
+        if freed_blocks:
+            self._onBlocksFreed(freed_blocks)
+
+    def _onBlockAccess(self, block_start, computeTime=None, stored=False):
+        """
+        Called whenever a block is read, or stored (with stored=True).
+        Does nothing here, see OpCompressedCache.
+        """
+        pass
+
+    def _onBlocksFreed(self, block_starts):
+        """
+        Called whenever blocks are removed from the cache.
+        Does nothing here, see OpCompressedCache.
+        """
+        pass
 
     def cleanUp(self):
         logger.debug("Cleaning up")
@@ -134,8 +173,13 @@ class OpUnmanagedCompressedCache(Operator):
         # Clip blockshape to image bounds
         new_blockshape = tuple(numpy.minimum(new_blockshape, self.Input.meta.shape))
 
-        if new_blockshape != self._blockshape:
-            # If the blockshape changes, we have to reset the entire cache.
+        new_codec = None
+        if self.Codec.ready():
+            new_codec = self.Codec.value
+
+        if new_blockshape != self._blockshape or new_codec != self._codec:
+            # If the blockshape (or the storage) changes, we have to reset the entire cache.
+            self._codec = new_codec
             self._init_cache(new_blockshape)
 
         self.Output.meta.ideal_blockshape = new_blockshape
@@ -181,33 +225,48 @@ class OpUnmanagedCompressedCache(Operator):
 
     def _copyData(self, roi, destination, block_starts):
         # Copy data from each block
-        # (Parallelism not needed here: h5py will serialize these requests anyway)
         logger.debug("Copying data from {} blocks...".format(len(block_starts)))
-        for block_start in block_starts:
-            entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
+        if self._codec is None:
+            # (Parallelism not needed here: h5py will serialize these requests anyway)
+            for block_start in block_starts:
+                self._copyBlockData(roi, destination, block_start)
+        else:
+            reqPool = RequestPool()
+            for block_start in block_starts:
+                reqPool.add(Request(partial(self._copyBlockData, roi, destination, block_start)))
+            reqPool.wait()
 
-            # This block's portion of the roi
-            intersecting_roi = getIntersection((roi.start, roi.stop), entire_block_roi)
+    def _copyBlockData(self, roi, destination, block_start):
+        entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
 
-            # Compute slicing within destination array and slicing within this block
-            destination_relative_intersection = numpy.subtract(intersecting_roi, roi.start)
-            block_relative_intersection = numpy.subtract(intersecting_roi, block_start)
-            destination_relative_intersection_slicing = roiToSlice(*destination_relative_intersection)
-            block_relative_intersection_slicing = roiToSlice(*block_relative_intersection)
+        # This block's portion of the roi
+        intersecting_roi = getIntersection((roi.start, roi.stop), entire_block_roi)
 
-            # Copy from block to destination
-            dataset = self._getBlockDataset(entire_block_roi)
-            if self.Output.meta.has_mask:
-                destination.data[destination_relative_intersection_slicing] = dataset["data"][
-                    block_relative_intersection_slicing
-                ]
-                destination.mask[destination_relative_intersection_slicing] = dataset["mask"][
-                    block_relative_intersection_slicing
-                ]
-                destination.fill_value = dataset["fill_value"][()]
-            else:
-                destination[destination_relative_intersection_slicing] = dataset[block_relative_intersection_slicing]
-            self._last_access_times[block_start] = time.time()
+        # Compute slicing within destination array and slicing within this block
+        destination_relative_intersection = numpy.subtract(intersecting_roi, roi.start)
+        block_relative_intersection = numpy.subtract(intersecting_roi, block_start)
+        destination_relative_intersection_slicing = roiToSlice(*destination_relative_intersection)
+        block_relative_intersection_slicing = roiToSlice(*block_relative_intersection)
+
+        # Copy from block to destination
+        dataset = self._getBlockDataset(entire_block_roi)
+        if self.Output.meta.has_mask:
+            destination.data[destination_relative_intersection_slicing] = dataset["data"][
+                block_relative_intersection_slicing
+            ]
+            destination.mask[destination_relative_intersection_slicing] = dataset["mask"][
+                block_relative_intersection_slicing
+            ]
+            destination.fill_value = dataset["fill_value"][()]
+        elif isinstance(dataset, CompressedArray):
+            # Decompress directly into the destination
+            dataset.readInto(
+                block_relative_intersection_slicing, destination[destination_relative_intersection_slicing]
+            )
+        else:
+            destination[destination_relative_intersection_slicing] = dataset[block_relative_intersection_slicing]
+        self._last_access_times[block_start] = time.time()
+        self._onBlockAccess(block_start)
 
     def _executeCleanBlocks(self, destination):
         """
@@ -241,9 +300,25 @@ class OpUnmanagedCompressedCache(Operator):
         self._ensureCached(block_roi)
         dataset = self._getBlockDataset(block_roi)
         assert str(block_roi) not in destination, "destination hdf5 group already has a dataset with this block's name"
-        destination.copy(dataset, str(block_roi))
+        if isinstance(dataset, (_CodecBlock, CompressedArray)):
+            self._exportBlock(dataset, destination, str(block_roi))
+        else:
+            destination.copy(dataset, str(block_roi))
         return destination
 
+    def _exportBlock(self, dataset, destination, name):
+        """
+        Write a block of the codec storage into the destination group
+        (in the same layout that the in-memory hdf5 files have).
+        """
+        if self.Output.meta.has_mask:
+            group = destination.create_group(name)
+            for each in ["data", "mask"]:
+                group.create_dataset(each, data=dataset[each][...], chunks=dataset[each].chunkshape, compression="lzf")
+            group.create_dataset("fill_value", data=dataset["fill_value"])
+        else:
+            destination.create_dataset(name, data=dataset[...], chunks=dataset.chunkshape, compression="lzf")
+
     def propagateDirty(self, slot, subindex, roi):
         if slot == self.Input:
             # Keep track of dirty blocks
@@ -259,6 +334,9 @@ class OpUnmanagedCompressedCache(Operator):
         elif slot == self.BlockShape:
             # Everything is dirty
             self.Output.setDirty(slice(None))
+        elif slot == self.Codec:
+            # The storage doesn't change the data
+            pass
         else:
             assert False, "Unknown output slot"
 
@@ -379,7 +457,10 @@ class OpUnmanagedCompressedCache(Operator):
             # uncompressed size
             unc += ds.size * self._getDtypeBytes(ds.dtype)
         if "mask" in group:
-            tot += group["mask"].size * self._getDtypeBytes(group["mask"].dtype)
+            if isinstance(group["mask"], CompressedArray):
+                tot += get_storage_size(group["mask"])
+            else:
+                tot += group["mask"].size * self._getDtypeBytes(group["mask"].dtype)
         if "fill_value" in group:
             tot += group["fill_value"].size * self._getDtypeBytes(group["fill_value"].dtype)
         return tot, unc
@@ -397,6 +478,12 @@ class OpUnmanagedCompressedCache(Operator):
                 # Create an in-memory hdf5 file with a unique name
                 # (the counter ensures that even blocks that have been deleted previously get a unique name when they are re-created).
                 logger.debug("Creating a cache file for block: {}".format(list(block_start)))
+                if self._codec is not None:
+                    self._blockLocks[block_start] = RequestLock()
+                    self._cacheFiles[block_start] = self._createCodecBlock(entire_block_roi)
+                    self._dirtyBlocks.add(block_start)
+                    return self._cacheFiles[block_start]
+
                 filename = (
                     str(id(self)) + str(id(self._cacheFiles)) + str(block_start) + str(next(self._block_id_counter))
                 )
@@ -425,6 +512,15 @@ class OpUnmanagedCompressedCache(Operator):
                 self._dirtyBlocks.add(block_start)
             return self._cacheFiles[block_start]
 
+    def _createCodecBlock(self, entire_block_roi):
+        datashape = tuple(entire_block_roi[1] - entire_block_roi[0])
+        block = _CodecBlock()
+        block["data"] = CompressedArray(datashape, self.Output.meta.dtype, self._chunkshape, self._codec)
+        if self.Output.meta.has_mask:
+            block["mask"] = CompressedArray(datashape, bool, self._chunkshape, self._codec)
+            block["fill_value"] = numpy.zeros((), dtype=self.Output.meta.dtype)
+        return block
+
     def _ensureCached(self, entire_block_roi):
         """
         Ensure that the cache file for the given block is up-to-date.
@@ -441,7 +537,9 @@ class OpUnmanagedCompressedCache(Operator):
                     # Can't write directly into the hdf5 dataset because
                     #  h5py.dataset.__getitem__ creates a copy, not a view.
                     # We must use a temporary numpy array to hold the data.
+                    start_time = time.time()
                     data = self.Input(*entire_block_roi).wait()
+                    compute_time = time.time() - start_time
                     block_file["data"][...] = data
                     if self.Output.meta.has_mask:
                         block_file["mask"][...] = data.mask
@@ -449,11 +547,11 @@ class OpUnmanagedCompressedCache(Operator):
 
                     if logger.isEnabledFor(logging.DEBUG):
                         uncompressed_size = numpy.prod(data.shape) * self._getDtypeBytes(data.dtype)
-                        storage_size = block_file["data"].id.get_storage_size()
+                        storage_size = get_storage_size(block_file["data"])
                         if "mask" in block_file:
-                            storage_size += block_file["mask"].id.get_storage_size()
-                        if "fill_value" in block_file:
-                            storage_size += block_file["fill_value"].id.get_storage_size()
+                            storage_size += get_storage_size(block_file["mask"])
+                        if "fill_value" in block_file and not isinstance(block_file, _CodecBlock):
+                            storage_size += get_storage_size(block_file["fill_value"])
                         logger.debug(
                             "Storage for block: {} is {}. ({}% of original)".format(
                                 block_start, storage_size, 100 * storage_size / uncompressed_size
@@ -461,6 +559,7 @@ class OpUnmanagedCompressedCache(Operator):
                         )
                     with self._lock:
                         self._dirtyBlocks.remove(block_start)
+                    self._onBlockAccess(block_start, compute_time, stored=True)
                     updated_cache = True
 
             if updated_cache:
@@ -524,6 +623,7 @@ class OpUnmanagedCompressedCache(Operator):
                     dataset["data"][block_relative_intersection_slicing] = new_block_data.data
                     dataset["mask"][block_relative_intersection_slicing] = new_block_data.mask
                     dataset["fill_value"][()] = new_block_data.fill_value
+                    self._onBlockAccess(block_start, stored=True)
 
                     # Untested. Write a test to use this.
                     # # If we can, remove this block entirely.
@@ -543,6 +643,9 @@ class OpUnmanagedCompressedCache(Operator):
                                 self._cacheFiles[block_start].close()
                                 del self._cacheFiles[block_start]
                             del self._blockLocks[block_start]
+                        self._onBlocksFreed([block_start])
+                    else:
+                        self._onBlockAccess(block_start, stored=True)
 
             # Here, we assume that if this function is used to update ANY PART of a
             #  block, he is responsible for updating the ENTIRE block.
@@ -582,13 +685,19 @@ class OpUnmanagedCompressedCache(Operator):
                     assert cachefile[each].shape == value[each].shape
 
                 for each in ["data", "mask", "fill_value"]:
-                    del cachefile[each]
-                    cachefile.copy(value[each], each)
+                    if isinstance(cachefile, _CodecBlock):
+                        cachefile[each][...] = value[each][()]
+                    else:
+                        del cachefile[each]
+                        cachefile.copy(value[each], each)
             else:
                 assert cachefile["data"].dtype == value.dtype
                 assert cachefile["data"].shape == value.shape
-                del cachefile["data"]
-                cachefile.copy(value, "data")
+                if isinstance(cachefile, _CodecBlock):
+                    cachefile["data"][...] = value[()]
+                else:
+                    del cachefile["data"]
+                    cachefile.copy(value, "data")
 
             block_start = tuple(roi.start)
             self._dirtyBlocks.discard(block_start)
@@ -618,6 +727,8 @@ class OpUnmanagedCompressedCache(Operator):
         """
         block_file = self._getCacheFile(entire_block_roi)
         if self.Output.meta.has_mask:
+            if isinstance(block_file, _CodecBlock):
+                return block_file
             return block_file["/"]
         else:
             return block_file["data"]
@@ -631,14 +742,41 @@ class OpUnmanagedCompressedCache(Operator):
         with self._lock:
             self._blockLocks = {}
             self._cacheFiles = {}
+        if cacheFiles:
+            self._onBlocksFreed(list(cacheFiles.keys()))
 
 
 class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
     def __init__(self, *args, **kwargs):
+        # block_start -> storage size of the block, measured when it is stored
+        self._block_storage_sizes = {}
         super(OpCompressedCache, self).__init__(*args, **kwargs)
         # Now that we're initialized, it's safe to register with the memory manager
         self.registerWithMemoryManager()
 
+    def _onBlockAccess(self, block_start, computeTime=None, stored=False):
+        """
+        Overridden from OpUnmanagedCompressedCache
+        """
+        # Reads use the size measured when the block was stored (asking hdf5 takes its global lock)
+        storage_size = None if stored else self._block_storage_sizes.get(block_start)
+        if storage_size is None:
+            try:
+                storage_size = get_storage_size(self._cacheFiles[block_start]["data"])
+            except (KeyError, ValueError):
+                # block was removed (and its file closed) in the meantime
+                return
+            self._block_storage_sizes[block_start] = storage_size
+        self.reportBlockAccess(block_start, storage_size, computeTime)
+
+    def _onBlocksFreed(self, block_starts):
+        """
+        Overridden from OpUnmanagedCompressedCache
+        """
+        for block_start in block_starts:
+            self._block_storage_sizes.pop(block_start, None)
+        self.reportBlocksFreed(block_starts)
+
     def fractionOfUsedMemoryDirty(self):
         tot = 0.0
         dirty = 0.0
@@ -694,7 +832,8 @@ class OpCompressedCache(OpUnmanagedCompressedCache, ManagedBlockedCache):
             with self._lock:
                 del self._cacheFiles[block_id]
                 del self._last_access_times[block_id]
-            return mem
+        self._onBlocksFreed([block_id])
+        return mem
 
     def getBlockAccessTimes(self):
         with self._lock:
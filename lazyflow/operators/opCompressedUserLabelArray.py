@@ -30,6 +30,7 @@ import collections
 # Third-party
 import numpy
 import vigra
+import h5py
 
 # Lazyflow
 from lazyflow.graph import InputSlot, OutputSlot
@@ -48,6 +49,73 @@ from lazyflow.rtype import SubRegion
 logger = logging.getLogger(__name__)
 
 
+class _SparseLabelBlock(object):
+    """
+    The non-zero pixels of one block of label data, as (sorted) flat indices within the block and their values.
+    Reading and writing only touches the stored and the given pixels, never the whole block.
+    """
+
+    def __init__(self, shape, dtype=numpy.uint8):
+        self.shape = tuple(shape)
+        self.indices = numpy.zeros((0,), dtype=numpy.int64)
+        self.values = numpy.zeros((0,), dtype=dtype)
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.values.nbytes
+
+    def read(self, start, stop):
+        """
+        Dense copy of the block-relative roi.
+        """
+        result = numpy.zeros(numpy.subtract(stop, start), dtype=self.values.dtype)
+        coords = numpy.unravel_index(self.indices, self.shape)
+        inside = numpy.ones(len(self.indices), dtype=bool)
+        for c, a, b in zip(coords, start, stop):
+            inside &= (c >= a) & (c < b)
+        result[tuple(c[inside] - a for c, a in zip(coords, start))] = self.values[inside]
+        return result
+
+    def write(self, start, pixels, eraser):
+        """
+        Write the non-zero pixels of the given array at the block-relative start (pixels with the eraser value
+        are removed).
+        """
+        nonzero = numpy.nonzero(pixels)
+        values = pixels[nonzero]
+        written = values != eraser
+        values = values.astype(self.values.dtype)
+        # numpy.nonzero() is in C order, so these are sorted (and unique), just like self.indices.
+        indices = numpy.ravel_multi_index(tuple(c + a for c, a in zip(nonzero, start)), self.shape)
+
+        # Where the given pixels are (or would be inserted) among the stored ones
+        positions = numpy.searchsorted(self.indices, indices)
+        found = positions < len(self.indices)
+        found[found] = self.indices[positions[found]] == indices[found]
+
+        stored_values = self.values.copy()
+        stored_values[positions[found & written]] = values[found & written]
+        keep = numpy.ones(len(self.indices), dtype=bool)
+        keep[positions[found & ~written]] = False
+
+        # Merge the new pixels in (numpy.insert() keeps the order of pixels inserted at the same position)
+        new = ~found & written
+        keep = numpy.insert(keep, positions[new], True)
+        self.indices = numpy.insert(self.indices, positions[new], indices[new])[keep]
+        self.values = numpy.insert(stored_values, positions[new], values[new])[keep]
+
+    def replace(self, data):
+        """
+        Replace the whole block with the given (dense) data.
+        """
+        assert data.shape == self.shape
+        self.indices = numpy.flatnonzero(data)
+        self.values = data.ravel()[self.indices].astype(self.values.dtype)
+
+
 class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     """
     A subclass of OpUnmanagedCompressedCache that is suitable for storing user-drawn label pixels.
@@ -62,6 +130,9 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     eraser = InputSlot()
     deleteLabel = InputSlot(optional=True)
     blockShape = InputSlot()  # If the blockshape is changed after labels have been stored, all cache data is lost.
+    # Store only the labeled pixels of each block instead of compressed dense blocks (not for masked data).
+    # Writes are proportional to the number of changed pixels then.
+    SparseStorage = InputSlot(value=False)
 
     # Output = OutputSlot()
     # nonzeroValues = OutputSlot()
@@ -84,6 +155,7 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     def __init__(self, *args, **kwargs):
         self._blockshape = None
         self._label_to_purge = 0
+        self._sparse = False
         super(OpCompressedUserLabelArray, self).__init__(*args, **kwargs)
 
         # ignoring the ideal chunk shape is ok because we use the input only
@@ -100,7 +172,21 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     def mergeLabels(self, from_label, into_label):
         self._purge_label(from_label, True, into_label)
 
+    def _init_cache(self, new_blockshape):
+        super(OpCompressedUserLabelArray, self)._init_cache(new_blockshape)
+        with self._lock:
+            # block start -> _SparseLabelBlock, if SparseStorage is used
+            self._sparseBlocks = {}
+
     def setupOutputs(self):
+        sparse = bool(self.SparseStorage.value) and not self.Input.meta.has_mask
+        if sparse != self._sparse:
+            if self._cacheFiles or self._sparseBlocks:
+                raise RuntimeError(
+                    "You are not permitted to change the label storage after you've already stored labels in it."
+                )
+            self._sparse = sparse
+
         # Due to a temporary naming clash, pass our subclass blockshape to the superclass
         # TODO: Fix this by renaming the BlockShape slots to be consistent.
         self.BlockShape.setValue(self.blockShape.value)
@@ -160,6 +246,10 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             value so the set of stored labels remains consecutive.
             Note that the decrement is performed AFTER replacement.
         """
+        if self._sparse:
+            self._purge_label_sparse(label_to_purge, decrement_remaining, replacement_value)
+            return
+
         changed_block_rois = []
         # stored_block_rois = self.CleanBlocks.value
         stored_block_roi_destination = [None]
@@ -193,6 +283,27 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             # FIXME: Shouldn't this dirty notification be handled in OpUnmanagedCompressedCache?
             self.Output.setDirty(*block_roi)
 
+    def _purge_label_sparse(self, label_to_purge, decrement_remaining, replacement_value):
+        changed_block_rois = []
+        with self._lock:
+            for block_start, block in list(self._sparseBlocks.items()):
+                values = block.values.copy()
+                values[block.values == label_to_purge] = replacement_value
+                if decrement_remaining:
+                    values[values > label_to_purge] -= numpy.uint8(1)
+                if (values == block.values).all():
+                    continue
+
+                nonzero = values != 0
+                block.indices = block.indices[nonzero]
+                block.values = values[nonzero]
+                if len(block) == 0:
+                    del self._sparseBlocks[block_start]
+                changed_block_rois.append(getBlockBounds(self.Output.meta.shape, self._blockshape, block_start))
+
+        for block_roi in changed_block_rois:
+            self.Output.setDirty(*block_roi)
+
     def execute(self, slot, subindex, roi, destination):
         if slot == self.Output:
             self._executeOutput(roi, destination)
@@ -200,6 +311,8 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             self._execute_nonzeroBlocks(destination)
         elif slot == self.Projection2D:
             self._executeProjection2D(roi, destination)
+        elif slot == self.OutputHdf5 and self._sparse:
+            self._executeOutputHdf5Sparse(roi, destination)
         else:
             return super(OpCompressedUserLabelArray, self).execute(slot, subindex, roi, destination)
 
@@ -215,6 +328,71 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
         self._copyData(roi, destination, block_starts)
         return destination
 
+    def _executeCleanBlocks(self, destination):
+        if not self._sparse:
+            return super(OpCompressedUserLabelArray, self)._executeCleanBlocks(destination)
+
+        with self._lock:
+            block_starts = list(self._sparseBlocks.keys())
+        block_rois = [getBlockBounds(self.Output.meta.shape, self._blockshape, start) for start in block_starts]
+        destination[0] = [[TinyVector(start), TinyVector(stop)] for start, stop in block_rois]
+        return destination
+
+    def _executeOutputHdf5Sparse(self, roi, destination):
+        assert isinstance(
+            destination, h5py.Group
+        ), "OutputHdf5 slot requires an hdf5 GROUP to copy into (not a numpy array)."
+        block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, roi.start)
+        assert (
+            block_roi == numpy.array((roi.start, roi.stop))
+        ).all(), "OutputHdf5 slot requires roi to be exactly one block."
+
+        name = str([roi.start, roi.stop])
+        assert name not in destination, "destination hdf5 group already has a dataset with this block's name"
+        data = self._readBlock(block_roi, roiToSlice(*numpy.subtract(block_roi, roi.start)))
+        chunkshape = tuple(numpy.minimum(data.shape, self._chunkshape))
+        destination.create_dataset(name, data=data, chunks=chunkshape, compression="lzf")
+        return destination
+
+    def _hasBlock(self, block_start):
+        if self._sparse:
+            return block_start in self._sparseBlocks
+        return block_start in self._cacheFiles
+
+    def _readBlock(self, entire_block_roi, block_relative_slicing):
+        """
+        The data of a stored block (within the given block-relative slicing)
+        """
+        if self._sparse:
+            block_start = tuple(entire_block_roi[0])
+            start = [s.start for s in block_relative_slicing]
+            stop = [s.stop for s in block_relative_slicing]
+            with self._lock:
+                block = self._sparseBlocks.get(block_start)
+                if block is None:
+                    # Block was removed in the meantime (all of its labels were erased)
+                    return numpy.zeros(numpy.subtract(stop, start), dtype=self.Output.meta.dtype)
+                return block.read(start, stop)
+
+        block = self._getBlockDataset(entire_block_roi)
+        if self.Output.meta.has_mask:
+            return numpy.ma.masked_array(
+                block["data"][block_relative_slicing],
+                mask=block["mask"][block_relative_slicing],
+                fill_value=block["fill_value"][()],
+                shrink=False,
+            )
+        return block[block_relative_slicing]
+
+    def _usedMemory(self):
+        if not self._sparse:
+            return super(OpCompressedUserLabelArray, self)._usedMemory()
+        with self._lock:
+            blocks = list(self._sparseBlocks.values())
+        tot = sum(block.nbytes for block in blocks)
+        unc = sum(numpy.prod(block.shape) * block.values.itemsize for block in blocks)
+        return tot, unc
+
     def _execute_nonzeroBlocks(self, destination):
         stored_block_rois_destination = [None]
         self._executeCleanBlocks(stored_block_rois_destination)
@@ -271,7 +449,7 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
         # (Parallelism wouldn't help here: h5py will serialize these requests anyway)
         block_starts = list(map(tuple, block_starts))
         for block_start in block_starts:
-            if block_start not in self._cacheFiles:
+            if not self._hasBlock(block_start):
                 # No label data in this block.  Move on.
                 continue
 
@@ -285,17 +463,7 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             block_relative_intersection = numpy.subtract(intersecting_roi, block_start)
             block_relative_intersection_slicing = roiToSlice(*block_relative_intersection)
 
-            block = self._getBlockDataset(entire_block_roi)
-            deep_data = None
-            if self.Output.meta.has_mask:
-                deep_data = numpy.ma.masked_array(
-                    block["data"][block_relative_intersection_slicing],
-                    mask=block["mask"][block_relative_intersection_slicing],
-                    fill_value=block["fill_value"][()],
-                    shrink=False,
-                )
-            else:
-                deep_data = block[block_relative_intersection_slicing]
+            deep_data = self._readBlock(entire_block_roi, block_relative_intersection_slicing)
 
             # make binary and convert to float (must copy)
             deep_data_float = deep_data.astype(numpy.float32)
@@ -365,7 +533,11 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
             destination_relative_intersection_slicing = roiToSlice(*destination_relative_intersection)
             block_relative_intersection_slicing = roiToSlice(*block_relative_intersection)
 
-            if block_start in self._cacheFiles:
+            if self._sparse and block_start in self._sparseBlocks:
+                destination[destination_relative_intersection_slicing] = self._readBlock(
+                    entire_block_roi, block_relative_intersection_slicing
+                )
+            elif block_start in self._cacheFiles:
                 # Copy from block to destination
                 dataset = self._getBlockDataset(entire_block_roi)
 
@@ -392,6 +564,8 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
     def setInSlot(self, slot, subindex, roi, new_pixels):
         if slot is self.Input:
             self._setInSlotInput(slot, subindex, roi, new_pixels)
+        elif slot is self.InputHdf5 and self._sparse:
+            self._setInSlotInputHdf5Sparse(roi, new_pixels)
         else:
             # We don't yet support the InputHdf5 slot in this function.
             assert False, "Unsupported slot for setInSlot: {}".format(slot.name)
@@ -412,6 +586,9 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
         if isinstance(new_pixels, vigra.VigraArray):
             new_pixels = new_pixels.view(numpy.ndarray)
 
+        if self._sparse:
+            return self._setInSlotInputSparse(roi, new_pixels)
+
         # Get logical blocking.
         block_rois = getIntersectingRois(self.Output.meta.shape, self._blockshape, (roi.start, roi.stop))
         # Convert to tuples
@@ -462,6 +639,57 @@ class OpCompressedUserLabelArray(OpUnmanagedCompressedCache):
 
         return max_label  # Internal use: Return max label
 
+    def _setInSlotInputSparse(self, roi, new_pixels):
+        """
+        Like _setInSlotInput(), but only the non-zero new pixels are written into the sparse blocks.
+        """
+        max_label = 0
+        block_starts = getIntersectingBlocks(self._blockshape, (roi.start, roi.stop))
+        for block_start in map(tuple, block_starts):
+            entire_block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, block_start)
+            intersecting_roi = getIntersection((roi.start, roi.stop), entire_block_roi)
+
+            new_block_pixels = new_pixels[roiToSlice(*numpy.subtract(intersecting_roi, roi.start))]
+            # Shortcut: Nothing to change if this block is all zeros.
+            if not new_block_pixels.any():
+                continue
+
+            block_relative_start = numpy.subtract(intersecting_roi[0], block_start)
+            with self._lock:
+                block = self._sparseBlocks.get(block_start)
+                if block is None:
+                    block_shape = numpy.subtract(*entire_block_roi[::-1])
+                    block = _SparseLabelBlock(block_shape, self.Output.meta.dtype)
+                block.write(block_relative_start, new_block_pixels, self._eraser_magic_value)
+                if len(block) > 0:
+                    self._sparseBlocks[block_start] = block
+                    max_label = max(max_label, block.values.max())
+                else:
+                    self._sparseBlocks.pop(block_start, None)
+
+            # See the comment about dirty notifications in _setInSlotInput()
+            self.Output.setDirty(*intersecting_roi)
+
+        return max_label
+
+    def _setInSlotInputHdf5Sparse(self, roi, value):
+        assert isinstance(
+            value, h5py.Dataset
+        ), "InputHdf5 slot requires an hdf5 Dataset to copy from (not a numpy array)."
+        block_roi = getBlockBounds(self.Output.meta.shape, self._blockshape, roi.start)
+        if (block_roi == numpy.array((roi.start, roi.stop))).all():
+            block_start = tuple(roi.start)
+            block = _SparseLabelBlock(value.shape, self.Output.meta.dtype)
+            block.replace(value[()])
+            with self._lock:
+                if len(block) > 0:
+                    self._sparseBlocks[block_start] = block
+                else:
+                    self._sparseBlocks.pop(block_start, None)
+        else:
+            # Not exactly one block: write it the "normal" way (see OpUnmanagedCompressedCache)
+            self.Input[roiToSlice(roi.start, roi.stop)] = value[()]
+
     def ingestData(self, slot):
         """
         Read the data from the given slot and copy it into this cache.
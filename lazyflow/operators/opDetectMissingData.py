@@ -41,6 +41,7 @@ from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.stype import Opaque
 from lazyflow.rtype import SubRegion
 from lazyflow.request import Request, RequestPool
+from lazyflow.request.processPool import offloadable
 from lazyflow.roi import roiToSlice
 
 import numpy as np
@@ -223,17 +224,15 @@ class OpDetectMissing(Operator):
 
         maxZ = data.shape[0]
 
+        # the patch layout is the same for all slices
+        _, slices = _patchify(data[0, :, :], patchSize, haloSize)
+        sliceHists = _sliceHistograms(
+            data.view(np.ndarray), patchSize, haloSize, self.NHistogramBins.value, self._inputRange
+        )
+
         # walk over slices
         for z in range(maxZ):
-            patches, slices = _patchify(data[z, :, :], patchSize, haloSize)
-            hists = []
-            # walk over patches
-            for patch in patches:
-                (hist, _) = np.histogram(patch, bins=self.NHistogramBins.value, range=self._inputRange, density=True)
-                hists.append(hist)
-            hists = np.vstack(hists)
-
-            pred = self.predict(hists, method=self.DetectionMethod.value)
+            pred = self.predict(sliceHists[z], method=self.DetectionMethod.value)
             for i, p in enumerate(pred):
                 if p > 0:
                     # patch is classified as missing
@@ -644,6 +643,24 @@ def _patchify(data, patchSize, haloSize):
     return (patches, slices)
 
 
+@offloadable
+def _sliceHistograms(data, patchSize, haloSize, nBins, inputRange):
+    """
+    histograms of all patches of all slices of a 3d z-y-x volume
+
+    this loop is dominated by numpy overhead on small arrays, so it is
+    executed in the process pool if that is enabled
+
+    returns ndarray, shape: nSlices x nPatches x nBins
+    """
+    sliceHists = []
+    for z in range(data.shape[0]):
+        patches, _ = _patchify(data[z, :, :], patchSize, haloSize)
+        hists = [np.histogram(patch, bins=nBins, range=inputRange, density=True)[0] for patch in patches]
+        sliceHists.append(np.vstack(hists))
+    return np.stack(sliceHists)
+
+
 def _histogramIntersectionKernel(X, Y):
     """
     implements the histogram intersection kernel in a fancy way
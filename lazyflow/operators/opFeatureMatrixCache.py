@@ -21,7 +21,6 @@
 ###############################################################################
 from __future__ import division
 from builtins import map
-from functools import partial
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,7 +28,7 @@ logger = logging.getLogger(__name__)
 import numpy
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.request import RequestLock, Request, RequestPool
+from lazyflow.request import RequestLock, RequestStream
 from lazyflow.utility import OrderedSignal
 from lazyflow.roi import getBlockBounds, getIntersectingBlocks, determineBlockShape
 
@@ -144,13 +143,8 @@ class OpFeatureMatrixCache(Operator):
         # This could be fixed with some fancier progress state, but
         # (1) We don't expect that to by typical, and
         # (2) progress reporting is merely informational.
-        num_dirty_blocks = len(self._dirty_blocks)
-        remaining_dirty = [num_dirty_blocks]
-
-        def update_progress(result):
-            remaining_dirty[0] -= 1
-            percent_complete = 95.0 * (num_dirty_blocks - remaining_dirty[0]) // num_dirty_blocks
-            self.progressSignal(percent_complete)
+        dirty_blocks = list(self._dirty_blocks)
+        num_dirty_blocks = len(dirty_blocks)
 
         # Update all dirty blocks in the cache
         logger.debug("Updating {} dirty blocks".format(num_dirty_blocks))
@@ -159,30 +153,25 @@ class OpFeatureMatrixCache(Operator):
         # It's better to do this now instead of inside each request
         #  to avoid contention over self._lock
         with self._lock:
-            for block_start in self._dirty_blocks:
+            for block_start in dirty_blocks:
                 if block_start not in self._block_locks:
                     self._block_locks[block_start] = RequestLock()
 
-        # Update each block in its own request.
-        pool = RequestPool()
-        reqs = {}
-        for block_start in self._dirty_blocks:
-            req = Request(partial(self._get_features_for_block, block_start))
-            req.notify_finished(update_progress)
-            reqs[block_start] = req
-            pool.add(req)
-        pool.wait()
-
-        # Now store the results we got.
+        # Update each block in its own request, and store the results as they come in.
         # It's better to store the blocks here -- rather than within each request -- to
         #  avoid contention over self._lock from within every block's request.
-        with self._lock:
-            for block_start, req in list(reqs.items()):
-                if req.result is None:
-                    # 'None' means the block wasn't dirty. No need to update.
-                    continue
-                labels_and_features_matrix = req.result
-                self._dirty_blocks.remove(block_start)
+        for num_done, (block_start, labels_and_features_matrix) in enumerate(
+            RequestStream(self._get_features_for_block, dirty_blocks), start=1
+        ):
+            percent_complete = 95.0 * num_done // num_dirty_blocks
+            self.progressSignal(percent_complete)
+
+            if labels_and_features_matrix is None:
+                # 'None' means the block wasn't dirty. No need to update.
+                continue
+
+            with self._lock:
+                self._dirty_blocks.discard(block_start)
 
                 if labels_and_features_matrix.shape[0] > 0:
                     # Update the block entry with the new matrix.
@@ -19,9 +19,9 @@ from lazyflow.operator import Operator
 from lazyflow.slot import InputSlot, OutputSlot
 from lazyflow.rtype import SubRegion
 from lazyflow.metaDict import MetaDict
-from lazyflow.request import Request, RequestPool
+from lazyflow.request import Request, RequestPool, RequestLock
 from lazyflow.operators import OpBlockedArrayCache, OpReorderAxes
-from .opLazyConnectedComponents import OpLazyConnectedComponents
+from .opLazyConnectedComponents import OpLazyConnectedComponents, UnionFindArray, _uniquePairs
 from future.utils import with_metaclass
 
 logger = logging.getLogger(__name__)
@@ -57,10 +57,16 @@ class OpLabelVolume(Operator):
     # currently available:
     # * 'vigra': use the fast algorithm from ukoethe/vigra
     # * 'blocked': use the memory saving algorithm from thorbenk/blockedarray
+    # * 'lazy': label only the chunks that are needed for the requested region
+    # * 'twopass': label blocks in parallel and merge them (for large volumes)
     #
     # A change here deletes all previously cached results.
     Method = InputSlot(value="vigra")
 
+    ## relabel only the affected parts of the volume if the input changes
+    # (only supported by method 'twopass', see _OpLabelTwoPass)
+    Incremental = InputSlot(value=False)
+
     ## Labeled volume
     # Axistags and shape are the same as on the Input, dtype is an integer
     # datatype.
@@ -105,7 +111,12 @@ class OpLabelVolume(Operator):
 
         # available OpLabelingABCs:
         # TODO: OpLazyConnectedComponents and _OpLabelBlocked does not conform to OpLabelingABC
-        self._labelOps = {"vigra": _OpLabelVigra, "blocked": _OpLabelBlocked, "lazy": OpLazyConnectedComponents}
+        self._labelOps = {
+            "vigra": _OpLabelVigra,
+            "blocked": _OpLabelBlocked,
+            "lazy": OpLazyConnectedComponents,
+            "twopass": _OpLabelTwoPass,
+        }
 
     def setupOutputs(self):
         method = self.Method.value
@@ -122,8 +133,10 @@ class OpLabelVolume(Operator):
         if self._opLabel is None:
             self._opLabel = self._labelOps[method](parent=self)
             self._opLabel.Input.connect(self._op5.Output)
-            if method is "vigra":
+            if method in ("vigra", "twopass"):
                 self._opLabel.BypassModeEnabled.connect(self.BypassModeEnabled)
+            if method == "twopass":
+                self._opLabel.Incremental.connect(self.Incremental)
 
         # connect reordering operators
         self._op5_2.Input.connect(self._opLabel.Output)
@@ -141,7 +154,7 @@ class OpLabelVolume(Operator):
         self._setBG()
 
     def propagateDirty(self, slot, subindex, roi):
-        if slot == self.BypassModeEnabled:
+        if slot == self.BypassModeEnabled or slot == self.Incremental:
             pass
         elif slot == self.Method:
             # We are changing the labeling method. In principle, the labelings
@@ -314,6 +327,302 @@ class _OpLabelVigra(OpLabelingABC):
             result[..., 0] = vigra.analysis.labelImageWithBackground(source[..., 0], background_value=int(bg))
 
 
+## blockwise two-pass connected components
+#
+# Labels each time/channel slice in four passes, each of which is parallelized
+# over blocks with a RequestPool:
+#   1. label every block on its own (local labels)
+#   2. find the pairs of local labels that touch across the faces between
+#      neighbouring blocks
+#   3. resolve all pairs in a single union find structure, which gives a final
+#      label for every local label
+#   4. relabel every block with its final labels
+# The input is read block by block, so a slice never has to be passed to vigra
+# as a whole. The block shape is the input's ideal_blockshape, if it has one.
+#
+# In incremental mode, the local labels of every fully labeled slice are kept
+# (see _TwoPassState). When the input changes, only the blocks intersecting
+# the dirty region are labeled again, and only their faces are merged again.
+# Objects that were not affected by the change keep their labels, and only the
+# blocks that contain affected objects are set dirty. The labels are
+# contiguous only for the first labeling of a slice: labels of vanished
+# objects are reused by new objects, but there might be gaps.
+class _OpLabelTwoPass(OpLabelingABC):
+    name = "OpLabelTwoPass"
+    supportedDtypes = [np.uint8, np.uint32, np.float32]
+
+    ## relabel only the blocks that are affected by a change of the input
+    # (needs memory for the local labels of the whole volume)
+    Incremental = InputSlot(value=False)
+
+    ## spatial block shape (xyz), used if the input has no ideal_blockshape
+    defaultBlockShape = (256, 256, 256)
+
+    def __init__(self, *args, **kwargs):
+        super(_OpLabelTwoPass, self).__init__(*args, **kwargs)
+        # (t, c) -> _TwoPassState, in incremental mode
+        self._states = {}
+        self._statesLock = ThreadLock()
+
+    def setupOutputs(self):
+        super(_OpLabelTwoPass, self).setupOutputs()
+        with self._statesLock:
+            self._states = {}
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot == self.Incremental:
+            with self._statesLock:
+                self._states = {}
+        elif slot == self.Input and self.Incremental.value:
+            self._propagateDirtyIncremental(roi)
+        else:
+            if slot == self.Background:
+                with self._statesLock:
+                    self._states = {}
+            super(_OpLabelTwoPass, self).propagateDirty(slot, subindex, roi)
+
+    def _propagateDirtyIncremental(self, roi):
+        shape = self.Input.meta.shape
+        dirtyRois = []
+        for t in range(roi.start[0], roi.stop[0]):
+            for c in range(roi.start[4], roi.stop[4]):
+                with self._statesLock:
+                    state = self._states.get((t, c))
+                if state is None:
+                    # never labeled as a whole, everything is dirty
+                    dirtyRois.append(((t, 0, 0, 0, c), (t + 1,) + tuple(shape[1:4]) + (c + 1,)))
+                    continue
+                with state.lock:
+                    slicings = state.invalidate(roi.start[1:4], roi.stop[1:4])
+                for slicing in slicings:
+                    start = (t,) + tuple(s.start for s in slicing) + (c,)
+                    stop = (t + 1,) + tuple(s.stop for s in slicing) + (c + 1,)
+                    dirtyRois.append((start, stop))
+
+        for start, stop in dirtyRois:
+            self.Output.setDirty(start, stop)
+            self.CachedOutput.setDirty(start, stop)
+
+    def _label3d(self, roi, bg, result):
+        result = result.view(np.ndarray)
+        t, c = roi.start[0], roi.start[4]
+        shape = self.Input.meta.shape
+        fullSlice = all(roi.start[i] == 0 and roi.stop[i] == shape[i] for i in range(1, 4))
+        if self.Incremental.value and fullSlice:
+            with self._statesLock:
+                state = self._states.get((t, c))
+                if state is None or state.bg != bg:
+                    state = _TwoPassState(self._blocks(roi), bg, persistent=True)
+                    self._states[(t, c)] = state
+        else:
+            state = _TwoPassState(self._blocks(roi), bg, persistent=False)
+
+        with state.lock:
+            self._update(state, roi, result)
+            self._runParallel(self._writeBlock, [(state, block, result) for block in state.blocks])
+
+    ## bring the labels of all stale blocks up to date
+    def _update(self, state, roi, result):
+        stale = set(state.stale)
+        if not stale:
+            return
+
+        # 1. local labeling
+        blocks = [block for block in state.blocks if block[0] in stale]
+        self._runParallel(self._labelBlock, [(roi, state, block, result) for block in blocks])
+
+        # 2. merging across the faces of relabeled blocks
+        slicings = dict(state.blocks)
+        args = []
+        for index, _ in state.blocks:
+            for axis in range(3):
+                neighbour = list(index)
+                neighbour[axis] += 1
+                neighbour = tuple(neighbour)
+                if neighbour in slicings and (index in stale or neighbour in stale):
+                    args.append((state, index, neighbour, axis))
+        self._runParallel(self._mergeFace, args)
+
+        # 3. global resolution
+        offsets = {}
+        total = 0
+        for index, _ in state.blocks:
+            offsets[index] = total
+            total += state.numLabels[index]
+
+        uf = UnionFindArray(1)
+        if total > 0:
+            uf.makeNewIndices(total)
+        pairs = [(a + offsets[index], b + offsets[neighbour]) for (index, _), (neighbour, a, b) in state.pairs.items()]
+        if pairs:
+            uf.makeUnions(np.concatenate([a for a, _ in pairs]), np.concatenate([b for _, b in pairs]))
+        roots = uf.findIndices(np.arange(total + 1))
+        roots[0] = 0
+        final = self._finalLabels(state, stale, offsets, roots)
+
+        # 4. relabeling (the look up tables, they are applied in _writeBlock)
+        for index, _ in state.blocks:
+            lut = final[offsets[index] : offsets[index] + state.numLabels[index] + 1].copy()
+            lut[0] = 0
+            state.luts[index] = lut
+        state.stale.clear()
+
+    ## final label for every global index (local label + block offset)
+    def _finalLabels(self, state, stale, offsets, roots):
+        # index 0 (background) has the smallest root, so it stays component 0
+        _, components = np.unique(roots, return_inverse=True)
+
+        # the labels of the blocks that were not labeled again
+        previous = np.zeros(len(roots), dtype=self.labelType)
+        for index, _ in state.blocks:
+            if index not in stale and index in state.luts:
+                offset = offsets[index]
+                previous[offset + 1 : offset + state.numLabels[index] + 1] = state.luts[index][1:]
+        if not previous.any():
+            return components.astype(self.labelType)
+
+        # every object keeps the smallest label it had, unless an object with
+        # a smaller index already took it (after a split)
+        numComponents = components.max() + 1
+        none = np.iinfo(self.labelType).max
+        candidates = np.full(numComponents, none, dtype=self.labelType)
+        known = previous > 0
+        np.minimum.at(candidates, components[known], previous[known])
+        labels = np.zeros(numComponents, dtype=self.labelType)
+        claiming = np.nonzero(candidates[1:] != none)[0] + 1
+        _, first = np.unique(candidates[claiming], return_index=True)
+        keeping = claiming[first]
+        labels[keeping] = candidates[keeping]
+
+        # the other objects get the smallest unused labels
+        others = np.nonzero(labels[1:] == 0)[0] + 1
+        unused = np.setdiff1d(np.arange(1, labels.max() + len(others) + 1), labels[keeping])
+        labels[others] = unused[: len(others)]
+        return labels[components]
+
+    ## list of (block index, block slicing in roi) for all blocks of a roi
+    def _blocks(self, roi):
+        blockShape = self.defaultBlockShape
+        ideal = self.Input.meta.ideal_blockshape
+        if ideal is not None and np.prod(ideal[1:4]) > 0:
+            blockShape = ideal[1:4]
+        blockShape = np.asarray(blockShape)
+        shape = np.asarray(roi.stop[1:4]) - np.asarray(roi.start[1:4])
+        gridShape = (shape + blockShape - 1) // blockShape
+
+        blocks = []
+        for index in np.ndindex(*gridShape):
+            start = np.asarray(index) * blockShape
+            stop = np.minimum(start + blockShape, shape)
+            blocks.append((index, tuple(slice(a, b) for a, b in zip(start, stop))))
+        return blocks
+
+    @staticmethod
+    def _runParallel(func, args):
+        pool = RequestPool()
+        for a in args:
+            pool.add(Request(partial(func, *a)))
+        pool.wait()
+        pool.clean()
+
+    def _labelBlock(self, roi, state, block, result):
+        index, blockSlicing = block
+        start = np.array(roi.start)
+        stop = np.array(roi.stop)
+        start[1:4] += [s.start for s in blockSlicing]
+        stop[1:4] = start[1:4] + [s.stop - s.start for s in blockSlicing]
+        blockRoi = SubRegion(self.Input, start=tuple(start), stop=tuple(stop))
+
+        source = vigra.taggedView(self.Input.get(blockRoi).wait(), axistags="txyzc").withAxes(*"xyz")
+        bg = int(state.bg)
+        if source.shape[2] > 1:
+            labeled = vigra.analysis.labelVolumeWithBackground(source, background_value=bg)
+        else:
+            labeled = vigra.analysis.labelImageWithBackground(source[..., 0], background_value=bg)
+            labeled = labeled[..., np.newaxis]
+
+        if state.persistent:
+            state.local[index] = labeled.view(np.ndarray)
+        else:
+            # label in place, the result is relabeled in _writeBlock
+            result[blockSlicing] = labeled
+            state.local[index] = result[blockSlicing]
+        state.numLabels[index] = int(labeled.max())
+
+        # keep the input values on the faces, we need them for merging
+        source = source.view(np.ndarray)
+        state.faces[index] = [(source.take([0], axis=i), source.take([-1], axis=i)) for i in range(3)]
+
+    @staticmethod
+    def _mergeFace(state, index, neighbour, axis):
+        labelsA = state.local[index].take([-1], axis=axis)
+        labelsB = state.local[neighbour].take([0], axis=axis)
+        adjacent = (labelsA > 0) & (labelsB > 0) & (state.faces[index][axis][1] == state.faces[neighbour][axis][0])
+        a, b = _uniquePairs(labelsA[adjacent], labelsB[adjacent])
+        state.pairs[(index, axis)] = (neighbour, a, b)
+
+    @staticmethod
+    def _writeBlock(state, block, result):
+        index, blockSlicing = block
+        result[blockSlicing] = state.luts[index][state.local[index]]
+
+
+## labeling state of one time/channel slice for _OpLabelTwoPass
+class _TwoPassState(object):
+    def __init__(self, blocks, bg, persistent):
+        self.blocks = blocks
+        self.bg = bg
+        # keep the local labels in memory (otherwise they are written to the result directly)
+        self.persistent = persistent
+        self.lock = RequestLock()
+
+        # block index -> local labels, number of local labels, input values on the faces
+        self.local = {}
+        self.numLabels = {}
+        self.faces = {}
+        # (block index, axis) -> (neighbour block index, touching local labels of block, of neighbour)
+        self.pairs = {}
+        # block index -> final label for every local label
+        self.luts = {}
+        # blocks that have to be labeled again
+        self.stale = set(index for index, _ in blocks)
+
+    ## mark the blocks intersecting a (spatial) region stale
+    # @return the slicings of all blocks whose final labels might change
+    def invalidate(self, start, stop):
+        if len(self.luts) < len(self.blocks):
+            # never fully labeled
+            self.stale.update(index for index, _ in self.blocks)
+            return [slicing for _, slicing in self.blocks]
+
+        slicings = dict(self.blocks)
+        dirty = set()
+        for index, slicing in self.blocks:
+            if all(s.start < b and a < s.stop for s, a, b in zip(slicing, start, stop)):
+                dirty.add(index)
+
+        # objects in the dirty blocks, and objects that touch them from outside (they might be merged)
+        involved = [self.luts[index][1:] for index in dirty]
+        for index in dirty:
+            for axis in range(3):
+                for step, side in ((-1, -1), (1, 0)):
+                    neighbour = list(index)
+                    neighbour[axis] += step
+                    neighbour = tuple(neighbour)
+                    if neighbour in slicings and neighbour not in dirty:
+                        face = self.local[neighbour].take([side], axis=axis)
+                        involved.append(self.luts[neighbour][face].ravel())
+        involved = np.unique(np.concatenate(involved)) if involved else np.zeros((0,))
+        involved = involved[involved > 0]
+
+        self.stale |= dirty
+        affected = []
+        for index, slicing in self.blocks:
+            if index in dirty or np.isin(self.luts[index][1:], involved).any():
+                affected.append(slicing)
+        return affected
+
+
 # try to import the blockedarray module, fail only if neccessary
 try:
     from blockedarray import OpBlockedConnectedComponents
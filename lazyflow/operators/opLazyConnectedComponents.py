@@ -377,10 +377,7 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
 
                 # determine which objects from this chunk continue in the
                 # neighbouring chunk
-                extendingLabels = np.array([b for a, b in zip(myLabels, otherLabels) if a in actualLabels]).astype(
-                    myLabels.dtype
-                )
-                extendingLabels = np.sort(vigra.analysis.unique(extendingLabels)).astype(_LABEL_TYPE)
+                extendingLabels = np.unique(otherLabels[np.isin(myLabels, actualLabels)]).astype(_LABEL_TYPE)
 
                 # add the neighbour to our processing queue only if it actually
                 # shares objects
@@ -431,18 +428,15 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
         numLabels = labeled.max()  # we ignore 0 here
         self._numIndices[chunkIndex] = numLabels
         if numLabels > 0:
-            with self._lock:
-                # determine the offset
-                # localLabel + offset = globalLabel (for localLabel>0)
-                offset = self._uf.makeNewIndex()
-                self._globalLabelOffset[chunkIndex] = offset - 1
-
-                # get n-1 more labels
-                for i in range(numLabels - 1):
-                    self._uf.makeNewIndex()
+            # determine the offset
+            # localLabel + offset = globalLabel (for localLabel>0)
+            offset = self._uf.makeNewIndices(int(numLabels))
+            self._globalLabelOffset[chunkIndex] = offset - 1
 
     # merge the labels of two adjacent chunks
     # the chunks have to be ordered lexicographically, e.g. by self._orderPair
+    # returns the pairs of adjacent local labels (without duplicates) as
+    # 2-tuple of arrays (labels of chunkA, labels of chunkB)
     @_chunksynchronized
     def _merge(self, chunkA, chunkB):
         if chunkB in self._mergeMap[chunkA]:
@@ -468,20 +462,18 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
         hyperplane_b = self._Input[hyperplane_index_b].wait()
         adjacent_bool_inds = np.logical_and(adjacent_bool_inds, hyperplane_a == hyperplane_b)
 
-        # union find manipulations are critical
-        with self._lock:
-            map_a = self.localToGlobal(chunkA)
-            map_b = self.localToGlobal(chunkB)
-            labels_a = map_a[label_hyperplane_a[adjacent_bool_inds]]
-            labels_b = map_b[label_hyperplane_b[adjacent_bool_inds]]
-            for a, b in zip(labels_a, labels_b):
-                assert a not in self._globalToFinal, "Invalid merge"
-                assert b not in self._globalToFinal, "Invalid merge"
-                self._uf.makeUnion(a, b)
-
-            logger.debug("merged chunks {} and {}".format(chunkA, chunkB))
-        correspondingLabelsA = label_hyperplane_a[adjacent_bool_inds]
-        correspondingLabelsB = label_hyperplane_b[adjacent_bool_inds]
+        # every pair of touching objects appears many times on the hyperplane
+        correspondingLabelsA, correspondingLabelsB = _uniquePairs(
+            label_hyperplane_a[adjacent_bool_inds], label_hyperplane_b[adjacent_bool_inds]
+        )
+
+        # the union find structure has a lock of its own, merges of other
+        # chunk pairs don't have to wait for us
+        offset_a = self._globalLabelOffset[chunkA]
+        offset_b = self._globalLabelOffset[chunkB]
+        self._uf.makeUnions(correspondingLabelsA + offset_a, correspondingLabelsB + offset_b)
+
+        logger.debug("merged chunks {} and {}".format(chunkA, chunkB))
         return correspondingLabelsA, correspondingLabelsB
 
     # get a rectangular region with final global labels
@@ -529,7 +521,7 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
         numLabels = self._numIndices[chunkIndex]
         labels = np.arange(1, numLabels + 1, dtype=_LABEL_TYPE) + offset
 
-        labels = np.asarray(list(map(self._uf.findIndex, labels)), dtype=_LABEL_TYPE)
+        labels = self._uf.findIndices(labels)
 
         # we got 'numLabels' real labels, and one label '0', so our
         # output has to have numLabels+1 elements
@@ -790,50 +782,83 @@ class OpLazyConnectedComponents(Operator, ObservableCache):
 
 
 # python implementation of vigra's UnionFindArray structure
+# The parent of each index is stored in a numpy array, such that unions and
+# lookups of many indices at once are vectorized.
 class UnionFindArray(object):
     def __init__(self, nextFree=1):
-        self._map = dict(list(zip(*(list(range(nextFree)),) * 2)))
+        self._parent = np.arange(max(nextFree, 1024), dtype=_LABEL_TYPE)
         self._lock = HardLock()
         self._nextFree = nextFree
         self._it = None
 
     ## join regions a and b
-    # callback is called whenever two regions are joined that were
-    # separate before, signature is
-    #   callback(smaller_label, larger_label)
     @threadsafe
     def makeUnion(self, a, b):
-        assert a in self._map
-        assert b in self._map
-
-        a = self._findIndex(a)
-        b = self._findIndex(b)
+        assert a < self._nextFree
+        assert b < self._nextFree
+        self._makeUnions(np.asarray([a], dtype=_LABEL_TYPE), np.asarray([b], dtype=_LABEL_TYPE))
 
-        # avoid cycles by choosing the smallest label as the common one
-        # swap such that a is smaller
-        if a > b:
-            a, b = b, a
-
-        self._map[b] = a
+    ## join regions a[i] and b[i] for all i
+    @threadsafe
+    def makeUnions(self, a, b):
+        a = np.asarray(a, dtype=_LABEL_TYPE)
+        b = np.asarray(b, dtype=_LABEL_TYPE)
+        assert a.shape == b.shape
+        assert a.size == 0 or max(a.max(), b.max()) < self._nextFree
+        self._makeUnions(a, b)
+
+    def _makeUnions(self, a, b):
+        while a.size > 0:
+            a = self._findIndices(a)
+            b = self._findIndices(b)
+            notJoined = a != b
+            a = a[notJoined]
+            b = b[notJoined]
+            # avoid cycles by choosing the smallest label as the common one
+            # (if a root appears more than once, the smallest label wins and the
+            # other pairs are joined in the next iteration)
+            np.minimum.at(self._parent, np.maximum(a, b), np.minimum(a, b))
 
     @threadsafe
     def makeNewIndex(self):
-        newLabel = self._nextFree
-        self._nextFree += 1
-        self._map[newLabel] = newLabel
-        return newLabel
+        return self._makeNewIndices(1)
+
+    ## reserve n consecutive indices, returns the first one
+    @threadsafe
+    def makeNewIndices(self, n):
+        return self._makeNewIndices(n)
+
+    def _makeNewIndices(self, n):
+        first = self._nextFree
+        self._nextFree += n
+        if self._nextFree > self._parent.size:
+            size = max(self._nextFree, 2 * self._parent.size)
+            parent = np.arange(size, dtype=_LABEL_TYPE)
+            parent[: self._parent.size] = self._parent
+            self._parent = parent
+        return first
 
     @threadsafe
     def findIndex(self, a):
-        return self._findIndex(a)
+        return self._findIndices(np.asarray([a], dtype=_LABEL_TYPE))[0]
 
-    def _findIndex(self, a):
-        while a != self._map[a]:
-            a = self._map[a]
-        return a
+    @threadsafe
+    def findIndices(self, a):
+        return self._findIndices(np.asarray(a, dtype=_LABEL_TYPE))
+
+    def _findIndices(self, a):
+        roots = self._parent[a]
+        while True:
+            parents = self._parent[roots]
+            if np.array_equal(parents, roots):
+                break
+            roots = parents
+        # path compression
+        self._parent[a] = roots
+        return roots
 
     def __str__(self):
-        s = "<UnionFindArray>\n{}".format(self._map)
+        return "<UnionFindArray>\n{}".format(self._parent[: self._nextFree])
 
     def __getstate__(self):
         odict = self.__dict__.copy()
@@ -842,6 +867,15 @@ class UnionFindArray(object):
 
     def __setstate__(self, dict):
         self.__dict__.update(dict)
+        self._lock = HardLock()
+
+
+# remove duplicates from pairs of labels (a[i], b[i])
+def _uniquePairs(a, b):
+    a = np.asarray(a, dtype=_LABEL_TYPE)
+    b = np.asarray(b, dtype=_LABEL_TYPE)
+    packed = np.unique((a.astype(np.uint64) << np.uint64(32)) | b)
+    return (packed >> np.uint64(32)).astype(_LABEL_TYPE), (packed & np.uint64(0xFFFFFFFF)).astype(_LABEL_TYPE)
 
 
 class InfiniteLabelIterator(object):
@@ -29,11 +29,13 @@ from functools import partial
 
 from lazyflow import roi
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.request import RequestPool
+from lazyflow.request import Request, RequestPool
 from lazyflow.roi import sliceToRoi, roiToSlice
 from lazyflow.rtype import SubRegion
 
 from .operators import OpArrayPiper
+from .opBlockedArrayCache import OpBlockedArrayCache
+from . import derivativeFeatures
 from .filterOperators import (
     OpGaussianSmoothing,
     OpDifferenceOfGaussians,
@@ -50,6 +52,39 @@ if WITH_FAST_FILTERS:
 logger = logging.getLogger(__name__)
 
 
+def _computeGaussianSmoothing(vol, sigma, roi, in2d, window_size):
+    """
+    Gaussian smoothing of the given (czyx) volume, cropped to roi (czyx).
+    Used by OpPixelFeaturesPresmoothed and OpPresmoothing.
+    """
+    if WITH_FAST_FILTERS:
+        # Use fast filters (if available)
+        result = numpy.zeros(vol.shape).astype(vol.dtype)
+        assert vol.channelIndex == 0
+
+        for channel in range(vol.shape[0]):
+            c_slice = slice(channel, channel + 1)
+            if in2d:
+
+                for z in range(vol.shape[1]):
+                    result[c_slice, z : z + 1] = fastfilters.gaussianSmoothing(
+                        vol[c_slice, z : z + 1], sigma, window_size=window_size
+                    )
+            else:
+                result[c_slice] = fastfilters.gaussianSmoothing(vol[c_slice], sigma, window_size=window_size)
+
+        roi = roiToSlice(*roi)
+        return result[roi]
+    else:
+        # Use Vigra's filters
+        if in2d:
+            sigma = (0, sigma, sigma)
+
+        # vigra's filter functions need roi without channels axis
+        vigra_roi = (roi[0][1:], roi[1][1:])
+        return vigra.filters.gaussianSmoothing(vol, sigma, roi=vigra_roi, window_size=window_size)
+
+
 class OpPixelFeaturesPresmoothed(Operator):
     name = "OpPixelFeaturesPresmoothed"
     category = "Vigra filter"
@@ -58,6 +93,10 @@ class OpPixelFeaturesPresmoothed(Operator):
     Scales = InputSlot()
     SelectionMatrix = InputSlot()
     ComputeIn2d = InputSlot()
+    # If True, the pre-smoothed input is cached per scale in blocks, so neighbouring requests share their halos
+    CachePresmoothed = InputSlot(value=False)
+    # If True, the features of a scale are computed from shared Gaussian derivative images (see derivativeFeatures)
+    ShareDerivatives = InputSlot(value=False)
 
     # Specify a default set & order for the features we compute
     FeatureIds = InputSlot(
@@ -76,11 +115,18 @@ class OpPixelFeaturesPresmoothed(Operator):
 
     WINDOW_SIZE = 3.5
 
+    # Spatial (zyx) block shape of the pre-smoothed caches (see CachePresmoothed)
+    PRESMOOTHED_BLOCK_SHAPE = (64, 64, 64)
+
     def __init__(self, *args, **kwargs):
         Operator.__init__(self, *args, **kwargs)
         self.source = OpArrayPiper(parent=self)
         self.source.Input.connect(self.Input)
 
+        # scale index -> (OpPresmoothing, OpBlockedArrayCache), if CachePresmoothed is set
+        self._presmoothingCaches = {}
+        self._presmoothingConfig = None
+
     def getInvalidScales(self):
         """
         Check each of the scales the user selected against the shape of the input dataset (in space only).
@@ -226,6 +272,7 @@ class OpPixelFeaturesPresmoothed(Operator):
             self.max_sigma = 0.7
 
         self.featureOps = oparray
+        self._setupPresmoothingCaches()
 
         # Output meta is a modified copy of the input meta
         self.Output.meta.assignFrom(self.Input.meta)
@@ -240,6 +287,45 @@ class OpPixelFeaturesPresmoothed(Operator):
         #        but vigra functions may use internal RAM as well.
         self.Output.meta.ram_usage_per_requested_pixel = 4.0 * self.Output.meta.shape[1]
 
+    def _presmoothingSigma(self, j):
+        # The feature operators smooth with (at most) sigma 1.0 themselves, see newScales
+        if self.scales[j] > 1.0:
+            return math.sqrt(self.scales[j] ** 2 - 1.0)
+        else:
+            return self.scales[j]
+
+    def _setupPresmoothingCaches(self):
+        config = None
+        if self.CachePresmoothed.value:
+            config = tuple(
+                (j, self._presmoothingSigma(j), self.ComputeIn2d.value[j])
+                for j in range(len(self.scales))
+                if self.matrix[:, j].any()
+            )
+
+        if config != self._presmoothingConfig:
+            for smoothOp, cacheOp in self._presmoothingCaches.values():
+                cacheOp.cleanUp()
+                smoothOp.cleanUp()
+            self._presmoothingCaches = {}
+            self._presmoothingConfig = config
+
+            for j, sigma, in2d in config or ():
+                smoothOp = OpPresmoothing(parent=self)
+                smoothOp.Sigma.setValue(sigma)
+                smoothOp.ComputeIn2d.setValue(in2d)
+                smoothOp.Input.connect(self.Input)
+
+                cacheOp = OpBlockedArrayCache(parent=self)
+                cacheOp.Input.connect(smoothOp.Output)
+                self._presmoothingCaches[j] = (smoothOp, cacheOp)
+
+        if self._presmoothingCaches:
+            t, c = 1, self.Input.meta.shape[1]
+            spatial_shape = numpy.minimum(self.PRESMOOTHED_BLOCK_SHAPE, self.Input.meta.shape[2:])
+            for _, cacheOp in self._presmoothingCaches.values():
+                cacheOp.BlockShape.setValue((t, c, *spatial_shape))
+
     def _get_ideal_blockshape(self):
         assert self.Output.meta.getAxisKeys() == list("tczyx")
 
@@ -289,6 +375,9 @@ class OpPixelFeaturesPresmoothed(Operator):
             or inputSlot == self.ComputeIn2d
         ):
             self.Output.setDirty(slice(None))
+        elif inputSlot == self.CachePresmoothed or inputSlot == self.ShareDerivatives:
+            # Only changes how the output is computed, not the output itself
+            pass
         else:
             assert False, "Unknown dirty input slot."
 
@@ -371,80 +460,84 @@ class OpPixelFeaturesPresmoothed(Operator):
             filter_target_slice = roi.roiToSlice(filter_target_start, filter_target_stop)
             input_smooth_slice = roi.roiToSlice(input_smooth_start, input_smooth_stop)
 
-            # pre-smooth for all requested time slices and all channels
-            full_input_smooth_slice = (full_output_slice[0], slice(None), *input_smooth_slice)
-            req = self.Input[full_input_smooth_slice]
-            source = req.wait()
-            req.clean()
-            req.destination = None
-            if source.dtype != numpy.float32:
-                sourceF = source.astype(numpy.float32)
-                try:
-                    source.resize((1,), refcheck=False)
-                except Exception:
-                    pass
-                del source
-                source = sourceF
-
-            sourceV = source.view(vigra.VigraArray)
-            sourceV.axistags = copy.copy(self.Input.meta.axistags)
-
             dimCol = len(self.scales)
             dimRow = self.matrix.shape[0]
 
-            presmoothed_source = [None] * dimCol
-
-            source_smooth_shape = tuple(smooth_filter_stop - smooth_filter_start)
-            full_source_smooth_shape = (
-                full_output_stop[0] - full_output_start[0],
-                self.Input.meta.shape[1],
-            ) + source_smooth_shape
-            try:
-                for j in range(dimCol):
-                    for i in range(dimRow):
-                        if self.matrix[i, j]:
-                            # There is at least one filter op with this scale
-                            break
-                    else:
-                        # There is no filter op at this scale
-                        continue
+            if self._presmoothingCaches:
+                presmoothed_source = self._getCachedPresmoothing(
+                    full_output_start, full_output_stop, input_filter_start, input_filter_stop
+                )
+            else:
+                # pre-smooth for all requested time slices and all channels
+                full_input_smooth_slice = (full_output_slice[0], slice(None), *input_smooth_slice)
+                req = self.Input[full_input_smooth_slice]
+                source = req.wait()
+                req.clean()
+                req.destination = None
+                if source.dtype != numpy.float32:
+                    sourceF = source.astype(numpy.float32)
+                    try:
+                        source.resize((1,), refcheck=False)
+                    except Exception:
+                        pass
+                    del source
+                    source = sourceF
 
-                    if self.scales[j] > 1.0:
-                        tempSigma = math.sqrt(self.scales[j] ** 2 - 1.0)
-                    else:
-                        tempSigma = self.scales[j]
+                sourceV = source.view(vigra.VigraArray)
+                sourceV.axistags = copy.copy(self.Input.meta.axistags)
 
-                    presmoothed_source[j] = numpy.ndarray(full_source_smooth_shape, numpy.float32)
+                presmoothed_source = [None] * dimCol
 
-                    droi = (
-                        (0, *tuple(smooth_filter_start._asint())),
-                        (sourceV.shape[1], *tuple(smooth_filter_stop._asint())),
-                    )
-                    for i, vsa in enumerate(sourceV.timeIter()):
-                        presmoothed_source[j][i, ...] = self._computeGaussianSmoothing(
-                            vsa, tempSigma, droi, in2d=self.ComputeIn2d.value[j]
+                source_smooth_shape = tuple(smooth_filter_stop - smooth_filter_start)
+                full_source_smooth_shape = (
+                    full_output_stop[0] - full_output_start[0],
+                    self.Input.meta.shape[1],
+                ) + source_smooth_shape
+                try:
+                    for j in range(dimCol):
+                        for i in range(dimRow):
+                            if self.matrix[i, j]:
+                                # There is at least one filter op with this scale
+                                break
+                        else:
+                            # There is no filter op at this scale
+                            continue
+
+                        tempSigma = self._presmoothingSigma(j)
+
+                        presmoothed_source[j] = numpy.ndarray(full_source_smooth_shape, numpy.float32)
+
+                        droi = (
+                            (0, *tuple(smooth_filter_start._asint())),
+                            (sourceV.shape[1], *tuple(smooth_filter_stop._asint())),
                         )
+                        for i, vsa in enumerate(sourceV.timeIter()):
+                            presmoothed_source[j][i, ...] = _computeGaussianSmoothing(
+                                vsa, tempSigma, droi, in2d=self.ComputeIn2d.value[j], window_size=self.WINDOW_SIZE
+                            )
 
-            except RuntimeError as e:
-                if "kernel longer than line" in str(e):
-                    raise RuntimeError(
-                        "Feature computation error:\nYour image is too small to apply a filter with "
-                        f"sigma={self.scales[j]:.1f}. Please select features with smaller sigmas."
-                    )
-                else:
-                    raise e
+                except RuntimeError as e:
+                    if "kernel longer than line" in str(e):
+                        raise RuntimeError(
+                            "Feature computation error:\nYour image is too small to apply a filter with "
+                            f"sigma={self.scales[j]:.1f}. Please select features with smaller sigmas."
+                        )
+                    else:
+                        raise e
 
-            del sourceV
-            try:
-                source.resize((1,), refcheck=False)
-            except ValueError:
-                # Sometimes this fails, but that's okay.
-                logger.debug("Failed to free array memory.")
-            del source
+                del sourceV
+                try:
+                    source.resize((1,), refcheck=False)
+                except ValueError:
+                    # Sometimes this fails, but that's okay.
+                    logger.debug("Failed to free array memory.")
+                del source
 
             cnt = 0
             written = 0
             closures = []
+            # scale index -> [(featureId, op, begin, end, subtarget)], if ShareDerivatives is set
+            sharedPieces = {}
             # connect individual operators
             for i in range(dimRow):
                 for j in range(dimCol):
@@ -472,18 +565,32 @@ class OpPixelFeaturesPresmoothed(Operator):
                             full_filter_target_slice = [full_output_slice[0], slice(begin, end), *filter_target_slice]
                             filter_target_roi = SubRegion(oslot, pslice=full_filter_target_slice)
 
-                            closure = partial(
-                                oslot.operator.call_execute,
-                                oslot,
-                                (),
-                                filter_target_roi,
-                                subtarget,
-                                sourceArray=presmoothed_source[j],
-                            )
-                            closures.append(closure)
+                            featureId = self.FeatureIds.value[i]
+                            if self.ShareDerivatives.value and self._canShareDerivatives(featureId, oslot.operator):
+                                piece = (featureId, oslot.operator, begin, end, subtarget)
+                                sharedPieces.setdefault(j, []).append(piece)
+                            else:
+                                closure = partial(
+                                    oslot.operator.call_execute,
+                                    oslot,
+                                    (),
+                                    filter_target_roi,
+                                    subtarget,
+                                    sourceArray=presmoothed_source[j],
+                                )
+                                closures.append(closure)
 
                             written += end - begin
                         cnt += slices
+            for j, pieces in sharedPieces.items():
+                closure = partial(
+                    self._computeSharedDerivativeFeatures,
+                    pieces,
+                    presmoothed_source[j],
+                    self.newScales[j],
+                    filter_target_slice,
+                )
+                closures.append(closure)
             pool = RequestPool()
             for c in closures:
                 pool.request(c)
@@ -497,30 +604,169 @@ class OpPixelFeaturesPresmoothed(Operator):
                     except Exception:
                         presmoothed_source[i] = None
 
-    def _computeGaussianSmoothing(self, vol, sigma, roi, in2d):
-        if WITH_FAST_FILTERS:
-            # Use fast filters (if available)
-            result = numpy.zeros(vol.shape).astype(vol.dtype)
-            assert vol.channelIndex == 0
+    @staticmethod
+    def _canShareDerivatives(featureId, op):
+        if featureId not in derivativeFeatures.SUPPORTED_FEATURES:
+            return False
+        if featureId in ("StructureTensorEigenvalues", "HessianOfGaussianEigenvalues"):
+            # the filter ops drop singleton spatial axes from their eigenvalue channels
+            in2d = op.invalid_z or op.ComputeIn2d.value
+            return op.resultingChannels() == (2 if in2d else 3)
+        return True
+
+    def _computeSharedDerivativeFeatures(self, pieces, presmoothed, sigma, filter_target_slice):
+        """
+        Compute the features of one scale from shared derivative images and write them to their subtargets.
+        Each time step and input channel is processed in its own request.
+
+        Args:
+            pieces: list of (featureId, op, begin, end, subtarget), where begin:end is the channel range of the
+              feature op's output that goes into subtarget
+            presmoothed: the pre-smoothed input (tczyx) in the filter frame
+            sigma: the scale of the feature ops
+            filter_target_slice: the target (zyx) in the filter frame
+        """
+        pool = RequestPool()
+        for tstep in range(presmoothed.shape[0]):
+            for input_c in range(presmoothed.shape[1]):
+                pool.add(
+                    Request(
+                        partial(
+                            self._computeSharedDerivativeFeaturesOfChannel,
+                            pieces,
+                            presmoothed,
+                            sigma,
+                            filter_target_slice,
+                            tstep,
+                            input_c,
+                        )
+                    )
+                )
+        pool.wait()
+        pool.clean()
+
+    def _computeSharedDerivativeFeaturesOfChannel(
+        self, pieces, presmoothed, sigma, filter_target_slice, tstep, input_c
+    ):
+        window_size = OpGaussianSmoothing.window_size_feature
+        # (featureId, params, channels of this input channel, in2d, resC, begin, subtarget)
+        features = []
+        for featureId, op, begin, end, subtarget in pieces:
+            resC = op.resultingChannels()
+            channels = [k for k in range(resC) if begin <= input_c * resC + k < end]
+            if channels:
+                params = {s.name: s.value for s in op.inputs.values() if s.name not in ("Input", "ComputeIn2d")}
+                in2d = bool(op.invalid_z or op.ComputeIn2d.value)
+                features.append((featureId, params, channels, in2d, resC, begin, subtarget))
+
+        # 3d and 2d derivatives (with z as a batch axis)
+        derivatives = {}
+        crops = {}
+        for in2d in set(feature[3] for feature in features):
+            if in2d:
+                image = presmoothed[tstep, input_c, filter_target_slice[0]]
+                axes = (1, 2)
+                crops[in2d] = (slice(None), *filter_target_slice[1:])
+            else:
+                image = presmoothed[tstep, input_c]
+                axes = (0, 1, 2)
+                crops[in2d] = filter_target_slice
+            derivatives[in2d] = derivativeFeatures.GaussianDerivatives(image, sigma, axes, window_size)
+            required = []
+            for featureId, params, _, feature_in2d, _, _, _ in features:
+                if feature_in2d == in2d:
+                    required += derivativeFeatures.requiredDerivatives(featureId, derivatives[in2d], **params)
+            derivatives[in2d].precompute(required)
+
+        for featureId, params, channels, in2d, resC, begin, subtarget in features:
+            result = derivativeFeatures.computeFeature(featureId, derivatives[in2d], **params)
+            for k in channels:
+                subtarget[tstep, input_c * resC + k - begin] = result[k][crops[in2d]]
+
+    def _getCachedPresmoothing(self, full_output_start, full_output_stop, input_filter_start, input_filter_stop):
+        """
+        The pre-smoothed input in the filter frame for each scale (None for unused scales), from the caches.
+        The scales are requested in parallel.
+        """
+        presmoothed_source = [None] * len(self.scales)
+        start = (full_output_start[0], 0, *input_filter_start)
+        stop = (full_output_stop[0], self.Input.meta.shape[1], *input_filter_stop)
+        pool = RequestPool()
+        for j, (_, cacheOp) in self._presmoothingCaches.items():
+            pool.add(Request(partial(self._getCachedPresmoothingOfScale, presmoothed_source, j, cacheOp, start, stop)))
+        pool.wait()
+        pool.clean()
+        return presmoothed_source
+
+    def _getCachedPresmoothingOfScale(self, presmoothed_source, j, cacheOp, start, stop):
+        try:
+            presmoothed_source[j] = cacheOp.Output(start, stop).wait()
+        except RuntimeError as e:
+            if "kernel longer than line" in str(e):
+                raise RuntimeError(
+                    "Feature computation error:\nYour image is too small to apply a filter with "
+                    f"sigma={self.scales[j]:.1f}. Please select features with smaller sigmas."
+                )
+            else:
+                raise e
 
-            for channel in range(vol.shape[0]):
-                c_slice = slice(channel, channel + 1)
-                if in2d:
 
-                    for z in range(vol.shape[1]):
-                        result[c_slice, z : z + 1] = fastfilters.gaussianSmoothing(
-                            vol[c_slice, z : z + 1], sigma, window_size=self.WINDOW_SIZE
-                        )
-                else:
-                    result[c_slice] = fastfilters.gaussianSmoothing(vol[c_slice], sigma, window_size=self.WINDOW_SIZE)
+class OpPresmoothing(Operator):
+    """
+    Gaussian pre-smoothing of the input of OpPixelFeaturesPresmoothed for one scale.
+    Computes any roi of the (float32) output by reading the input with a halo,
+    so it can be put behind a blocked cache.
+    """
 
-            roi = roiToSlice(*roi)
-            return result[roi]
-        else:
-            # Use Vigra's filters
-            if in2d:
-                sigma = (0, sigma, sigma)
+    Input = InputSlot()
+    Sigma = InputSlot()
+    ComputeIn2d = InputSlot()
 
-            # vigra's filter functions need roi without channels axis
-            vigra_roi = (roi[0][1:], roi[1][1:])
-            return vigra.filters.gaussianSmoothing(vol, sigma, roi=vigra_roi, window_size=self.WINDOW_SIZE)
+    Output = OutputSlot()
+
+    def setupOutputs(self):
+        assert self.Input.meta.getAxisKeys() == list("tczyx"), self.Input.meta.getAxisKeys()
+        self.Output.meta.assignFrom(self.Input.meta)
+        self.Output.meta.dtype = numpy.float32
+
+    def _enlargeRoi(self, start, stop):
+        enlarge_axes = (0, 0, not self.ComputeIn2d.value, 1, 1)
+        return roi.enlargeRoiForHalo(
+            start,
+            stop,
+            self.Input.meta.shape,
+            self.Sigma.value,
+            OpPixelFeaturesPresmoothed.WINDOW_SIZE,
+            enlarge_axes=enlarge_axes,
+        )
+
+    def execute(self, slot, subindex, slot_roi, result):
+        input_start, input_stop = self._enlargeRoi(slot_roi.start, slot_roi.stop)
+        source = self.Input(input_start, input_stop).wait()
+        if source.dtype != numpy.float32:
+            source = source.astype(numpy.float32)
+
+        sourceV = source.view(vigra.VigraArray)
+        sourceV.axistags = copy.copy(self.Input.meta.axistags)
+
+        # roi within the source (czyx, for one time slice)
+        droi = (
+            (0, *numpy.subtract(slot_roi.start[2:], input_start[2:]).tolist()),
+            (sourceV.shape[1], *numpy.subtract(slot_roi.stop[2:], input_start[2:]).tolist()),
+        )
+        for i, vsa in enumerate(sourceV.timeIter()):
+            result[i, ...] = _computeGaussianSmoothing(
+                vsa,
+                self.Sigma.value,
+                droi,
+                in2d=self.ComputeIn2d.value,
+                window_size=OpPixelFeaturesPresmoothed.WINDOW_SIZE,
+            )
+        return result
+
+    def propagateDirty(self, slot, subindex, dirty_roi):
+        if slot == self.Input:
+            start, stop = self._enlargeRoi(dirty_roi.start, dirty_roi.stop)
+            self.Output.setDirty(start, stop)
+        else:
+            self.Output.setDirty()
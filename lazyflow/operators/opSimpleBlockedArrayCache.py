@@ -99,12 +99,34 @@ class OpSimpleBlockedArrayCache(OpUnblockedArrayCache):
         clipped_block_rois = getIntersectingRois(self.Input.meta.shape, self._blockshape, (roi.start, roi.stop), True)
         full_block_rois = getIntersectingRois(self.Input.meta.shape, self._blockshape, (roi.start, roi.stop), False)
 
+        if len(full_block_rois) == 1:
+            # No need for a pool (and its requests) if there is only one block
+            copy_block(full_block_rois[0], clipped_block_rois[0])
+            return
+
         pool = RequestPool()
         for full_block_roi, clipped_block_roi in zip(full_block_rois, clipped_block_rois):
             req = Request(partial(copy_block, full_block_roi, clipped_block_roi))
             pool.add(req)
         pool.wait()
 
+    def isResident(self, slot, subindex, roi):
+        """
+        Overridden from OpUnblockedArrayCache
+        """
+        if slot is not self.Output or self.BypassModeEnabled.value:
+            return False
+        clipped_block_rois = getIntersectingRois(self.Input.meta.shape, self._blockshape, (roi.start, roi.stop), True)
+        return all(self._get_containing_block_roi(block_roi) is not None for block_roi in clipped_block_rois)
+
+    def readOnlyView(self, slot, subindex, roi):
+        """
+        Overridden from OpUnblockedArrayCache
+        """
+        if self.BypassModeEnabled.value:
+            return None
+        return super(OpSimpleBlockedArrayCache, self).readOnlyView(slot, subindex, roi)
+
     def propagateDirty(self, slot, subindex, roi):
         if slot in (self.BypassModeEnabled, self.BlockShape):
             return
@@ -28,10 +28,12 @@ from itertools import starmap
 import numpy
 import vigra
 
+from lazyflow import operatorStatistics
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.operators.opCache import ManagedBlockedCache
+from lazyflow.operators.cacheSpillStore import DiskSpillStore
 from lazyflow.request import RequestLock
-from lazyflow.roi import getIntersection, roiFromShape, roiToSlice, containing_rois, sliceToRoi
+from lazyflow.roi import roiFromShape, roiToSlice, sliceToRoi, RoiIndex
 
 import logging
 
@@ -52,10 +54,19 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
     Instead, it is assumed that the downstream operators have chosen some reasonable blocking.
     Hopefully the downstream operators are reasonably consistent in the blocks they request data with,
     since every unique result is cached separately.
+
+    Optionally, blocks that are evicted by the memory manager can be kept on disk (see SpillBudget).
+    Such blocks are read back from disk instead of being requested from Input again.
+
+    If ZeroCopyEnabled is set, requests that are entirely contained in an (uncompressed) cached block
+    and don't provide a destination array get a read-only view of the cached data instead of a copy.
     """
 
     Input = InputSlot(allow_mask=True)
     CompressionEnabled = InputSlot(value=False)  # If True, compression will be enabled for certain dtypes
+    SpillBudget = InputSlot(value=0)  # Bytes of disk space for blocks evicted from RAM (0 disables the disk tier)
+    SpillDirectory = InputSlot(value="")  # Where to create the scratch directory for spilled blocks ('' means tmp)
+    ZeroCopyEnabled = InputSlot(value=False)  # If True, cache hits may be returned as read-only views (no copy)
     Output = OutputSlot(allow_mask=True)
 
     CleanBlocks = OutputSlot()  # A list of slicings indicating which blocks are stored in the cache and clean.
@@ -63,6 +74,10 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
     def __init__(self, *args, **kwargs):
         super(OpUnblockedArrayCache, self).__init__(*args, **kwargs)
         self._lock = RequestLock()
+        self._block_data = {}
+        self._spill_store = None
+        # Incremented whenever blocks become dirty, to detect blocks that became dirty while being spilled
+        self._spill_generation = 0
         self._resetBlocks()
 
         self.Input.notifyUnready(self._resetBlocks)
@@ -81,6 +96,24 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         self.Output.meta.assignFrom(self.Input.meta)
         self.CleanBlocks.meta.shape = (1,)
         self.CleanBlocks.meta.dtype = object  # it's a list
+        self._setup_spill_store()
+
+    def _setup_spill_store(self):
+        budget = self.SpillBudget.value
+        directory = self.SpillDirectory.value
+        spill_store = self._spill_store
+        if spill_store is not None:
+            if spill_store.maxBytes == budget and self._spill_directory == directory:
+                return
+            spill_store.close()
+            with self._lock:
+                self._spill_index = RoiIndex()
+
+        self._spill_directory = directory
+        if budget > 0:
+            self._spill_store = DiskSpillStore(budget, directory)
+        else:
+            self._spill_store = None
 
     def execute(self, slot, subindex, roi, result):
         if slot is self.Output:
@@ -98,11 +131,30 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         with self._lock:
             block_roi = self._get_containing_block_roi(request_roi)
             if block_roi is not None:
-                # Data is already in the cache. Just extract it.
-                block_relative_roi = numpy.array(request_roi) - block_roi[0]
-                self.Output.stype.copy_data(result, self._block_data[block_roi][roiToSlice(*block_relative_roi)])
-                return
+                block = self._block_data[block_roi]
+                nbytes = self._block_sizes[block_roi]
+                self._last_access_times[block_roi] = time.time()
+
+        if block_roi is not None:
+            # Data is already in the cache. Just extract it.
+            # Stored blocks are never modified (only replaced), so there's no need to hold the lock while copying.
+            block_relative_roi = numpy.array(request_roi) - block_roi[0]
+            self.Output.stype.copy_data(result, block[roiToSlice(*block_relative_roi)])
+            self.reportBlockAccess(block_roi, nbytes)
+            operatorStatistics.recordCacheAccess(self, self.Output, hit=True)
+            return
+
+        spilled_roi = self._get_containing_spilled_roi(request_roi)
+        if spilled_roi is not None:
+            # Data was evicted to disk. Load the whole block back into the cache and extract our part.
+            # (Counts as a hit: nothing is recomputed upstream.)
+            operatorStatistics.recordCacheAccess(self, self.Output, hit=True)
+            block_data = self._fetch_and_store_block(spilled_roi, out=None)
+            block_relative_roi = numpy.array(request_roi) - spilled_roi[0]
+            self.Output.stype.copy_data(result, block_data[roiToSlice(*block_relative_roi)])
+            return
 
+        operatorStatistics.recordCacheAccess(self, self.Output, hit=False)
         if self.Input.meta.dontcache:
             # Data isn't in the cache, but we don't want to cache it anyway.
             self.Input(*request_roi).writeInto(result).block()
@@ -111,15 +163,52 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         # Data isn't in the cache, so request it and cache it
         self._fetch_and_store_block(request_roi, out=result)
 
+    def isResident(self, slot, subindex, roi):
+        # Cache hits are served inline (see Slot.get)
+        return slot is self.Output and self._get_containing_block_roi((roi.start, roi.stop)) is not None
+
+    def readOnlyView(self, slot, subindex, roi):
+        if slot is not self.Output or not self.ZeroCopyEnabled.value:
+            return None
+
+        request_roi = self._standardize_roi(roi.start, roi.stop)
+        with self._lock:
+            block_roi = self._get_containing_block_roi(request_roi)
+            if block_roi is None:
+                return None
+            block = self._block_data[block_roi]
+            if not isinstance(block, numpy.ndarray) or isinstance(block, numpy.ma.MaskedArray):
+                # Compressed blocks must be decompressed, and views don't preserve masks.
+                return None
+            nbytes = self._block_sizes[block_roi]
+            self._last_access_times[block_roi] = time.time()
+
+        self.reportBlockAccess(block_roi, nbytes)
+        operatorStatistics.recordCacheAccess(self, self.Output, hit=True)
+        block_relative_roi = numpy.array(request_roi) - block_roi[0]
+        view = block[roiToSlice(*block_relative_roi)]
+        view.flags.writeable = False
+        return view
+
     def _get_containing_block_roi(self, request_roi):
         # Does this roi happen to fit ENTIRELY within an existing stored block?
         request_roi = self._standardize_roi(*request_roi)
-        outer_rois = containing_rois(list(self._block_data.keys()), request_roi)
-        if len(outer_rois) > 0:
-            # Standardize roi for usage as dict key
-            block_roi = self._standardize_roi(*outer_rois[0])
-            return block_roi
-        return None
+        if request_roi in self._block_data:
+            return request_roi
+        return self._block_index.containing(request_roi)
+
+    def _get_containing_spilled_roi(self, request_roi):
+        # Does this roi fit ENTIRELY within a block that was spilled to disk?
+        spill_store = self._spill_store
+        if spill_store is None:
+            return None
+        with self._lock:
+            while True:
+                spilled_roi = self._spill_index.containing(request_roi)
+                if spilled_roi is None or spilled_roi in spill_store:
+                    return spilled_roi
+                # The store deleted the block to stay within its budget
+                self._spill_index.remove(spilled_roi)
 
     def _fetch_and_store_block(self, block_roi, out):
         if out is not None:
@@ -136,25 +225,51 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         # without preventing parallel requests for different blocks.
         with block_lock:
             if block_roi in self._block_data:
+                block = self._block_data[block_roi]
+                nbytes = self._block_sizes.get(block_roi)
+                if nbytes is not None:
+                    self.reportBlockAccess(block_roi, nbytes)
                 if out is None:
                     # Extra [:] here is in case we are decompressing from a chunkedarray
-                    return self._block_data[block_roi][:]
+                    return block[:]
                 else:
                     # Extra [:] here is in case we are decompressing from a chunkedarray
-                    self.Output.stype.copy_data(out, self._block_data[block_roi][:])
+                    self.Output.stype.copy_data(out, block[:])
                     return out
 
+            spill_store = self._spill_store
+            spilled_block = spill_store.get(block_roi) if spill_store is not None else None
+            if spilled_block is None:
+                with self._lock:
+                    self._spill_index.remove(block_roi)
+            else:
+                # Read the block back from disk and keep it in RAM again,
+                # then serve it from RAM (rather than reading the disk file twice).
+                block = self._store_block_data(block_roi, spilled_block)
+                if block is None:
+                    block = numpy.array(spilled_block)
+                if out is None:
+                    return block[:]
+                self.Output.stype.copy_data(out, block[:])
+                return out
+
             req = self.Input(*block_roi)
             if out is not None:
                 req.writeInto(out)
+            start_time = time.time()
             block_data = req.wait()
-            self._store_block_data(block_roi, block_data)
+            self._store_block_data(block_roi, block_data, compute_time=time.time() - start_time)
         return block_data
 
-    def _store_block_data(self, block_roi, block_data):
+    def _store_block_data(self, block_roi, block_data, compute_time=None):
         """
         Copy block_data and store it into the cache.
         The block_lock is not obtained here, so lock it before you call this.
+
+        compute_time: How long it took to compute block_data upstream (seconds), if known.
+                      The memory manager's eviction policy may use it to keep expensive blocks longer.
+
+        Returns the stored block, or None if the block was removed from the cache meanwhile.
         """
         with self._lock:
             if self.CompressionEnabled.value and numpy.dtype(block_data.dtype) in [
@@ -163,7 +278,10 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
                 numpy.dtype(numpy.float32),
             ]:
                 compressed_block = vigra.ChunkedArrayCompressed(
-                    block_data.shape, vigra.Compression.LZ4, block_data.dtype
+                    block_data.shape,
+                    vigra.Compression.LZ4,
+                    block_data.dtype,
+                    chunk_shape=self._compressed_chunk_shape(block_data.shape),
                 )
                 compressed_block[:] = block_data
                 block_storage_data = compressed_block
@@ -174,10 +292,39 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             # First double-check that the block wasn't removed from the
             #   cache while we were requesting it.
             # (Could have happened via propagateDirty() or eventually the arrayCacheMemoryMgr)
-            if block_roi in self._block_locks:
+            stored = block_roi in self._block_locks
+            if stored:
+                nbytes = self._block_nbytes(block_data)
                 self._block_data[block_roi] = block_storage_data
+                self._block_sizes[block_roi] = nbytes
+                self._block_index.add(block_roi)
 
         self._last_access_times[block_roi] = time.time()
+        if not stored:
+            return None
+        self.reportBlockAccess(block_roi, nbytes, compute_time)
+        return block_storage_data
+
+    @staticmethod
+    def _block_nbytes(block):
+        return block.size * numpy.dtype(block.dtype).itemsize
+
+    @staticmethod
+    def _compressed_chunk_shape(block_shape, max_chunk_size=2 ** 16):
+        """
+        Chunk shape for compressed blocks (vigra requires powers of two).
+
+        Cache hits for a sub-roi of a compressed block only decompress the chunks the roi touches,
+        so the chunks are kept small and as cubic as possible along the non-singleton axes of the block.
+        """
+        chunk_shape = [1] * len(block_shape)
+        while numpy.prod(chunk_shape) < max_chunk_size:
+            growable = [axis for axis, extent in enumerate(block_shape) if chunk_shape[axis] < extent]
+            if not growable:
+                break
+            axis = min(growable, key=lambda axis: chunk_shape[axis])
+            chunk_shape[axis] *= 2
+        return tuple(chunk_shape)
 
     def _execute_CleanBlocks(self, slot, subindex, roi, result):
         with self._lock:
@@ -195,10 +342,14 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             block_lock = self._block_locks[block_roi]
 
         with block_lock:
+            if self._spill_store is not None:
+                with self._lock:
+                    self._spill_index.remove(block_roi)
+                self._spill_store.discard(block_roi)
             self._store_block_data(block_roi, block_data)
 
     def propagateDirty(self, slot, subindex, roi):
-        if slot is self.CompressionEnabled:
+        if slot in (self.CompressionEnabled, self.SpillBudget, self.SpillDirectory, self.ZeroCopyEnabled):
             return
 
         dirty_roi = self._standardize_roi(roi.start, roi.stop)
@@ -210,11 +361,20 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
             # Everything is dirty, so no need to loop
             self._resetBlocks()
         else:
-            # FIXME: This is O(N) for now.
-            #        We should speed this up by maintaining a bookkeeping data structure in execute().
-            for block_roi in list(self._block_data.keys()):
-                if getIntersection(block_roi, dirty_roi, assertIntersect=False):
-                    self.freeBlock(block_roi)
+            with self._lock:
+                self._spill_generation += 1
+                dirty_spilled_blocks = self._spill_index.intersecting(dirty_roi)
+                for block_roi in dirty_spilled_blocks:
+                    self._spill_index.remove(block_roi)
+            spill_store = self._spill_store
+            if spill_store is not None:
+                for block_roi in dirty_spilled_blocks:
+                    spill_store.discard(block_roi)
+
+            with self._lock:
+                dirty_blocks = self._block_index.intersecting(dirty_roi)
+            for block_roi in dirty_blocks:
+                self._free_block(block_roi, spill=False)
 
         self.Output.setDirty(roi.start, roi.stop)
 
@@ -257,22 +417,57 @@ class OpUnblockedArrayCache(Operator, ManagedBlockedCache):
         return used
 
     def freeBlock(self, key):
+        return self._free_block(key, spill=True)
+
+    def _free_block(self, key, spill):
+        """
+        Remove a block from RAM.
+        If spill is True and the disk tier is enabled, the block is written to disk first.
+        """
         with self._lock:
             if key not in self._block_locks:
                 return 0
-            block = self._block_data[key]
+            # Removing the block lock also keeps requests that are currently fetching the block from storing it.
+            del self._block_locks[key]
+            self._last_access_times.pop(key, None)
+            block = self._block_data.pop(key, None)
+            if block is None:
+                return 0
+            self._block_sizes.pop(key, None)
+            self._block_index.remove(key)
             bytes_per_pixel = numpy.dtype(block.dtype).itemsize
             mem = block.size * bytes_per_pixel
-            del self._block_data[key]
-            del self._block_locks[key]
-            del self._last_access_times[key]
-            return mem
+            spill_store = self._spill_store if spill else None
+            generation = self._spill_generation
+        self.reportBlocksFreed([key])
+
+        if spill_store is not None and not isinstance(block, numpy.ma.MaskedArray):
+            # Extra [:] here is in case we are decompressing from a chunkedarray
+            spilled = spill_store.put(key, block[:])
+            with self._lock:
+                if self._spill_generation != generation:
+                    # The block became dirty while we were writing it
+                    spill_store.discard(key)
+                elif spilled:
+                    self._spill_index.add(key)
+        return mem
 
     def freeDirtyMemory(self):
         return 0.0
 
     def _resetBlocks(self, *_):
         with self._lock:
+            self._spill_generation += 1
+            if self._spill_store is not None:
+                self._spill_store.clear()
+            freed_blocks = list(self._block_data.keys())
             self._block_data = {}
+            # Uncompressed size of each stored block in bytes, as reported to the memory manager
+            self._block_sizes = {}
+            self._block_index = RoiIndex()
+            # Blocks in the spill store (may contain blocks the store has deleted since, see _get_containing_spilled_roi)
+            self._spill_index = RoiIndex()
             self._block_locks = {}
             self._last_access_times = collections.defaultdict(float)
+        if freed_blocks:
+            self.reportBlocksFreed(freed_blocks)
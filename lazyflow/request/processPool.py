@@ -0,0 +1,233 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+"""
+Process-pool backend for GIL-bound operator code.
+
+Most of the heavy lifting in lazyflow happens in C extensions that release the GIL, so running
+requests on threads scales well.  Some operators, however, spend their time in pure-python loops
+or in numpy calls on many tiny arrays, and those don't get faster with more threads.
+
+Module-level functions decorated with :py:func:`offloadable` can be moved to a pool of worker
+processes.  Operators keep their ``execute()`` methods (they need the graph to request their
+inputs), and call an offloadable function for the GIL-bound part.  While the process pool is
+disabled (the default), an offloadable function is an ordinary function call.
+
+Arrays don't travel through pickle: ndarray arguments are copied into
+:py:class:`multiprocessing.shared_memory.SharedMemory` segments, and only the segment names, shapes
+and dtypes are sent to the worker process.  An ndarray return value comes back the same way, and an
+ndarray passed as ``out=`` is filled in place.  All other arguments and return values are pickled.
+
+Example:
+
+>>> import numpy
+>>> from lazyflow.request.processPool import offloadable
+>>> @offloadable
+... def total(a):
+...     return a.sum()
+>>> int(total(numpy.arange(10)))
+45
+
+When called from within a request, the request is suspended while the worker process is busy,
+so the thread can work on other requests in the meantime.
+"""
+
+import collections
+import concurrent.futures
+import functools
+import importlib
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+
+import numpy
+
+from .request import Request, RequestLock
+
+_executor = None
+_executor_lock = threading.Lock()
+
+#: Picklable stand-in for an ndarray that lives in a shared memory segment
+SharedArray = collections.namedtuple("SharedArray", "name shape dtype")
+
+
+def enable(num_processes=None):
+    """
+    Start the process pool (restarting it if it is running already).
+
+    :param num_processes: Number of worker processes, by default one per cpu.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        context = multiprocessing.get_context("spawn")
+        _executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_processes, mp_context=context)
+
+
+def disable():
+    """
+    Shut down the process pool.  Offloadable functions are executed in the calling thread again.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = None
+
+
+def isEnabled():
+    return _executor is not None
+
+
+def offloadable(fn):
+    """
+    Decorator for module-level functions that may be executed in the process pool.
+    The function must not depend on global state of the calling process.
+    """
+    qualname = (fn.__module__, fn.__qualname__)
+    assert "<locals>" not in fn.__qualname__, "Only module-level functions can be offloaded"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        executor = _executor
+        if executor is None:
+            return fn(*args, **kwargs)
+        return _callInProcess(executor, qualname, args, kwargs)
+
+    return wrapper
+
+
+def _share(array, segments):
+    """
+    Copy array into a new shared memory segment (appended to segments) and return its descriptor.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    segments.append(shm)
+    shared = numpy.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return SharedArray(shm.name, array.shape, array.dtype.str)
+
+
+def _callInProcess(executor, qualname, args, kwargs):
+    segments = []
+    try:
+        args = tuple(_share(a, segments) if isinstance(a, numpy.ndarray) else a for a in args)
+        kwargs = dict(kwargs)
+        out = kwargs.get("out")
+        for k, v in kwargs.items():
+            if isinstance(v, numpy.ndarray):
+                kwargs[k] = _share(v, segments)
+
+        result = _waitFor(executor.submit(_runInChild, qualname, args, kwargs))
+
+        if isinstance(out, numpy.ndarray):
+            out_shm = next(shm for shm in segments if shm.name == kwargs["out"].name)
+            out[...] = numpy.ndarray(out.shape, dtype=out.dtype, buffer=out_shm.buf)
+            if isinstance(result, SharedArray) and result == kwargs["out"]:
+                return out
+        if isinstance(result, SharedArray):
+            shm = shared_memory.SharedMemory(name=result.name)
+            segments.append(shm)
+            result = numpy.ndarray(result.shape, dtype=result.dtype, buffer=shm.buf).copy()
+        return result
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+
+
+def _waitFor(future):
+    """
+    Wait for the future without blocking the worker thread if we are running in a request.
+    """
+    if Request._current_request() is None:
+        return future.result()
+
+    # The lock is released by the executor once the result is in,
+    # until then the current request is suspended in the second acquire().
+    done = RequestLock()
+    done.acquire()
+    future.add_done_callback(lambda f: done.release())
+    try:
+        done.acquire()
+    except BaseException:
+        if not future.cancel():
+            future.add_done_callback(_discardResult)
+        raise
+    done.release()
+    return future.result()
+
+
+def _discardResult(future):
+    # The caller is gone (e.g. its request was cancelled), free the segment of an array result.
+    if not future.cancelled() and future.exception() is None and isinstance(future.result(), SharedArray):
+        shm = shared_memory.SharedMemory(name=future.result().name)
+        shm.close()
+        shm.unlink()
+
+
+def _runInChild(qualname, args, kwargs):
+    """
+    Entry point in the worker process: attach to the shared arrays and call the undecorated function.
+    """
+    module_name, name = qualname
+    fn = importlib.import_module(module_name)
+    for attr in name.split("."):
+        fn = getattr(fn, attr)
+    fn = fn.__wrapped__
+
+    segments = []
+
+    def attach(a):
+        if not isinstance(a, SharedArray):
+            return a
+        # The worker shares the resource tracker with the parent, so the segment stays registered once
+        # and is unregistered when the parent unlinks it.
+        shm = shared_memory.SharedMemory(name=a.name)
+        segments.append(shm)
+        return numpy.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
+
+    out = kwargs.get("out")
+    result = None
+    try:
+        args = [attach(a) for a in args]
+        kwargs = {k: attach(v) for k, v in kwargs.items()}
+        result = fn(*args, **kwargs)
+        if not isinstance(result, numpy.ndarray):
+            return result
+        if isinstance(out, SharedArray) and result is kwargs["out"]:
+            return out
+        shm = shared_memory.SharedMemory(create=True, size=max(result.nbytes, 1))
+        segments.append(shm)
+        numpy.ndarray(result.shape, dtype=result.dtype, buffer=shm.buf)[...] = result
+        return SharedArray(shm.name, result.shape, result.dtype.str)
+    finally:
+        # Views on the segments must be gone before they can be closed
+        args = kwargs = result = None
+        for shm in segments:
+            try:
+                shm.close()
+            except BufferError:
+                # Still referenced by the traceback of an exception, the parent unlinks it anyway.
+                pass
@@ -22,6 +22,7 @@ from future.utils import raise_with_traceback
 # 		   http://ilastik.org/license/
 ###############################################################################
 # Built-in
+import asyncio
 import collections
 import sys
 import heapq
@@ -32,6 +33,7 @@ import multiprocessing
 import platform
 import traceback
 import io
+from contextlib import contextmanager
 from random import randrange
 from typing import Callable
 from numpy import ma
@@ -107,6 +109,41 @@ def log_exception(logger, msg=None, exc_info=None, level=logging.ERROR):
         logger.log(level, msg)
 
 
+def _as_awaitable(request, loop=None):
+    """
+    Return an asyncio future that is resolved when the given request (or request-like object) completes,
+    and submit the request.  Cancelling the future cancels the request.
+
+    The future belongs to the given event loop (by default, the running loop).
+    """
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(method, *args):
+        if not future.done():
+            method(*args)
+
+    def resolve_threadsafe(method, *args):
+        # Request callbacks are called in the thread that completes the request
+        try:
+            loop.call_soon_threadsafe(resolve, method, *args)
+        except RuntimeError:
+            # The loop was closed in the meantime, nobody is waiting any more
+            pass
+
+    def cancel_request(f):
+        if f.cancelled():
+            request.cancel()
+
+    request.notify_finished(lambda result: resolve_threadsafe(future.set_result, result))
+    request.notify_failed(lambda exc, exc_info: resolve_threadsafe(future.set_exception, exc))
+    request.notify_cancelled(lambda: resolve_threadsafe(future.cancel))
+    future.add_done_callback(cancel_request)
+    request.submit()
+    return future
+
+
 class Request(object):
 
     # One thread pool shared by all requests.
@@ -117,8 +154,22 @@ class Request(object):
     class_lock = threading.Lock()
     active_count = 0
 
+    # The active RequestTracer, if any (see lazyflow.request.tracing)
+    _tracer = None
+
+    #: Priority classes.  When several classes have work queued, the ThreadPool
+    #: gives each a fair share of the workers (see threadPool.DEFAULT_PRIORITY_SHARES).
+    INTERACTIVE = threadPool.PRIORITY_INTERACTIVE
+    BATCH = threadPool.PRIORITY_BATCH
+    PREFETCH = threadPool.PRIORITY_PREFETCH
+
+    # Per (foreign) thread default priority class, see using_priority_class()
+    _thread_priority_class = threading.local()
+
     @classmethod
-    def reset_thread_pool(cls, num_workers=min(multiprocessing.cpu_count(), 8)):
+    def reset_thread_pool(
+        cls, num_workers=min(multiprocessing.cpu_count(), 8), work_stealing=False, priority_shares=None
+    ):
         """
         Change the number of threads allocated to the request system.
 
@@ -127,6 +178,12 @@ class Request(object):
                             workers, even on machines with many CPUs.
                             For more details, see:
                             https://github.com/ilastik/ilastik/issues/1458
+        :param work_stealing: If True, use a ``WorkStealingThreadPool``, in which each worker has its own
+                              task queue and idle workers steal from busy ones, instead of one queue shared
+                              by all workers.  This scales better to large numbers of workers.
+        :param priority_shares: Relative share of the workers per priority class,
+                                e.g. ``{Request.INTERACTIVE: 16, Request.BATCH: 4, Request.PREFETCH: 1}``
+                                (the default).
 
         As a special case, you may set ``num_workers`` to 0.
         In that case, the normal thread pool is not used at all.
@@ -142,7 +199,31 @@ class Request(object):
 
             if cls.global_thread_pool is not None:
                 cls.global_thread_pool.stop()
-            cls.global_thread_pool = threadPool.ThreadPool(num_workers)
+            if work_stealing:
+                cls.global_thread_pool = threadPool.WorkStealingThreadPool(num_workers, priority_shares)
+            else:
+                cls.global_thread_pool = threadPool.ThreadPool(num_workers, priority_shares)
+
+    @classmethod
+    @contextmanager
+    def using_priority_class(cls, priority_class):
+        """
+        Context manager: requests created by the current thread get the given priority class by default.
+
+        This only affects requests created outside of any request (i.e. in foreign threads),
+        since requests created within a request inherit the class of their parent.
+        Inside a request, pass ``priority_class`` to the Request constructor instead.
+
+        >>> with Request.using_priority_class(Request.BATCH):
+        ...     Request(lambda: 42).priority_class
+        'batch'
+        """
+        previous = getattr(cls._thread_priority_class, "name", None)
+        cls._thread_priority_class.name = priority_class
+        try:
+            yield
+        finally:
+            cls._thread_priority_class.name = previous
 
     class CancellationException(Exception):
         """
@@ -197,10 +278,15 @@ class Request(object):
 
     _root_request_counter = itertools.count()
 
-    def __init__(self, fn, root_priority=[0]):
+    def __init__(self, fn, root_priority=[0], priority_class=None):
         """
         Constructor.
         Postconditions: The request has the same cancelled status as its parent (the request that is creating this one).
+
+        :param priority_class: One of Request.INTERACTIVE, Request.BATCH or Request.PREFETCH.
+                               By default, the class of the parent request is inherited.
+                               Root requests get the default of their thread (see using_priority_class),
+                               or Request.INTERACTIVE.
         """
 
         self._lock = threading.Lock()  # NOT an RLock, since requests may share threads
@@ -208,7 +294,23 @@ class Request(object):
         self._sig_cancelled = SimpleSignal()
         self._sig_finished = SimpleSignal()
         self._sig_execution_complete = SimpleSignal()
+        self.finished_event = threading.Event()
+
+        # Request relationships
+        self.pending_requests = set()  # Requests that are waiting for this one
+        self.blocking_requests = (
+            set()
+        )  # Requests that this one is waiting for (currently one at most since wait() can only be called on one request at a time)
+        self.child_requests = (
+            set()
+        )  # Requests that were created from within this request (NOT the same as pending_requests)
+
+        self._init_state(fn, root_priority, priority_class)
 
+    def _init_state(self, fn, root_priority, priority_class):
+        """
+        Initialize the workload, the state and the priority of this request (see __init__).
+        """
         # Workload
         self.fn = fn
 
@@ -221,7 +323,6 @@ class Request(object):
         self.uncancellable = False
         self.finished = False
         self.execution_complete = False
-        self.finished_event = threading.Event()
         self.exception = None
         self.exception_info = (None, None, None)
         self._cleaned = False
@@ -230,22 +331,17 @@ class Request(object):
         self.greenlet = None  # Not created until assignment to a worker
         self._assigned_worker = None
 
-        # Request relationships
-        self.pending_requests = set()  # Requests that are waiting for this one
-        self.blocking_requests = (
-            set()
-        )  # Requests that this one is waiting for (currently one at most since wait() can only be called on one request at a time)
-        self.child_requests = (
-            set()
-        )  # Requests that were created from within this request (NOT the same as pending_requests)
-
         self._current_foreign_thread = None
         current_request = Request._current_request()
         self.parent_request = current_request
         self._max_child_priority = 0
         if current_request is None:
             self._priority = root_priority + [next(Request._root_request_counter)]
+            if priority_class is None:
+                priority_class = getattr(Request._thread_priority_class, "name", None) or Request.INTERACTIVE
         else:
+            if priority_class is None:
+                priority_class = current_request.priority_class
             with current_request._lock:
                 current_request.child_requests.add(self)
                 # We must ensure that we get the same cancelled status as our parent.
@@ -254,6 +350,13 @@ class Request(object):
                 current_request._max_child_priority += 1
                 self._priority = current_request._priority + root_priority + [current_request._max_child_priority]
 
+        #: Used by the ThreadPool for fair-share scheduling.  Inherited by child requests.
+        #: May be changed before the request is submitted.
+        self.priority_class = priority_class
+
+        tracer = Request._tracer
+        self._trace_id = None if tracer is None else tracer.request_created(self)
+
     def __lt__(self, other):
         """
         Request comparison is by priority.
@@ -291,6 +394,24 @@ class Request(object):
         """
         return _ValueRequest(value)
 
+    @classmethod
+    def inline(cls, fn):
+        """
+        Creates a request for a cheap workload (e.g. data that is already resident in a cache),
+        for which the scheduling overhead would dominate the actual work.
+
+        The signals, the finished event and the bookkeeping sets of the request are only created
+        on first use. If the request is waited for before anybody else started it, the workload is
+        executed right away in the caller and none of them are needed.
+        Otherwise, it behaves like any other request (e.g. callbacks of a submitted request
+        are called by the worker that executes it, never from submit() itself).
+
+        Example:
+        >>> Request.inline(lambda: 42).wait()
+        42
+        """
+        return _InlineRequest(fn)
+
     def clean(self, _fullClean=True):
         """
         Delete all state from the request, for cleanup purposes.
@@ -353,6 +474,10 @@ class Request(object):
         """
         Do the real work of this request.
         """
+        tracer = Request._tracer
+        if tracer is not None and self._trace_id is not None:
+            tracer.record("start", self._trace_id)
+
         # Did someone cancel us before we even started?
         if not self.cancelled:
             try:
@@ -443,10 +568,17 @@ class Request(object):
             with Request.class_lock:
                 Request.active_count -= 1
 
+            tracer = Request._tracer
+            if tracer is not None and self._trace_id is not None:
+                tracer.record("finish", self._trace_id)
+
     def submit(self):
         """
         If this request isn't started yet, schedule it to be started.
         """
+        tracer = Request._tracer
+        if tracer is not None and self._trace_id is not None:
+            tracer.record("submit", self._trace_id)
         if Request.global_thread_pool.num_workers > 0:
             with self._lock:
                 if not self.started:
@@ -516,9 +648,18 @@ class Request(object):
         """
         Suspend this request so another one can be woken up by the worker.
         """
+        tracer = Request._tracer
+        if tracer is not None:
+            # Everything running in this greenlet is suspended, not just self
+            # (see the direct execution in _wait_within_request)
+            suspended = tuple(r._trace_id for r in self.greenlet.owning_requests if r._trace_id is not None)
+            tracer.record("suspend", suspended)
+
         # Switch back to the worker that we're currently running in.
         try:
             self.greenlet.parent.switch()
+            if tracer is not None:
+                tracer.record("resume", suspended)
         except greenlet.error:
             logger.critical(
                 "Current thread ({}) could not suspend task: {}.  (parent greenlet={})".format(
@@ -847,6 +988,30 @@ class Request(object):
     def getResult(self):
         return self.result
 
+    ##########################
+    #### asyncio support  ####
+    ##########################
+
+    def as_awaitable(self, loop=None):
+        """
+        Submit this request and return an asyncio future for its result,
+        so it can be awaited without blocking a thread:
+
+        >>> async def get_answer():
+        ...     return await Request(lambda: 42).as_awaitable()
+        >>> asyncio.run(get_answer())
+        42
+
+        Cancelling the future (e.g. by cancelling the task that awaits it) cancels the request,
+        and a cancelled request cancels the future.
+
+        :param loop: The event loop of the future.  By default, the running loop.
+        """
+        return _as_awaitable(self, loop)
+
+    def __await__(self):
+        return self.as_awaitable().__await__()
+
 
 Request.reset_thread_pool()
 
@@ -1473,6 +1638,144 @@ class RequestPool(object):
             self.clean()
 
 
+class RequestStream(object):
+    """
+    Streaming counterpart of :py:class:`RequestPool`, for fanning out over a huge number of work items.
+
+    Instead of a pre-built set of requests, a RequestStream takes a function and an iterable
+    (typically a generator) of work items.  Items are pulled from the iterable lazily, so at most
+    ``max_active`` requests (running, or finished but not yet consumed) are alive at any time.
+    Iterating over the stream yields ``(item, result)`` tuples in completion order.
+
+    The first failure stops the stream: no further items are pulled, requests that haven't started
+    yet are skipped, the active ones are cancelled (as far as the request framework allows),
+    and the exception is re-raised to the consumer.  Abandoning the iteration early (e.g. via
+    ``break``) stops the stream in the same way.
+
+    >>> stream = RequestStream(lambda x: x * x, range(10), max_active=3)
+    >>> sorted(result for item, result in stream)
+    [0, 1, 4, 9, 16, 25, 36, 49, 64, 81]
+    """
+
+    def __init__(self, fn, items, max_active=None):
+        """
+        fn: The workload function, called as ``fn(item)`` in a request for every item.
+        items: Iterable of work items.  Consumed lazily.
+        max_active: The number of requests alive at the same time.  Defaults to the number of workers.
+        """
+        self._fn = fn
+        self._items = iter(items)
+        max_active = max_active or 0
+        self._max_active = max_active or max(1, Request.global_thread_pool.num_workers)
+
+        self._condition = SimpleRequestCondition()
+        self._active_requests = set()
+        self._completed = collections.deque()  # (item, result) pairs, not yet consumed
+        self._failed_request = None
+        self._started = False
+        self._stopped = False
+
+    def __len__(self):
+        """
+        Returns the number of requests that are currently alive (running, or finished but not consumed).
+        """
+        with self._condition:
+            return len(self._active_requests) + len(self._completed)
+
+    def __iter__(self):
+        if self._started:
+            raise RequestPool.RequestPoolError("Can't re-start a RequestStream that was already started.")
+        self._started = True
+        return self._stream()
+
+    def _stream(self):
+        exhausted = False
+        try:
+            while True:
+                # Launch new requests until we're at the max again
+                while not exhausted:
+                    with self._condition:
+                        alive = len(self._active_requests) + len(self._completed)
+                        if self._failed_request is not None or alive >= self._max_active:
+                            break
+                    try:
+                        item = next(self._items)
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        self._launch(item)
+
+                # Wait for a result, unless we can launch more requests
+                with self._condition:
+                    while (
+                        not self._completed
+                        and self._failed_request is None
+                        and self._active_requests
+                        and (exhausted or len(self._active_requests) >= self._max_active)
+                    ):
+                        self._condition.wait()
+
+                    failed_request = self._failed_request
+                    if failed_request is None and self._completed:
+                        next_result = self._completed.popleft()
+                    elif failed_request is None and exhausted and not self._active_requests:
+                        return
+                    else:
+                        next_result = None
+
+                if failed_request is not None:
+                    self._stop()
+                    # Re-raises the request's exception in our own context
+                    failed_request.block()
+                    # No exception: it was cancelled (from the outside)
+                    raise Request.CancellationException()
+
+                if next_result is not None:
+                    yield next_result
+        finally:
+            self._stop()
+
+    def _launch(self, item):
+        req = Request(functools.partial(self._execute_item, item))
+        with self._condition:
+            self._active_requests.add(req)
+        req.notify_finished(functools.partial(self._handle_finished, req, item))
+        req.notify_failed(functools.partial(self._handle_failed, req))
+        req.notify_cancelled(functools.partial(self._handle_failed, req))
+        req.submit()
+
+    def _execute_item(self, item):
+        if self._stopped:
+            # Don't bother: the stream has failed or was abandoned.
+            return None
+        return self._fn(item)
+
+    def _handle_finished(self, req, item, result):
+        with self._condition:
+            self._active_requests.discard(req)
+            if not self._stopped:
+                self._completed.append((item, result))
+            self._condition.notify()
+
+    def _handle_failed(self, req, *args):
+        with self._condition:
+            self._active_requests.discard(req)
+            if not self._stopped and self._failed_request is None:
+                self._failed_request = req
+            self._condition.notify()
+
+    def _stop(self):
+        """
+        Stop pulling new items, and cancel the requests that are still active.
+        """
+        with self._condition:
+            self._stopped = True
+            self._completed.clear()
+            active_requests = list(self._active_requests)
+        for req in active_requests:
+            req.cancel()
+
+
 class RequestPool_SIMPLE(object):
     # This simplified version doesn't attempt to be efficient with RAM like the standard version (above).
     # It is provided here as a simple reference implementation for comparison and testing purposes.
@@ -1537,6 +1840,111 @@ class RequestPool_SIMPLE(object):
         self._requests = set()
 
 
+class _InlineRequest(Request):
+    """
+    Request for a cheap workload, see Request.inline().
+
+    The members in _LAZY_MEMBERS are created on first use (by __getattr__).
+    wait() executes an unstarted request directly if none of them exist,
+    i.e. if nobody else has subscribed to or is waiting for the request.
+    """
+
+    _LAZY_MEMBERS = {
+        "_sig_failed": SimpleSignal,
+        "_sig_cancelled": SimpleSignal,
+        "_sig_finished": SimpleSignal,
+        "_sig_execution_complete": SimpleSignal,
+        "finished_event": threading.Event,
+        "pending_requests": set,
+        "blocking_requests": set,
+        "child_requests": set,
+    }
+
+    def __init__(self, fn):
+        self._lock = threading.Lock()
+        self._init_state(fn, [0], None)
+
+    def __getattr__(self, name):
+        factory = _InlineRequest._LAZY_MEMBERS.get(name)
+        if factory is None:
+            raise AttributeError(name)
+        # dict.setdefault is atomic, so concurrent first uses get the same member
+        member = self.__dict__.setdefault(name, factory())
+        if name == "finished_event" and self.execution_complete:
+            # Completed by the direct execution in _wait(), which doesn't set the event
+            member.set()
+        return member
+
+    def _lazy_members_in_use(self):
+        return any(name in self.__dict__ for name in _InlineRequest._LAZY_MEMBERS)
+
+    def _wait(self, timeout=None):
+        if self.execution_complete and not self.cancelled and self.exception is None:
+            return self._result
+
+        with self._lock:
+            direct_execute = (
+                not self.started and not self.cancelled and self._trace_id is None and not self._lazy_members_in_use()
+            )
+            if direct_execute:
+                self.started = True
+        if not direct_execute:
+            return super()._wait(timeout)
+
+        cancelled = False
+        try:
+            self._result = self.fn()
+        except Request.CancellationException:
+            # As in _execute(): don't store it, the current request was cancelled (see below)
+            cancelled = True
+        except Exception as ex:
+            self.exception = ex
+            self.exception_info = sys.exc_info()
+
+        with self._lock:
+            # Somebody may have subscribed to (or started waiting for) this request in the meantime
+            notify = self._lazy_members_in_use()
+            if not notify:
+                self.finished = True
+                self.execution_complete = True
+
+        if notify:
+            current_request = Request._current_request()
+            if current_request is not None:
+                # (So failures are propagated to the current request instead of being reported as unhandled.)
+                self.pending_requests.add(current_request)
+            with Request.class_lock:
+                # Balanced by _post_execute()
+                Request.active_count += 1
+            self._post_execute()
+            if current_request is not None:
+                self.pending_requests.discard(current_request)
+        else:
+            self.clean(_fullClean=False)
+
+        if cancelled:
+            Request.raise_if_cancelled()
+        if self.exception is not None:
+            exc_type, exc_value, exc_tb = self.exception_info
+            raise_with_traceback(exc_value, exc_tb)
+        return self._result
+
+    def clean(self, _fullClean=True):
+        if self._lazy_members_in_use():
+            super().clean(_fullClean)
+            return
+
+        # Nothing to clean but the relationship to the parent (and the result)
+        parent_request = self.parent_request
+        if parent_request is not None:
+            with parent_request._lock:
+                parent_request.child_requests.discard(self)
+
+        if _fullClean:
+            self._cleaned = True
+            self._result = None
+
+
 class _ValueRequest:
     """
     Pseudo request that behaves like a request.Request object.
@@ -1567,6 +1975,15 @@ class _ValueRequest:
     def notify_cancelled(self, callback):
         pass
 
+    def cancel(self):
+        pass
+
+    def as_awaitable(self, loop=None):
+        return _as_awaitable(self, loop)
+
+    def __await__(self):
+        return self.as_awaitable().__await__()
+
     def clean(self):
         self.result = None
 
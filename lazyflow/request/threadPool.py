@@ -21,6 +21,7 @@
 ###############################################################################
 
 import atexit
+import heapq
 import logging
 import queue
 import threading
@@ -28,17 +29,88 @@ from typing import Callable, List
 
 logger = logging.getLogger(__name__)
 
+# Priority classes of tasks (see Request.priority_class).
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_PREFETCH = "prefetch"
+DEFAULT_PRIORITY_CLASS = PRIORITY_INTERACTIVE
+
+#: Relative share of the workers each priority class gets while several classes have tasks waiting.
+#: Classes that aren't listed get a share of 1.
+DEFAULT_PRIORITY_SHARES = {PRIORITY_INTERACTIVE: 16, PRIORITY_BATCH: 4, PRIORITY_PREFETCH: 1}
+
+
+def _priority_class(task) -> str:
+    return getattr(task, "priority_class", DEFAULT_PRIORITY_CLASS)
+
+
+class FairShareQueue:
+    """Queue of unassigned tasks with one priority queue per priority class.
+
+    Classes are served by stride scheduling: every time a class is served, its virtual time advances
+    by ``1 / share``, and the class with the smallest virtual time is served next.  So while several
+    classes have tasks waiting, each class gets its share of the dispatches (e.g. 16:4:1), and no class
+    is starved.  A class that had nothing to do doesn't accumulate credit: when it becomes busy again,
+    it starts at the virtual time of the busy classes.
+
+    Within a class, tasks are popped in priority order.
+    Same (non-blocking) interface as the ``queue.PriorityQueue`` it replaces.
+    """
+
+    def __init__(self, shares=None):
+        self._lock = threading.Lock()
+        self._shares = dict(DEFAULT_PRIORITY_SHARES if shares is None else shares)
+        assert all(share > 0 for share in self._shares.values())
+        self._queues = {}
+        self._virtual_times = {}
+
+    def put_nowait(self, task) -> None:
+        priority_class = _priority_class(task)
+        with self._lock:
+            heap = self._queues.setdefault(priority_class, [])
+            if not heap:
+                busy_times = [self._virtual_times[c] for c, q in self._queues.items() if q]
+                self._virtual_times[priority_class] = max(
+                    self._virtual_times.get(priority_class, 0.0), min(busy_times, default=0.0)
+                )
+            heapq.heappush(heap, task)
+
+    def get_nowait(self):
+        with self._lock:
+            busy = [c for c, q in self._queues.items() if q]
+            if not busy:
+                raise queue.Empty()
+            # Ties go to the class with the bigger share
+            priority_class = min(busy, key=lambda c: (self._virtual_times[c], -self.share(c)))
+            self._virtual_times[priority_class] += 1.0 / self.share(priority_class)
+            return heapq.heappop(self._queues[priority_class])
+
+    def share(self, priority_class) -> float:
+        return self._shares.get(priority_class, 1)
+
+    def qsize(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
 
 class ThreadPool:
     """Manages a set of worker threads and dispatches tasks to them.
 
+    New tasks are dispatched by fair-share between their priority classes (see FairShareQueue).
+
     Attributes:
         num_workers: The number of worker threads.
     """
 
-    def __init__(self, num_workers: int):
-        """Start all workers."""
-        self.unassigned_tasks = queue.PriorityQueue()
+    def __init__(self, num_workers: int, priority_shares=None):
+        """Start all workers.
+
+        priority_shares: Relative worker share per priority class, see DEFAULT_PRIORITY_SHARES.
+        """
+        self.unassigned_tasks = FairShareQueue(priority_shares)
 
         self.workers = {_Worker(self, i) for i in range(num_workers)}
         for w in self.workers:
@@ -182,3 +254,169 @@ class _Worker(threading.Thread):
                 # You may have to wrap it in a custom class first.
                 task.assigned_worker = self
                 return task
+
+
+class WorkStealingThreadPool(ThreadPool):
+    """A ThreadPool in which every worker owns its own queue of unassigned tasks.
+
+    New tasks are handed to a single idle worker (only that worker is notified).
+    If no worker is idle, the task is queued on the submitting worker (or the least loaded one),
+    and workers that run out of work steal the highest-priority task from the busiest peer.
+    Tasks that have already been started stay bound to their assigned worker, just like in ThreadPool.
+
+    Every local queue is a FairShareQueue, so the priority classes get their shares of the tasks
+    each worker runs, whether it pops them from its own queue or steals them from a peer.
+
+    Attributes:
+        num_workers: The number of worker threads.
+    """
+
+    def __init__(self, num_workers: int, priority_shares=None):
+        """Start all workers.
+
+        priority_shares: Relative worker share per priority class, see DEFAULT_PRIORITY_SHARES.
+        """
+        self.priority_shares = priority_shares
+        self._idle_lock = threading.Lock()
+        self._idle_workers = []
+
+        self._worker_list = [_StealingWorker(self, i) for i in range(num_workers)]
+        self.workers = set(self._worker_list)
+        for w in self._worker_list:
+            w.start()
+
+        atexit.register(self.stop)
+
+    def wake_up(self, task: Callable[[], None]) -> None:
+        """Schedule the given task on the worker that is assigned to it.
+
+        If it has no assigned worker yet, hand it to an idle worker, or queue it locally on a busy one.
+        """
+        if hasattr(task, "assigned_worker") and task.assigned_worker is not None:
+            task.assigned_worker.wake_up(task)
+            return
+
+        target = self._pop_idle_worker()
+        if target is not None:
+            target.push_unassigned(task)
+            target.notify()
+            return
+
+        current = threading.current_thread()
+        if current in self.workers:
+            # Keep child tasks close to their parent
+            target = current
+        else:
+            target = min(self._worker_list, key=len)
+        target.push_unassigned(task)
+
+        # A worker might have gone idle while we were queueing the task on a busy one.
+        # Let it come and steal the task.
+        idle = self._pop_idle_worker()
+        if idle is not None:
+            idle.notify()
+
+    def _pop_idle_worker(self):
+        with self._idle_lock:
+            if self._idle_workers:
+                return self._idle_workers.pop()
+            return None
+
+    def _register_idle(self, worker) -> None:
+        with self._idle_lock:
+            if worker not in self._idle_workers:
+                self._idle_workers.append(worker)
+
+    def _unregister_idle(self, worker) -> None:
+        with self._idle_lock:
+            if worker in self._idle_workers:
+                self._idle_workers.remove(worker)
+
+    def _steal(self, thief):
+        """Take the highest-priority unassigned task from the worker with the longest local queue."""
+        victims = sorted((w for w in self._worker_list if w is not thief), key=len, reverse=True)
+        for victim in victims:
+            task = victim.pop_unassigned()
+            if task is not None:
+                return task
+        return None
+
+
+class _StealingWorker(_Worker):
+    """Worker of a WorkStealingThreadPool.
+
+    In addition to the queue of resumed tasks (which are bound to this worker),
+    it keeps a local queue of unassigned tasks that idle peers may steal from.
+    """
+
+    def __init__(self, thread_pool, index):
+        super().__init__(thread_pool, index)
+        self._local_tasks = FairShareQueue(thread_pool.priority_shares)
+
+    def __len__(self):
+        return self._local_tasks.qsize()
+
+    def push_unassigned(self, task):
+        self._local_tasks.put_nowait(task)
+
+    def pop_unassigned(self):
+        try:
+            return self._local_tasks.get_nowait()
+        except queue.Empty:
+            return None
+
+    def notify(self):
+        with self.job_queue_condition:
+            self.job_queue_condition.notify()
+
+    def _get_next_job(self):
+        """Get the next available job to perform.
+
+        If necessary, register as idle and block until a task is available or the worker has been stopped.
+        """
+        with self.job_queue_condition:
+            if self.stopped:
+                return None
+            next_task = self._pop_job()
+
+            while next_task is None and not self.stopped:
+                # Announce that we're idle, then look once more so that a task queued
+                # on a busy peer in the meantime can't slip past us.
+                self.thread_pool._register_idle(self)
+                next_task = self._pop_job()
+                if next_task is not None:
+                    self.thread_pool._unregister_idle(self)
+                    break
+
+                self.job_queue_condition.wait()
+                self.thread_pool._unregister_idle(self)
+                if self.stopped:
+                    return None
+                next_task = self._pop_job()
+
+        if not self.stopped:
+            assert next_task is not None
+            assert next_task.assigned_worker is self
+
+        return next_task
+
+    def _pop_job(self):
+        """Get a job from our own job queue, then from our local unassigned tasks, then from the busiest peer.
+
+        Return None if there is no work to do anywhere.
+
+        Non-blocking.
+        """
+        try:
+            return self.job_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        task = self.pop_unassigned()
+        if task is None:
+            task = self.thread_pool._steal(self)
+        if task is None:
+            return None
+
+        task.assigned_worker = self
+        return task
@@ -0,0 +1,258 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+"""
+Low-overhead tracing of request execution.
+
+While a :py:class:`RequestTracer` is active, every :py:class:`Request<lazyflow.request.Request>`
+records when it is created, submitted, started, suspended and resumed, and finished, along with
+the thread it ran on, its parent request, and (for slot requests) the owning operator and slot.
+
+Example:
+
+>>> from lazyflow.request import Request
+>>> with RequestTracer() as tracer:
+...     Request(lambda: 42).wait()
+42
+>>> len(tracer.requests)
+1
+
+The recorded trace can be exported to the Chrome trace / Perfetto JSON format
+(:py:meth:`RequestTracer.exportChromeTrace`, open it in ``chrome://tracing`` or https://ui.perfetto.dev)
+and to the collapsed-stack format of flame graph tools like ``flamegraph.pl`` or speedscope
+(:py:meth:`RequestTracer.exportCollapsedStacks`).
+"""
+
+import collections
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+from .request import Request
+
+# Trace ids are unique across tracers, so stale requests from an earlier tracer can be recognized.
+_trace_ids = itertools.count()
+
+#: Bookkeeping for each traced request
+RequestInfo = collections.namedtuple("RequestInfo", "trace_id parent_id name operator slot")
+
+
+def _describe_workload(fn):
+    """
+    Return (name, operator name, slot name) for the workload of a request.
+    """
+    # Slot requests are executed via Slot.RequestExecutionWrapper, which knows the operator and slot.
+    operator = getattr(fn, "operator", None)
+    slot = getattr(fn, "slot", None)
+    if operator is not None and slot is not None:
+        return "{}.{}".format(operator.name, slot.name), operator.name, slot.name
+
+    while isinstance(fn, functools.partial):
+        fn = fn.func
+    name = getattr(fn, "__qualname__", None) or getattr(fn, "__name__", None) or type(fn).__name__
+    return name, None, None
+
+
+class RequestTracer(object):
+    """
+    Records the life cycle of all requests created while it is active.
+    Use it as a context manager (or call :py:meth:`start`/:py:meth:`stop`).
+    Only one tracer can be active at a time.
+
+    Recording an event is a single list append, so tracing is cheap enough to leave
+    enabled for a whole workflow run.  All the analysis happens at export time.
+    """
+
+    def __init__(self):
+        self._requests = {}
+        self._events = []
+        self._thread_names = {}
+
+    def start(self):
+        assert Request._tracer is None, "Another RequestTracer is already active."
+        Request._tracer = self
+        return self
+
+    def stop(self):
+        if Request._tracer is self:
+            Request._tracer = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def requests(self):
+        """
+        All requests created while tracing, as a dict of ``{trace_id: RequestInfo}``.
+        """
+        return dict(self._requests)
+
+    def request_created(self, request):
+        """
+        Called from the Request constructor.  Returns the request's trace id.
+        """
+        trace_id = next(_trace_ids)
+        parent = request.parent_request
+        parent_id = None if parent is None else parent._trace_id
+        name, operator, slot = _describe_workload(request.fn)
+        self._requests[trace_id] = RequestInfo(trace_id, parent_id, name, operator, slot)
+        self.record("create", trace_id)
+        return trace_id
+
+    def record(self, kind, trace_ids):
+        """
+        Record an event for the given request (or tuple of requests, for 'suspend' and 'resume').
+        """
+        thread_id = threading.get_ident()
+        if thread_id not in self._thread_names:
+            self._thread_names[thread_id] = threading.current_thread().name
+        self._events.append((time.perf_counter(), kind, trace_ids, thread_id))
+
+    def _intervals(self):
+        """
+        Replay the recorded events per thread.
+
+        Returns ``(slices, self_times, queued)``:
+
+        - slices: list of ``(thread_id, trace_id, begin, end)``, the intervals in which a request was running.
+          Slices of requests that run directly inside a waiting request (in the same greenlet) are nested.
+        - self_times: dict ``{trace_id: seconds}``, running time excluding directly executed child requests
+        - queued: dict ``{trace_id: seconds}``, time between submission and start
+        """
+        events = sorted(self._events, key=lambda e: e[0])
+        slices = []
+        self_times = collections.defaultdict(float)
+        queued = {}
+        submitted = {}
+
+        # Per thread: stack of [trace_id, slice begin]
+        stacks = collections.defaultdict(list)
+        last_time = {}
+
+        def close(thread_id, trace_id, timestamp):
+            stack = stacks[thread_id]
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == trace_id:
+                    slices.append((thread_id, trace_id, stack[i][1], timestamp))
+                    del stack[i]
+                    return
+
+        for timestamp, kind, trace_ids, thread_id in events:
+            stack = stacks[thread_id]
+            if stack:
+                self_times[stack[-1][0]] += timestamp - last_time[thread_id]
+            last_time[thread_id] = timestamp
+
+            if kind == "submit":
+                submitted.setdefault(trace_ids, timestamp)
+            elif kind == "start":
+                if trace_ids in submitted:
+                    queued[trace_ids] = timestamp - submitted[trace_ids]
+                stack.append([trace_ids, timestamp])
+            elif kind == "finish":
+                close(thread_id, trace_ids, timestamp)
+            elif kind == "suspend":
+                for trace_id in reversed(trace_ids):
+                    close(thread_id, trace_id, timestamp)
+            elif kind == "resume":
+                for trace_id in trace_ids:
+                    stack.append([trace_id, timestamp])
+
+        # Requests that were still running when the trace ended
+        end = events[-1][0] if events else 0.0
+        for thread_id, stack in stacks.items():
+            for trace_id, begin in stack:
+                slices.append((thread_id, trace_id, begin, end))
+        return slices, dict(self_times), queued
+
+    def exportChromeTrace(self, path):
+        """
+        Write the trace in the Chrome trace event format (JSON), as understood by
+        ``chrome://tracing`` and https://ui.perfetto.dev.
+        Each running interval of a request becomes one 'complete' event on the row of its thread.
+        """
+        slices, self_times, queued = self._intervals()
+        pid = os.getpid()
+        t0 = min((s[2] for s in slices), default=0.0)
+
+        trace_events = []
+        for thread_id, name in self._thread_names.items():
+            trace_events.append(
+                {"ph": "M", "name": "thread_name", "pid": pid, "tid": thread_id, "args": {"name": name}}
+            )
+
+        for thread_id, trace_id, begin, end in slices:
+            info = self._requests.get(trace_id)
+            if info is None:
+                continue
+            args = {"request": trace_id, "parent": info.parent_id}
+            if info.operator is not None:
+                args["operator"] = info.operator
+                args["slot"] = info.slot
+            if trace_id in queued:
+                args["queued_us"] = round(queued[trace_id] * 1e6, 3)
+            trace_events.append(
+                {
+                    "ph": "X",
+                    "name": info.name,
+                    "cat": "request",
+                    "pid": pid,
+                    "tid": thread_id,
+                    "ts": (begin - t0) * 1e6,
+                    "dur": (end - begin) * 1e6,
+                    "args": args,
+                }
+            )
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+    def collapsedStacks(self):
+        """
+        Return the self time of all requests (in microseconds), aggregated by their stack of
+        request names from the root request down, as a dict ``{"root;child;grandchild": microseconds}``.
+        """
+        _, self_times, _ = self._intervals()
+        stacks = collections.Counter()
+        for trace_id, seconds in self_times.items():
+            names = []
+            while trace_id is not None and trace_id in self._requests:
+                info = self._requests[trace_id]
+                names.append(info.name.replace(";", ":"))
+                trace_id = info.parent_id
+            stacks[";".join(reversed(names))] += seconds * 1e6
+        return {stack: int(round(us)) for stack, us in stacks.items() if us >= 0.5}
+
+    def exportCollapsedStacks(self, path):
+        """
+        Write the trace in the collapsed-stack format (one ``stack count`` line per stack),
+        as understood by ``flamegraph.pl``, speedscope and other flame graph tools.
+        """
+        with open(path, "w") as f:
+            for stack, us in sorted(self.collapsedStacks().items()):
+                f.write("{} {}\n".format(stack, us))
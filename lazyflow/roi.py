@@ -21,6 +21,7 @@
 ###############################################################################
 
 import collections
+import itertools
 import numbers
 from functools import partial
 from itertools import combinations
@@ -492,6 +493,140 @@ def containing_rois(rois, inner_roi):
     return rois[matching_rows]
 
 
+class RoiIndex(object):
+    """
+    Spatial index (grid hash) for a set of rois, to find the rois that contain or intersect
+    a given roi without comparing it to every stored roi (see containing_rois()).
+
+    Rois are hashed into the cells of a regular grid.  Unless given, the cell shape is taken
+    from the first roi that is added, which suits caches whose blocks mostly have the same shape.
+    Rois that would cover too many cells are kept in a separate list that is always checked.
+    Rois must be hashable, i.e. tuple-of-tuples (start, stop).
+
+    The index is not threadsafe, but queries only take atomic snapshots of the internal
+    containers, so they may run concurrently with updates (and just miss concurrently added rois).
+
+    Example:
+        >>> index = RoiIndex()
+        >>> index.add( ((0,0), (10,10)) )
+        >>> index.add( ((10,0), (20,10)) )
+        >>> index.containing( ((12,3), (15,5)) )
+        ((10, 0), (20, 10))
+        >>> index.containing( ((5,5), (15,6)) ) is None
+        True
+        >>> sorted( index.intersecting( ((5,5), (15,6)) ) )
+        [((0, 0), (10, 10)), ((10, 0), (20, 10))]
+    """
+
+    # Rois covering more grid cells than this are not hashed
+    MAX_CELLS_PER_ROI = 64
+
+    def __init__(self, cell_shape=None):
+        self._initial_cell_shape = cell_shape
+        self.clear()
+
+    def clear(self):
+        cell_shape = self._initial_cell_shape
+        self._cell_shape = tuple(max(int(s), 1) for s in cell_shape) if cell_shape is not None else None
+        # cell coordinates -> set of rois
+        self._cells = {}
+        # roi -> list of cells (or None if the roi is oversized)
+        self._rois = {}
+        self._oversized = set()
+
+    def __len__(self):
+        return len(self._rois)
+
+    def __contains__(self, roi):
+        return roi in self._rois
+
+    def __iter__(self):
+        return iter(list(self._rois))
+
+    def add(self, roi):
+        if roi in self._rois:
+            return
+        if self._cell_shape is None:
+            self._cell_shape = tuple(max(int(stop - start), 1) for start, stop in zip(*roi))
+
+        cells = self._cells_for(roi, self.MAX_CELLS_PER_ROI)
+        if cells is None:
+            self._oversized.add(roi)
+        else:
+            for cell in cells:
+                self._cells.setdefault(cell, set()).add(roi)
+        self._rois[roi] = cells
+
+    def remove(self, roi):
+        """
+        Remove a roi from the index. Unknown rois are ignored.
+        """
+        if roi not in self._rois:
+            return
+        cells = self._rois.pop(roi)
+        if cells is None:
+            self._oversized.discard(roi)
+            return
+        for cell in cells:
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(roi)
+                if not bucket:
+                    del self._cells[cell]
+
+    def containing(self, inner_roi):
+        """
+        Return a stored roi that entirely envelops the given roi, or None.
+        """
+        if self._cell_shape is None:
+            return None
+        # A containing roi must also contain the start of inner_roi, so one cell suffices
+        cell = tuple(int(start) // size for start, size in zip(inner_roi[0], self._cell_shape))
+        candidates = tuple(self._cells.get(cell, ())) + tuple(self._oversized)
+        for roi in candidates:
+            if all(outer <= inner for outer, inner in zip(roi[0], inner_roi[0])) and all(
+                outer >= inner for outer, inner in zip(roi[1], inner_roi[1])
+            ):
+                return roi
+        return None
+
+    def intersecting(self, query_roi):
+        """
+        Return a list of all stored rois that intersect the given roi.
+        """
+        if self._cell_shape is None:
+            return []
+        cells = self._cells_for(query_roi, max(len(self._cells), 1))
+        if cells is None:
+            # Querying a huge roi: cheaper to check every stored roi
+            candidates = tuple(self._rois)
+        else:
+            candidates = set(self._oversized)
+            for cell in cells:
+                candidates.update(tuple(self._cells.get(cell, ())))
+        return [
+            roi
+            for roi in candidates
+            if all(
+                max(start_a, start_b) < min(stop_a, stop_b)
+                for start_a, stop_a, start_b, stop_b in zip(roi[0], roi[1], query_roi[0], query_roi[1])
+            )
+        ]
+
+    def _cells_for(self, roi, max_cells):
+        """
+        Return the coordinates of all grid cells the roi touches, or None if there are more than max_cells.
+        """
+        first = [int(start) // size for start, size in zip(roi[0], self._cell_shape)]
+        last = [max(int(stop) - 1, int(start)) // size for start, stop, size in zip(roi[0], roi[1], self._cell_shape)]
+        num_cells = 1
+        for f, l in zip(first, last):
+            num_cells *= l - f + 1
+        if num_cells > max_cells:
+            return None
+        return list(itertools.product(*(range(f, l + 1) for f, l in zip(first, last))))
+
+
 def enlargeRoiForHalo(start, stop, shape, sigma, window=3.5, enlarge_axes=None, return_result_roi=False):
     """
     Enlarge the given roi (start,stop) with a halo according to the given
@@ -643,6 +778,121 @@ def getIntersectingBlocks(blockshape, roi, asarray=False):
         return numpy.reshape(block_indices, (num_indexes, axiscount))
 
 
+BLOCK_ORDERS = ("c", "zorder", "hilbert", "slab")
+
+
+def orderBlocks(block_starts, blockshape, order="c", slab_shape=None):
+    """
+    Sort block start coordinates (e.g. from getIntersectingBlocks()) into a traversal order.
+
+    Blocks that are processed close in time share halos and upstream cache blocks, so a
+    locality-preserving order improves the hit rate of upstream caches.
+
+    :param block_starts: array of block start coordinates, one row per block
+    :param blockshape: shape of the blocks
+    :param order: One of:
+
+        - ``'c'``: C-order over the block grid (the order of getIntersectingBlocks())
+        - ``'zorder'``: Z-order (Morton) curve over the block grid
+        - ``'hilbert'``: Hilbert curve over the block grid
+        - ``'slab'``: all blocks within one ``slab_shape`` region (e.g. an upstream cache block)
+          before the next region; regions and the blocks within a region are in C-order
+
+    :param slab_shape: The region shape for ``'slab'`` order.
+                       Entries that are 0 or None span the whole axis.
+
+    Example:
+        >>> starts = getIntersectingBlocks( (1,1), ((0,0), (4,4)) )
+        >>> orderBlocks( starts, (1,1), 'zorder' )[:6].tolist()
+        [[0, 0], [0, 1], [1, 0], [1, 1], [0, 2], [0, 3]]
+        >>> orderBlocks( starts, (1,1), 'hilbert' )[:6].tolist()
+        [[0, 0], [1, 0], [1, 1], [0, 1], [0, 2], [0, 3]]
+        >>> orderBlocks( starts, (1,1), 'slab', slab_shape=(2,2) )[:6].tolist()
+        [[0, 0], [0, 1], [1, 0], [1, 1], [0, 2], [0, 3]]
+    """
+    assert order in BLOCK_ORDERS, "Unknown block order: {}".format(order)
+    block_starts = numpy.asarray(block_starts)
+    if order == "c" or len(block_starts) < 2:
+        return block_starts
+
+    # Non-negative coordinates on the block grid
+    offset_starts = block_starts - block_starts.min(axis=0)
+    grid = offset_starts // numpy.asarray(blockshape)
+
+    if order == "slab":
+        assert slab_shape is not None, "slab order requires a slab shape"
+        # Slabs are aligned to absolute coordinates, like the blocks of an upstream cache
+        slab_shape = numpy.array([s if s else 0 for s in slab_shape])
+        slab_shape = numpy.where(slab_shape > 0, slab_shape, numpy.abs(block_starts).max(axis=0) + 1)
+        slabs = block_starts // slab_shape
+        # numpy.lexsort() uses the last key as the primary key
+        keys = [grid[:, axis] for axis in reversed(range(grid.shape[1]))]
+        keys += [slabs[:, axis] for axis in reversed(range(grid.shape[1]))]
+        return block_starts[numpy.lexsort(keys)]
+
+    if order == "zorder":
+        keys = _morton_keys(grid)
+    else:
+        keys = _hilbert_keys(grid)
+    return block_starts[numpy.argsort(keys, kind="stable")]
+
+
+def _interleave_bits(columns, bits):
+    """
+    Interleave the bits of the given columns (most significant first, first column first).
+    Returns one key per row.
+    """
+    # Fall back to Python integers if the keys don't fit into 64 bits
+    if bits * len(columns) <= 64:
+        dtype, one = numpy.uint64, numpy.uint64(1)
+    else:
+        dtype, one = object, 1
+    keys = numpy.zeros(len(columns[0]), dtype=dtype)
+    for bit in reversed(range(bits)):
+        for column in columns:
+            keys = (keys << one) | ((column >> bit) & 1).astype(dtype)
+    return keys
+
+
+def _morton_keys(grid):
+    bits = max(int(grid.max()).bit_length(), 1)
+    return _interleave_bits([grid[:, axis].astype(numpy.int64) for axis in range(grid.shape[1])], bits)
+
+
+def _hilbert_keys(grid):
+    """
+    Compute the index along the N-dimensional Hilbert curve for each row of grid coordinates.
+    (J. Skilling, "Programming the Hilbert curve", AIP Conf. Proc. 707, 2004)
+    """
+    ndim = grid.shape[1]
+    bits = max(int(grid.max()).bit_length(), 1)
+    x = [grid[:, axis].astype(numpy.int64) for axis in range(ndim)]
+
+    # Inverse undo
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = q - 1
+        for i in range(ndim):
+            high = (x[i] & q) != 0
+            x[0] = numpy.where(high, x[0] ^ p, x[0])
+            t = numpy.where(high, 0, (x[0] ^ x[i]) & p)
+            x[0] = x[0] ^ t
+            x[i] = x[i] ^ t
+        q >>= 1
+
+    # Gray encode
+    for i in range(1, ndim):
+        x[i] = x[i] ^ x[i - 1]
+    t = numpy.zeros_like(x[0])
+    q = 1 << (bits - 1)
+    while q > 1:
+        t = numpy.where((x[ndim - 1] & q) != 0, t ^ (q - 1), t)
+        q >>= 1
+    x = [column ^ t for column in x]
+
+    return _interleave_bits(x, bits)
+
+
 def getIntersectingRois(dataset_shape, blockshape, roi, clip_blocks_to_roi=True):
     block_starts = getIntersectingBlocks(blockshape, roi)
     block_rois = list(map(partial(getBlockBounds, dataset_shape, blockshape), block_starts))
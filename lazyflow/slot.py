@@ -34,6 +34,7 @@ import logging
 import collections
 import itertools
 import threading
+import weakref
 from functools import partial, wraps
 from contextlib import contextmanager
 import warnings
@@ -45,7 +46,7 @@ import vigra
 
 # lazyflow
 from lazyflow import rtype
-from lazyflow.roi import TinyVector
+from lazyflow.roi import TinyVector, roiToSlice
 from lazyflow.request import Request
 from lazyflow.stype import ArrayLike, Opaque
 from lazyflow.metaDict import MetaDict
@@ -211,6 +212,9 @@ class Slot(object):
 
         self._resizing = False
 
+        # In-flight requests, for output slots that coalesce requests (see OutputSlot)
+        self._in_flight = None
+
         # Allow slots to be sorted by their order of creation for
         # debug output and diagramming purposes.
         self._global_slot_id = next(Slot._global_counter)
@@ -826,8 +830,17 @@ class Slot(object):
                     self._type != "input"
                 ), "This inputSlot has no value and no upstream_slot.  You can't ask for its data yet!"
             # normal (outputslot) case
-            # --> construct heavy request object..
             execWrapper = Slot.RequestExecutionWrapper(self, roi)
+            if self.operator.isResident(self.top_level_slot, self.subindex, roi):
+                # the operator can serve this roi right away (e.g. cache hit)
+                # --> wait() executes it inline, without the thread pool handoff
+                return Request.inline(execWrapper)
+
+            if self._in_flight is not None and isinstance(roi, rtype.SubRegion):
+                # Share the computation with identical or enclosing rois that are in flight
+                return self._in_flight.get(execWrapper)
+
+            # --> construct heavy request object..
             request = Request(execWrapper)
 
             return request
@@ -856,6 +869,10 @@ class Slot(object):
             destination_given = destination is not None
 
             if destination is None:
+                # Skip allocation and copying if the data is available as a view (see Operator.readOnlyView)
+                view = self.operator.readOnlyView(self.slot.top_level_slot, self.slot.subindex, self.roi)
+                if view is not None:
+                    return view
                 destination = self.slot.stype.allocateDestination(self.roi)
             else:
                 if self.slot.meta.dtype is not None and hasattr(destination, "dtype"):
@@ -883,6 +900,164 @@ class Slot(object):
 
             return destination
 
+    class CoalescedExecutionWrapper:
+        """
+        Workload of a request for an output slot with ``coalesce=True`` that nothing in flight covers:
+        computes its roi like a plain request (into the caller's destination, if given) and lets
+        requests for the same or an enclosed roi attach to it while it runs (see AttachedExecutionWrapper).
+        """
+
+        __slots__ = ("slot", "operator", "roi", "exec_wrapper", "computation", "in_flight")
+
+        def __init__(self, exec_wrapper, computation, in_flight):
+            self.slot = exec_wrapper.slot
+            self.operator = exec_wrapper.operator
+            self.roi = exec_wrapper.roi
+            self.exec_wrapper = exec_wrapper
+            self.computation = computation
+            self.in_flight = in_flight
+
+        def __call__(self, destination=None):
+            self.in_flight.start(self.computation)
+            try:
+                result = self.exec_wrapper(destination)
+            except BaseException:
+                self.in_flight.discard(self.computation)
+                raise
+            if self.in_flight.finish(self.computation):
+                # Someone attached: give them a copy, so they don't depend on what our caller does with the result.
+                shared_result = self.slot.stype.allocateDestination(self.roi)
+                self.slot.stype.copy_data(dst=shared_result, src=result)
+                self.computation.shared_result = shared_result
+            return result
+
+    class AttachedExecutionWrapper:
+        """
+        Workload of a request for an output slot with ``coalesce=True`` whose roi lies within one that
+        was already requested: if that computation is running when we execute, waits for it and copies out
+        our part of its result; otherwise computes the roi itself.
+        """
+
+        __slots__ = ("slot", "operator", "roi", "exec_wrapper", "computation", "in_flight")
+
+        def __init__(self, exec_wrapper, computation, in_flight):
+            self.slot = exec_wrapper.slot
+            self.operator = exec_wrapper.operator
+            self.roi = exec_wrapper.roi
+            self.exec_wrapper = exec_wrapper
+            self.computation = computation
+            self.in_flight = in_flight
+
+        def __call__(self, destination=None):
+            shared_request = self.in_flight.attach(self.computation)
+            if shared_request is None:
+                return self.exec_wrapper(destination)
+            try:
+                shared_request.wait()
+            except Request.InvalidRequestException:
+                # The shared request was cancelled (along with the caller that created it).
+                # We still want the data, so compute it ourselves.
+                return self.exec_wrapper(destination)
+
+            relative_roi = (
+                numpy.subtract(self.roi.start, self.computation.start),
+                numpy.subtract(self.roi.stop, self.computation.start),
+            )
+            if destination is None:
+                destination = self.slot.stype.allocateDestination(self.roi)
+            self.slot.stype.copy_data(dst=destination, src=self.computation.shared_result[roiToSlice(*relative_roi)])
+            return destination
+
+    class InFlightComputation:
+        """
+        A requested roi of a coalescing output slot, which later requests within it may attach to.
+        """
+
+        __slots__ = ("start", "stop", "request_ref", "running", "closed", "attached", "shared_result")
+
+        def __init__(self, start, stop):
+            self.start = start
+            self.stop = stop
+            self.request_ref = None
+            self.running = False
+            self.closed = False
+            self.attached = 0
+            self.shared_result = None
+
+        def covers(self, start, stop):
+            return all(a <= b for a, b in zip(self.start, start)) and all(a >= b for a, b in zip(self.stop, stop))
+
+    class InFlightRequests:
+        """
+        Bookkeeping of the requested rois of a coalescing output slot.
+
+        The first request for a roi computes it like any other request.  Requests for the same or an
+        enclosed roi that execute while it runs attach to it and copy their part of its result, so only
+        they pay for a copy (and their creator for one more, to hand them out).
+        """
+
+        def __init__(self):
+            self._lock = threading.Lock()
+            self._computations = []
+
+        def get(self, exec_wrapper):
+            """
+            Return the request for the roi of the given workload.
+            """
+            start = tuple(exec_wrapper.roi.start)
+            stop = tuple(exec_wrapper.roi.stop)
+            with self._lock:
+                for computation in self._computations:
+                    if not computation.closed and computation.covers(start, stop):
+                        if computation.request_ref() is not None:
+                            return Request(Slot.AttachedExecutionWrapper(exec_wrapper, computation, self))
+
+                computation = Slot.InFlightComputation(start, stop)
+                request = Request(Slot.CoalescedExecutionWrapper(exec_wrapper, computation, self))
+                computation.request_ref = weakref.ref(request)
+                live = [c for c in self._computations if not c.closed and c.request_ref() is not None]
+                self._computations = live + [computation]
+            return request
+
+        def start(self, computation):
+            with self._lock:
+                computation.running = True
+
+        def attach(self, computation):
+            """
+            Return the request running the given computation, or None if it isn't running (any more).
+            """
+            with self._lock:
+                request = computation.request_ref()
+                if not computation.running or computation.closed or request is None:
+                    return None
+                computation.attached += 1
+                return request
+
+        def finish(self, computation):
+            """
+            Close the given computation for attaching, return whether anyone attached to it.
+            """
+            with self._lock:
+                self._close(computation)
+                return computation.attached > 0
+
+        def discard(self, computation):
+            with self._lock:
+                self._close(computation)
+
+        def _close(self, computation):
+            computation.closed = True
+            self._computations = [c for c in self._computations if c is not computation]
+
+        def clear(self):
+            """
+            Forget all requested rois, e.g. because their data became dirty.
+            (Requests that are already attached to them still get their results.)
+            """
+            with self._lock:
+                self._computations = []
+
     @is_setup_fn
     def setDirty(self, *args, **kwargs):
         """This method is called by a partnering OutputSlot when its
@@ -896,6 +1071,10 @@ class Slot(object):
             "Slot '{}' cannot be set dirty," " slot not belonging to any" " actual operator instance".format(self.name)
         )
 
+        if self._in_flight is not None:
+            # Requests from now on must not be served from results computed with the old data
+            self._in_flight.clear()
+
         if self.stype.isConfigured():
             if len(args) == 0 or not isinstance(args[0], rtype.Roi):
                 roi = self.rtype(self, *args, **kwargs)
@@ -1309,6 +1488,8 @@ class Slot(object):
         init_kwargs["allow_mask"] = self.allow_mask
         if self._type == "input":
             init_kwargs["optional"] = self._optional
+        else:
+            init_kwargs["coalesce"] = self.coalesce
 
         init_kwargs.update(init_kwarg_overrides)
 
@@ -1480,9 +1661,18 @@ class OutputSlot(Slot):
 
     This call returns an GetItemRequestObject.
 
+    With ``coalesce=True``, concurrent requests for the same roi, or for rois within one that is
+    already being computed, share a single execution of the operator (each request gets its own
+    copy of the data).  This is meant for expensive operators without a cache, e.g. filters or
+    predictions that are requested by several viewer tiles or downstream operators at once.
+    Partially overlapping rois are still computed independently.
+
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, coalesce=False, **kwargs):
         super(OutputSlot, self).__init__(*args, **kwargs)
         self._type = "output"
+        self.coalesce = coalesce
+        if coalesce:
+            self._in_flight = Slot.InFlightRequests()
         assert "optional" not in kwargs, '"optional" init arg cannot be used with OutputSlot'
@@ -28,6 +28,7 @@ import collections
 import warnings
 
 from .roi import roiToSlice
+from . import bufferPool
 
 import h5py
 
@@ -118,7 +119,7 @@ class ArrayLike(SlotType):
         )
 
         shape = roi.stop - roi.start if roi else self.slot.meta.shape
-        storage = numpy.ndarray(shape, dtype=self.slot.meta.dtype)
+        storage = bufferPool.allocate(shape, self.slot.meta.dtype)
 
         # if self.slot.meta.axistags is True:
         #     storage = vigra.taggedView(storage, self.slot.meta.axistags)
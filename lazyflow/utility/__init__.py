@@ -34,6 +34,8 @@ from .pathHelpers import PathComponents, getPathVariants, isUrl, make_absolute,
 
 from .roiRequestBatch import RoiRequestBatch
 from .bigRequestStreamer import BigRequestStreamer
+from . import compressionCodecs
+from .compressedArray import CompressedArray
 from . import io_util
 from .format_known_keys import format_known_keys
 from .timer import Timer, timeLogged
@@ -24,6 +24,9 @@ from builtins import object
 # This information is also available on the ilastik web site at:
 # 		   http://ilastik.org/license/
 ###############################################################################
+import threading
+import time
+
 import numpy
 from lazyflow.request import Request
 from lazyflow.utility import RoiRequestBatch
@@ -33,10 +36,12 @@ from lazyflow.roi import (
     getIntersection,
     determine_optimal_request_blockshape,
     determineBlockShape,
+    orderBlocks,
 )
 
 import logging
 import warnings
+from functools import partial
 from .memory import Memory
 
 logger = logging.getLogger(__name__)
@@ -91,10 +96,33 @@ class BigRequestStreamer(object):
     Progress: 0 16 33 50 66 83 100 100
     >>> print(f"Processed {result_count[0]} result blocks with a total sum of: {result_total_sum[0]}")
     Processed 6 result blocks with a total sum of: 68400
+
+    With ``adaptiveBlockshape=True``, the given (or automatically chosen) blockshape is only the
+    starting point: the wall time of the blocks and the RAM usage of the process are monitored,
+    and later blocks are made larger or smaller accordingly
+    (see :py:class:`AdaptiveBlockshapeController`).
+
+    By default, blocks are requested in C-order over the block grid.  Neighboring blocks share
+    halos and upstream cache blocks, so a locality-preserving ``blockOrder`` ('zorder', 'hilbert',
+    or 'slab', see :py:func:`lazyflow.roi.orderBlocks`) can save a lot of recomputation upstream.
     """
 
     def __init__(
-        self, outputSlot, roi, blockshape=None, batchSize=None, blockAlignment="absolute", allowParallelResults=False
+        self,
+        outputSlot,
+        roi,
+        blockshape=None,
+        batchSize=None,
+        blockAlignment="absolute",
+        allowParallelResults=False,
+        adaptiveBlockshape=False,
+        blockOrder="c",
+        slabShape=None,
+        prefetchSlot=None,
+        prefetchDepth=None,
+        prefetchRoi=None,
+        prefetchMemory=None,
+        priorityClass=Request.BATCH,
     ):
         """
         Constructor.
@@ -106,6 +134,19 @@ class BigRequestStreamer(object):
         :param blockAlignment: Determines how block the requests. Choices are 'absolute' or 'relative'.
         :param allowParallelResults: If False, The resultSignal will not be called in parallel.
                                      In that case, your handler function has no need for locks.
+        :param adaptiveBlockshape: If True, grow or shrink the blockshape while executing,
+                                   based on the measured time per block and RAM usage.
+        :param blockOrder: The order in which blocks are requested. Choices are 'c', 'zorder', 'hilbert' and 'slab'.
+                           Not supported with adaptiveBlockshape.
+        :param slabShape: The region shape for 'slab' order, e.g. the blockshape of an upstream cache.
+                          Defaults to the ideal_blockshape of the output slot.
+        :param prefetchSlot: Optional upstream slot to read ahead from.
+        :param prefetchDepth: How many blocks to read ahead.  Defaults to batchSize.
+        :param prefetchRoi: Optional callable mapping a block roi to the roi to read ahead from prefetchSlot.
+        :param prefetchMemory: Maximum number of bytes to read ahead of the active requests.
+        :param priorityClass: Priority class of the block requests.  Defaults to ``Request.BATCH``,
+                              so interactive requests (e.g. from the viewer) aren't queued behind the blocks.
+                              Pass None to inherit the class of the calling request.
         """
         self._outputSlot = outputSlot
         self._bigRoi = roi
@@ -120,11 +161,28 @@ class BigRequestStreamer(object):
             blockshape = self._determine_blockshape(outputSlot)
 
         assert blockAlignment in ["relative", "absolute"]
-        if blockAlignment == "relative":
+        assert blockOrder == "c" or not adaptiveBlockshape, "Adaptive blockshapes use their own block order"
+        if blockOrder == "slab" and slabShape is None:
+            slabShape = outputSlot.meta.ideal_blockshape
+            assert slabShape is not None, "Can't use slab order: no slabShape given and no ideal_blockshape known"
+
+        self._controller = None
+        if adaptiveBlockshape:
+            # Like _determine_blockshape(), never change the blockshape along time and channels
+            fixed_axes = []
+            if outputSlot.meta.axistags is not None:
+                axiskeys = outputSlot.meta.getAxisKeys()
+                fixed_axes = [axiskeys.index(k) for k in "tc" if k in axiskeys]
+            self._controller = AdaptiveBlockshapeController(
+                blockshape, roi, batchSize, fixedAxes=fixed_axes, maxBlockshape=outputSlot.meta.max_blockshape
+            )
+            roiGen = partial(self._adaptiveRoiGen, blockAlignment)
+        elif blockAlignment == "relative":
             # Align the blocking with the start of the roi
             offsetRoi = ([0] * len(roi[0]), numpy.subtract(roi[1], roi[0]))
             block_starts = getIntersectingBlocks(blockshape, offsetRoi)
             block_starts += roi[0]  # Un-offset
+            block_starts = orderBlocks(block_starts, blockshape, blockOrder, slabShape)
 
             # For now, simply iterate over the min blocks
             # TODO: Auto-dialate block sizes based on CPU/RAM usage.
@@ -156,6 +214,7 @@ class BigRequestStreamer(object):
             # Blocks are simply relative to (0,0,0,...)
             # But we still clip the requests to the overall roi bounds.
             block_starts = getIntersectingBlocks(blockshape, roi)
+            block_starts = orderBlocks(block_starts, blockshape, blockOrder, slabShape)
 
             def roiGen():
                 block_iter = block_starts.__iter__()
@@ -173,7 +232,50 @@ class BigRequestStreamer(object):
                         logger.debug("Requesting Roi: {}".format(block_bounds))
                         yield block_intersecting_portion
 
-        self._requestBatch = RoiRequestBatch(self._outputSlot, roiGen(), totalVolume, batchSize, allowParallelResults)
+        self._requestBatch = RoiRequestBatch(
+            self._outputSlot,
+            roiGen(),
+            totalVolume,
+            batchSize,
+            allowParallelResults,
+            prefetchSlot=prefetchSlot,
+            prefetchDepth=prefetchDepth,
+            prefetchRoi=prefetchRoi,
+            prefetchMemory=prefetchMemory,
+            priorityClass=priorityClass,
+        )
+        if self._controller is not None:
+            self._requestBatch.resultSignal.subscribe(self._controller.blockCompleted)
+
+    def _adaptiveRoiGen(self, blockAlignment):
+        """
+        Generate the block rois for adaptive mode.
+
+        The roi is swept axis by axis, and the extent of each step is taken from the controller's
+        *current* blockshape, so blockshape changes affect the very next block while the rois
+        still tile the big roi exactly.
+        """
+        start, stop = self._bigRoi
+        ndim = len(start)
+        controller = self._controller
+
+        def sweep(axis, block_start, block_stop):
+            if axis == ndim:
+                block_roi = (tuple(block_start), tuple(block_stop))
+                controller.blockIssued(block_roi)
+                logger.debug("Requesting Roi: {}".format(block_roi))
+                yield block_roi
+                return
+
+            origin = 0 if blockAlignment == "absolute" else start[axis]
+            pos = int(start[axis])
+            while pos < stop[axis]:
+                step = controller.blockshape[axis]
+                next_pos = int(min(origin + ((pos - origin) // step + 1) * step, stop[axis]))
+                yield from sweep(axis + 1, block_start + [pos], block_stop + [next_pos])
+                pos = next_pos
+
+        return sweep(0, [], [])
 
     def _determine_blockshape(self, outputSlot):
         """
@@ -290,6 +392,143 @@ class BigRequestStreamer(object):
         self._requestBatch.execute()
 
 
+class AdaptiveBlockshapeController(object):
+    """
+    Feedback control of the blockshape used by a :py:class:`BigRequestStreamer` in adaptive mode.
+
+    The streamer reports when each block is issued and completed.  Once a full batch of blocks
+    with the current blockshape has completed, the median wall time per block and the peak RSS
+    of the process (sampled whenever a block completes) are evaluated:
+
+    - If the process came close to its RAM budget, or blocks take very long (which leaves workers
+      idle at the end of the run), the largest axis of the blockshape is halved.
+    - If blocks are so fast that request overhead matters and there is enough RAM headroom for
+      blocks of twice the size, the smallest axis is doubled (as long as enough blocks remain
+      to keep all workers busy).
+
+    Axes listed in ``fixedAxes`` (e.g. time and channels) are never changed.
+    """
+
+    # Fraction of the RAM budget that triggers shrinking (and must not be exceeded by growing)
+    RAM_HEADROOM = 0.8
+
+    def __init__(
+        self,
+        blockshape,
+        roi,
+        batchSize,
+        fixedAxes=(),
+        maxBlockshape=None,
+        ramBudget=None,
+        minBlockSeconds=1.0,
+        maxBlockSeconds=30.0,
+    ):
+        """
+        :param blockshape: The initial blockshape
+        :param roi: The roi `(start, stop)` that is processed
+        :param batchSize: The number of blocks that are processed in parallel
+        :param fixedAxes: Indexes of axes whose blockshape must not change
+        :param maxBlockshape: Upper bound for the blockshape (the roi shape is always an upper bound)
+        :param ramBudget: RAM available to the whole process, in bytes (defaults to Memory.getAvailableRam())
+        :param minBlockSeconds: Blocks that finish faster are grown
+        :param maxBlockSeconds: Blocks that take longer are shrunk
+        """
+        self._lock = threading.Lock()
+        roi_shape = numpy.subtract(roi[1], roi[0])
+        max_shape = roi_shape if maxBlockshape is None else numpy.minimum(maxBlockshape, roi_shape)
+        self._max_blockshape = tuple(int(m) for m in max_shape)
+        self._blockshape = tuple(int(max(1, min(b, m))) for b, m in zip(blockshape, self._max_blockshape))
+        self._fixed_axes = set(fixedAxes)
+        self._batch_size = max(1, batchSize)
+        self._ram_budget = ramBudget if ramBudget is not None else Memory.getAvailableRam()
+        self._min_block_seconds = minBlockSeconds
+        self._max_block_seconds = maxBlockSeconds
+
+        self._remaining_volume = int(numpy.prod(roi_shape))
+        self._baseline_rss = Memory.getMemoryUsage()
+        self._peak_rss = self._baseline_rss
+
+        # Incremented on every blockshape change, so that blocks of older shapes are ignored
+        self._generation = 0
+        # block roi -> (issue time, generation)
+        self._issued = {}
+        # Wall times of completed blocks of the current generation
+        self._durations = []
+
+    @property
+    def blockshape(self):
+        return self._blockshape
+
+    def blockIssued(self, roi):
+        with self._lock:
+            self._issued[roi] = (time.perf_counter(), self._generation)
+            self._remaining_volume -= int(numpy.prod(numpy.subtract(roi[1], roi[0])))
+
+    def blockCompleted(self, roi, result=None):
+        finish_time = time.perf_counter()
+        rss = Memory.getMemoryUsage()
+        with self._lock:
+            self._peak_rss = max(self._peak_rss, rss)
+            issue_time, generation = self._issued.pop(roi, (None, None))
+            if generation != self._generation:
+                return
+            self._durations.append(finish_time - issue_time)
+            if len(self._durations) >= self._batch_size:
+                self._adapt()
+
+    def _adapt(self):
+        duration = float(numpy.median(self._durations))
+        ram_limit = self.RAM_HEADROOM * self._ram_budget
+        # All blocks of a batch are in flight at the same time
+        ram_per_block = max(self._peak_rss - self._baseline_rss, 0) / self._batch_size
+
+        old_blockshape = self._blockshape
+        if self._peak_rss > ram_limit or duration > self._max_block_seconds:
+            self._blockshape = self._shrunk(old_blockshape)
+        elif duration < self._min_block_seconds and self._peak_rss + self._batch_size * ram_per_block < ram_limit:
+            grown = self._grown(old_blockshape)
+            if self._remaining_volume >= 2 * self._batch_size * numpy.prod(grown):
+                self._blockshape = grown
+
+        if self._blockshape != old_blockshape:
+            logger.info(
+                "Changing blockshape from {} to {} (median time per block: {:.3f}s, peak RSS: {})".format(
+                    old_blockshape, self._blockshape, duration, Memory.format(self._peak_rss)
+                )
+            )
+            self._generation += 1
+        self._durations = []
+        self._peak_rss = self._baseline_rss
+
+    def _grown(self, blockshape):
+        """
+        Double the smallest adjustable axis (preferring fast axes on ties).
+        """
+        axes = [
+            axis
+            for axis in range(len(blockshape))
+            if axis not in self._fixed_axes and blockshape[axis] < self._max_blockshape[axis]
+        ]
+        if not axes:
+            return blockshape
+        axis = min(axes, key=lambda axis: (blockshape[axis], -axis))
+        new_blockshape = list(blockshape)
+        new_blockshape[axis] = min(2 * blockshape[axis], self._max_blockshape[axis])
+        return tuple(new_blockshape)
+
+    def _shrunk(self, blockshape):
+        """
+        Halve the largest adjustable axis (preferring slow axes on ties).
+        """
+        axes = [axis for axis in range(len(blockshape)) if axis not in self._fixed_axes and blockshape[axis] > 1]
+        if not axes:
+            return blockshape
+        axis = max(axes, key=lambda axis: (blockshape[axis], -axis))
+        new_blockshape = list(blockshape)
+        new_blockshape[axis] = (blockshape[axis] + 1) // 2
+        return tuple(new_blockshape)
+
+
 if __name__ == "__main__":
     import doctest
 
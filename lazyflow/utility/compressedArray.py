@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+from functools import partial
+
+import numpy
+
+from lazyflow.request import Request, RequestPool, RequestLock
+from lazyflow.roi import getIntersectingBlocks, getBlockBounds, getIntersection, roiToSlice, sliceToRoi
+from lazyflow.utility.compressionCodecs import getCodec, defaultCodec
+
+
+class CompressedArray(object):
+    """
+    An n-dimensional array that is stored as separately compressed chunks (plain byte buffers in a dict).
+    Chunks that contain only zeros are not stored at all.
+
+    Reading and writing works with (basic) slicings, like for an h5py dataset, but chunks are
+    (de)compressed in parallel and without any global lock.
+    Concurrent writes are serialized, reads are not.
+    """
+
+    def __init__(self, shape, dtype, chunkshape, codec=None):
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = numpy.dtype(dtype)
+        self.chunkshape = tuple(int(c) for c in numpy.minimum(chunkshape, self.shape))
+        self.codec = getCodec(codec or defaultCodec())
+        self._chunks = {}
+        self._lock = RequestLock()
+
+    @property
+    def size(self):
+        return int(numpy.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """
+        Size of the uncompressed data
+        """
+        return self.size * self.dtype.itemsize
+
+    @property
+    def storage_size(self):
+        """
+        Number of bytes actually used for the compressed chunks
+        """
+        return sum(len(buf) for buf in list(self._chunks.values()))
+
+    def __getitem__(self, slicing):
+        start, stop = sliceToRoi(slicing, self.shape)
+        result = numpy.empty(numpy.subtract(stop, start), dtype=self.dtype)
+        self._forEachChunk((start, stop), partial(self._readChunkInto, start, result))
+        return result
+
+    def readInto(self, slicing, destination):
+        """
+        Decompress the given region directly into the destination array (which must have the region's shape).
+        """
+        start, stop = sliceToRoi(slicing, self.shape)
+        assert tuple(destination.shape) == tuple(numpy.subtract(stop, start))
+        self._forEachChunk((start, stop), partial(self._readChunkInto, start, destination))
+        return destination
+
+    def __setitem__(self, slicing, value):
+        start, stop = sliceToRoi(slicing, self.shape)
+        value = numpy.broadcast_to(numpy.asarray(value, dtype=self.dtype), numpy.subtract(stop, start))
+        with self._lock:
+            self._forEachChunk((start, stop), partial(self._writeChunk, start, value))
+
+    def _forEachChunk(self, roi, func):
+        chunk_starts = list(map(tuple, getIntersectingBlocks(self.chunkshape, roi)))
+        if len(chunk_starts) == 1:
+            func(roi, chunk_starts[0])
+            return
+
+        pool = RequestPool()
+        for chunk_start in chunk_starts:
+            pool.add(Request(partial(func, roi, chunk_start)))
+        pool.wait()
+
+    def _readChunkInto(self, array_start, destination, roi, chunk_start):
+        chunk_roi = getBlockBounds(self.shape, self.chunkshape, chunk_start)
+        intersection = getIntersection(roi, chunk_roi)
+        destination_slicing = roiToSlice(*numpy.subtract(intersection, array_start))
+        buf = self._chunks.get(chunk_start)
+        if buf is None:
+            destination[destination_slicing] = 0
+        else:
+            chunk = self._decompress(buf, chunk_roi)
+            destination[destination_slicing] = chunk[roiToSlice(*numpy.subtract(intersection, chunk_start))]
+
+    def _writeChunk(self, array_start, value, roi, chunk_start):
+        chunk_roi = getBlockBounds(self.shape, self.chunkshape, chunk_start)
+        intersection = getIntersection(roi, chunk_roi)
+        value_slicing = roiToSlice(*numpy.subtract(intersection, array_start))
+        if (numpy.asarray(intersection) == chunk_roi).all():
+            chunk = numpy.ascontiguousarray(value[value_slicing])
+        else:
+            # Partial write: read-modify-write
+            buf = self._chunks.get(chunk_start)
+            if buf is None:
+                chunk = numpy.zeros(numpy.subtract(*chunk_roi[::-1]), dtype=self.dtype)
+            else:
+                chunk = self._decompress(buf, chunk_roi).copy()
+            chunk[roiToSlice(*numpy.subtract(intersection, chunk_start))] = value[value_slicing]
+
+        if chunk.any():
+            self._chunks[chunk_start] = self.codec.compress(chunk.reshape(-1).view(numpy.uint8), self.dtype.itemsize)
+        else:
+            self._chunks.pop(chunk_start, None)
+
+    def _decompress(self, buf, chunk_roi):
+        data = numpy.frombuffer(self.codec.decompress(buf), dtype=self.dtype)
+        return data.reshape(numpy.subtract(*chunk_roi[::-1]))
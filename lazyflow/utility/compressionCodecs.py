@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+"""
+A small registry of byte-buffer compression codecs.
+
+Each codec is a pair of functions:
+  compress(data, itemsize) -> bytes, where data is a bytes-like object and itemsize the size of one array element
+  decompress(data) -> bytes
+
+The built-in codecs are only registered if the corresponding module can be imported.
+"zlib" (from the standard library) is always available.
+"""
+import collections
+import zlib
+
+Codec = collections.namedtuple("Codec", "name compress decompress")
+
+_codecs = collections.OrderedDict()
+
+# Used by defaultCodec(): the first one that is available is chosen
+PREFERRED_CODECS = ("blosc", "lz4", "zstd", "zlib")
+
+
+def registerCodec(name, compress, decompress):
+    """
+    Register (or replace) the codec with the given name.
+    """
+    _codecs[name] = Codec(name, compress, decompress)
+
+
+def getCodec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise KeyError("Unknown compression codec: {} (available: {})".format(name, ", ".join(availableCodecs())))
+
+
+def availableCodecs():
+    return list(_codecs.keys())
+
+
+def defaultCodec():
+    for name in PREFERRED_CODECS:
+        if name in _codecs:
+            return name
+    return availableCodecs()[0]
+
+
+registerCodec("zlib", lambda data, itemsize: zlib.compress(data, 1), zlib.decompress)
+
+try:
+    import blosc
+except ImportError:
+    pass
+else:
+    registerCodec(
+        "blosc",
+        lambda data, itemsize: blosc.compress(data, typesize=itemsize, cname="lz4", shuffle=blosc.SHUFFLE),
+        blosc.decompress,
+    )
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    registerCodec("lz4", lambda data, itemsize: lz4.frame.compress(data), lz4.frame.decompress)
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    # (Compressor objects must not be shared between threads, so each call makes its own.)
+    registerCodec(
+        "zstd",
+        lambda data, itemsize: zstandard.ZstdCompressor(level=1).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
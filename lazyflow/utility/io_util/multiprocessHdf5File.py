@@ -7,15 +7,19 @@ from builtins import range
 from builtins import object
 import os
 import copy
+import bisect
+import collections
 import h5py
 import threading
 import warnings
+import weakref
 import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
 import numpy
 
+from lazyflow.request import Request, RequestLock
+
 # This code uses multiprocessing to read hdf5 datasets faster
-# I'm still experimenting with implementation details,
-#  and switching between implementation variants via the METHOD setting below.
 #
 # NOTES:
 # - So far, this code is:
@@ -23,97 +27,296 @@ import numpy
 #  -- somewhat slower for chunked uncompressed datasets
 #  -- *much slower* for unchunked datasets
 #
-# THINGS TO TRY:
-#  -- Right now we launch the process only once, which means it must serve requests of varying sizes
-#     Instead, we might try launching a new throwaway process for every request.
-#     Overhead would be increased, but it would allow us to pass a shared-memory Array to the process,
-#         since we know the request size in advance.
-#  -- Could memory-sharing be achieved instead via memory-mapped files and/or mem-mapped arrays?
-#  -- Create a pool of processes instead of creating a processes for every thread and volume combo.
-
-# DEBUG: In this file (including the __main__ section), we are experimenting with various implementations.
-#        The METHOD setting switches between each.
-# METHOD = 'plain-h5py' # 4.6 seconds
-# METHOD = 'pipe-array' # 3.8 - 4.5 (inconsistent...)
-METHOD = "pipe-bytes"  # 2.5 seconds
-# METHOD = 'shared-array' # 4.3 (2.0 without copy...)
+# - All MultiProcessHdf5File objects share one pool of reader processes (see ReaderPool).
+#   Each reader keeps the files it has read from open, until the MultiProcessHdf5File is closed.
+# - The data is not sent through a pipe: the reader writes it into a shared memory segment.
+#   If the destination array itself lives in shared memory (see sharedArray()), the reader writes
+#   directly into it.  Otherwise, each reader has a transfer segment, which is copied once into the
+#   destination.
+
+# DEBUG: The __main__ section below compares against plain h5py if METHOD is set to 'plain-h5py'.
+# METHOD = 'plain-h5py'
+METHOD = "shared-memory"
+
+# Shared memory segments allocated by sharedArray(), sorted by start address:
+# [(start address, stop address, segment name)]
+_shared_segments = []
+_shared_segments_lock = threading.Lock()
+
+
+def sharedArray(shape, dtype):
+    """
+    Allocate an array in shared memory.
+    Reader processes can write directly into (c-contiguous views of) such an array, without
+    going through a transfer buffer.  The segment is released when the array is garbage collected.
+    """
+    dtype = numpy.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(int(numpy.prod(shape)) * dtype.itemsize, 1))
+    array = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    start = array.__array_interface__["data"][0]
+    entry = (start, start + shm.size, shm.name)
+    with _shared_segments_lock:
+        bisect.insort(_shared_segments, entry)
+    weakref.finalize(array, _releaseSharedArray, shm, entry)
+    return array
+
+
+def _releaseSharedArray(shm, entry):
+    with _shared_segments_lock:
+        _shared_segments.remove(entry)
+    shm.close()
+    shm.unlink()
+
+
+def _findSharedSegment(array):
+    """
+    If the array is a c-contiguous view into an array from sharedArray(),
+    return (segment name, byte offset), otherwise None.
+    """
+    if not array.flags.c_contiguous:
+        return None
+    start = array.__array_interface__["data"][0]
+    with _shared_segments_lock:
+        i = bisect.bisect_right(_shared_segments, (start, float("inf"))) - 1
+        if i < 0:
+            return None
+        seg_start, seg_stop, name = _shared_segments[i]
+    if start + array.nbytes > seg_stop:
+        return None
+    return (name, start - seg_start)
 
 
 class ReaderProcess(multiprocessing.Process):
     # This class is not threadsafe.
-    # The reader process is not supposed to be shared by multiple threads.
-    # Each thread should create its own reader process.
+    # A reader process serves one caller at a time, see ReaderPool.
 
-    def __init__(self, filepath):
-        name = "ilastik_helper-" + os.path.split(filepath)[1]
+    def __init__(self, name):
         super(ReaderProcess, self).__init__(name=name)
-        self._filepath = filepath
         self._request_queue_recv, self._request_queue_send = multiprocessing.Pipe(duplex=False)
         self._result_queue_recv, self._result_queue_send = multiprocessing.Pipe(duplex=False)
         self.daemon = True
 
-        if METHOD == "shared-array":
-            self.available_bytes = 100 * 1024 ** 2
-            self.transfer_buffer = multiprocessing.RawArray("b", self.available_bytes)
+        # Owned by the parent process, grown on demand.
+        self._transfer_segment = None
+
+        # Files the process has opened (only tracked in the parent process)
+        self.open_files = set()
 
     def run(self):
-        with h5py.File(self._filepath, "r") as h5_file:
-            (internal_path, slicing) = self._request_queue_recv.recv()
+        h5_files = {}
+        try:
+            request = self._request_queue_recv.recv()
             # 'None' means stop the process.
-            while internal_path is not None:
+            while request is not None:
+                command, args = request
                 try:
-                    if METHOD == "shared-array":
-                        read_roi = slice_to_roi(slicing, h5_file[internal_path].shape)
-                        read_roi = numpy.array(read_roi)
-                        read_shape = read_roi[1] - read_roi[0]
-                        num_bytes = h5_file[internal_path].dtype.itemsize * numpy.prod(read_shape)
-                        assert num_bytes <= self.available_bytes, "I don't yet support really big slicings"
-                        read_array = numpy.frombuffer(self.transfer_buffer, dtype=numpy.uint8, count=num_bytes)
-                        read_array.setflags(write=True)
-                        read_array = read_array.view(h5_file[internal_path].dtype).reshape(read_shape)
-
-                        h5_file[internal_path].read_direct(read_array, slicing)
-
-                    if METHOD == "pipe-bytes" or METHOD == "pipe-array":
-                        read_array = h5_file[internal_path][slicing]
+                    if command == "read":
+                        self._read(h5_files, *args)
+                    elif command == "close":
+                        (filepath,) = args
+                        if filepath in h5_files:
+                            h5_files.pop(filepath).close()
+                    else:
+                        assert False, "Unknown command: {}".format(command)
                 except Exception as ex:
                     self._result_queue_send.send(ex)
-                    raise
                 else:
-                    self._result_queue_send.send((read_array.shape, read_array.dtype))
+                    self._result_queue_send.send(None)
 
-                    if METHOD == "pipe-array":
-                        self._result_queue_send.send(read_array)
+                # Wait for the next request
+                request = self._request_queue_recv.recv()
+        finally:
+            for h5_file in h5_files.values():
+                h5_file.close()
 
-                    if METHOD == "pipe-bytes":
-                        self._result_queue_send.send_bytes(numpy.getbuffer(read_array))
+    @staticmethod
+    def _read(h5_files, filepath, internal_path, slicing, segment_name, offset, shape, dtype):
+        if filepath not in h5_files:
+            h5_files[filepath] = h5py.File(filepath, "r")
 
-                # Wait for the next request
-                (internal_path, slicing) = self._request_queue_recv.recv()
+        segment = shared_memory.SharedMemory(name=segment_name)
+        try:
+            read_array = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offset)
+            h5_files[filepath][internal_path].read_direct(read_array, slicing)
+            del read_array
+        finally:
+            segment.close()
+
+    def _request(self, command, *args):
+        self._request_queue_send.send((command, args))
+        response = self._result_queue_recv.recv()
+        if isinstance(response, Exception):
+            raise response
+
+    def read_subvolume(self, filepath, internal_path, slicing, out_array):
+        """
+        Read dataset[slicing] into out_array, which must have the shape of the slicing.
+        """
+        self.open_files.add(filepath)
+        shared = _findSharedSegment(out_array)
+        if shared is not None:
+            segment_name, offset = shared
+            self._request(
+                "read", filepath, internal_path, slicing, segment_name, offset, out_array.shape, out_array.dtype.str
+            )
+            return out_array
+
+        if self._transfer_segment is None or self._transfer_segment.size < out_array.nbytes:
+            self._release_transfer_segment()
+            # Grow to the next power of two, so that we don't need to reallocate for every larger request.
+            size = 1 << max(out_array.nbytes - 1, 0).bit_length()
+            self._transfer_segment = shared_memory.SharedMemory(create=True, size=size)
+
+        self._request(
+            "read",
+            filepath,
+            internal_path,
+            slicing,
+            self._transfer_segment.name,
+            0,
+            out_array.shape,
+            out_array.dtype.str,
+        )
+        out_array[...] = numpy.ndarray(out_array.shape, dtype=out_array.dtype, buffer=self._transfer_segment.buf)
+        return out_array
+
+    def close_file(self, filepath):
+        if filepath in self.open_files:
+            self.open_files.remove(filepath)
+            self._request("close", filepath)
+
+    def _release_transfer_segment(self):
+        if self._transfer_segment is not None:
+            self._transfer_segment.close()
+            self._transfer_segment.unlink()
+            self._transfer_segment = None
 
-    def read_subvolume(self, internal_path, slicing):
-        self._request_queue_send.send((internal_path, slicing))
-        response_info = self._result_queue_recv.recv()
-        if isinstance(response_info, Exception):
-            raise response_info
-        shape, dtype = response_info
+    def join(self):
+        self._request_queue_send.send(None)
+        super(ReaderProcess, self).join()
+        self._release_transfer_segment()
 
-        if METHOD == "pipe-array":
-            result = self._result_queue_recv.recv()
 
-        if METHOD == "pipe-bytes":
-            raw_buffer = self._result_queue_recv.recv_bytes()
-            result = numpy.frombuffer(raw_buffer, dtype=dtype).reshape(shape)
-            result.setflags(write=True)
+class ReaderPool(object):
+    """
+    A pool of reader processes, shared by all MultiProcessHdf5File objects.
+    Reader processes are started on demand, up to num_processes.
+    Each read occupies one reader, so up to num_processes reads (from any files) run in parallel.
 
-        if METHOD == "shared-array":
-            result = numpy.frombuffer(self.transfer_buffer, dtype=dtype, count=numpy.prod(shape)).copy()
-            result = result.reshape(shape)
-        return result
+    Requests that wait for a reader are suspended (see RequestLock), so they don't block their worker thread.
+    """
 
-    def join(self):
-        self._request_queue_send.send((None, None))
-        super(ReaderProcess, self).join()
+    def __init__(self, num_processes=None):
+        self.num_processes = num_processes or multiprocessing.cpu_count()
+        # Protects the members below.  Never held while waiting for a reader.
+        self._lock = threading.Lock()
+        self._readers = []
+        self._idle_readers = []
+        self._closed_files = {}  # reader -> files to be closed when it is idle again
+        # Callers waiting for a reader, first come first served: [lock, reader]
+        # The lock is held until release() hands the waiter a reader.
+        self._waiters = collections.deque()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle_readers:
+                return self._idle_readers.pop()
+
+            if len(self._readers) < self.num_processes:
+                # Make sure the shared memory resource tracker runs before we fork,
+                # so the readers don't start their own trackers (which would unlink our segments when they exit).
+                resource_tracker.ensure_running()
+                reader = ReaderProcess("ilastik_hdf5_reader-{}".format(len(self._readers)))
+                reader.start()
+                self._readers.append(reader)
+                return reader
+
+            # In debug mode (no worker threads), RequestLock is reentrant, so a plain lock must do.
+            waiter_lock = RequestLock() if Request.global_thread_pool.num_workers > 0 else threading.Lock()
+            waiter_lock.acquire()
+            waiter = [waiter_lock, None]
+            self._waiters.append(waiter)
+
+        try:
+            waiter_lock.acquire()
+        except BaseException:
+            # We were cancelled after release() handed us a reader: pass it on.
+            self.release(waiter[1])
+            raise
+        return waiter[1]
+
+    def release(self, reader):
+        with self._lock:
+            closed_files = self._closed_files.pop(reader, set())
+        for filepath in closed_files:
+            reader.close_file(filepath)
+        with self._lock:
+            if not self._waiters:
+                self._idle_readers.append(reader)
+                return
+            waiter = self._waiters.popleft()
+        waiter[1] = reader
+        waiter[0].release()
+
+    def read_subvolume(self, filepath, internal_path, slicing, out_array):
+        reader = self.acquire()
+        try:
+            return reader.read_subvolume(filepath, internal_path, slicing, out_array)
+        finally:
+            self.release(reader)
+
+    def close_file(self, filepath):
+        """
+        Make all readers close the given file (busy readers close it once they are done).
+        """
+        with self._lock:
+            idle_readers = list(self._idle_readers)
+            for reader in self._readers:
+                if reader not in idle_readers:
+                    self._closed_files.setdefault(reader, set()).add(filepath)
+            # Hold the idle readers while we talk to them
+            self._idle_readers = []
+        for reader in idle_readers:
+            reader.close_file(filepath)
+            self.release(reader)
+
+    def shutdown(self):
+        """
+        Stop all reader processes.  The pool must not be in use.
+        """
+        with self._lock:
+            readers = self._readers
+            self._readers = []
+            self._idle_readers = []
+            self._closed_files = {}
+        for reader in readers:
+            reader.join()
+
+
+_reader_pool = None
+_reader_pool_lock = threading.Lock()
+
+
+def getReaderPool():
+    """
+    The pool used by MultiProcessHdf5File objects, unless they are given their own.
+    """
+    global _reader_pool
+    with _reader_pool_lock:
+        if _reader_pool is None:
+            _reader_pool = ReaderPool()
+        return _reader_pool
+
+
+def _selectionShape(shape, slicing):
+    """
+    The shape of dataset[slicing] for a dataset of the given shape.
+    """
+    # Index a zero-strided array of the right shape, so numpy does the work without allocating anything.
+    dummy = numpy.lib.stride_tricks.as_strided(
+        numpy.zeros(1, dtype=numpy.uint8), shape=shape, strides=(0,) * len(shape)
+    )
+    return dummy[slicing].shape
 
 
 class _Dataset(object):
@@ -124,10 +327,11 @@ class _Dataset(object):
     (This makes attribute access very slow.)
     """
 
-    def __init__(self, mp_file, reader_process, internal_path):
+    def __init__(self, mp_file, reader_pool, internal_path):
         self._internal_path = internal_path
-        self._reader_process = reader_process
+        self._reader_pool = reader_pool
         self.mp_file = mp_file
+        self._shape, self._dtype = mp_file._dataset_info[internal_path]
 
         if self.compression is None:
             warnings.warn(
@@ -135,8 +339,17 @@ class _Dataset(object):
                 "Your dataset '{}' is not compressed.".format(self.mp_file._filepath + internal_path)
             )
 
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
     def __getitem__(self, slicing):
-        return self._reader_process.read_subvolume(self._internal_path, slicing)
+        out_array = numpy.empty(_selectionShape(self._shape, slicing), dtype=self._dtype)
+        return self._reader_pool.read_subvolume(self.mp_file._filepath, self._internal_path, slicing, out_array)
 
     def __getattribute__(self, name):
         try:
@@ -155,7 +368,10 @@ class _Dataset(object):
                 return val
 
     def read_direct(self, out_array, slicing):
-        out_array[:] = self[slicing]
+        """
+        Read into out_array.  If it was allocated with sharedArray(), the reader process writes into it directly.
+        """
+        self._reader_pool.read_subvolume(self.mp_file._filepath, self._internal_path, slicing, out_array)
 
 
 class _Group(object):
@@ -240,43 +456,35 @@ class MultiProcessHdf5File(_Group):
     Users requesting a group or
     """
 
-    def __init__(self, filepath, mode="r"):
+    def __init__(self, filepath, mode="r", reader_pool=None):
         super(MultiProcessHdf5File, self).__init__(self, "")
         assert mode == "r", "Only read-only access is permitted when using MultiProcessHdf5File objects."
         self._filepath = filepath
-        self._reader_processes = {}
-        self._lock = threading.Lock()
+        self._reader_pool = reader_pool or getReaderPool()
 
         self._all_paths = {}
+        self._dataset_info = {}
 
         def add_path(key, val):
-            # Store just the type for now.
-            # All attributes will be read with high overhead (i.e. temporarily opening the file...)
+            # Store just the type (and shape/dtype for datasets) for now.
+            # All other attributes will be read with high overhead (i.e. temporarily opening the file...)
             if key[0] != "/":
                 key = "/" + key
             self._all_paths[key] = type(val)
+            if isinstance(val, h5py.Dataset):
+                self._dataset_info[key] = (val.shape, val.dtype)
 
         with h5py.File(filepath, "r") as f:
             f.visititems(add_path)
 
     def _get_dataset(self, internal_path):
-        thread_id = threading.current_thread().ident
-        if thread_id not in self._reader_processes:
-            with self._lock:
-                if thread_id not in self._reader_processes:
-                    self._reader_processes[thread_id] = ReaderProcess(self._filepath)
-                    self._reader_processes[thread_id].start()
-        return _Dataset(self, self._reader_processes[thread_id], internal_path)
+        return _Dataset(self, self._reader_pool, internal_path)
 
     def __setitem__(self, *args):
         raise NotImplementedError("Not permitted to write to a file via MultiProcessHdf5File")
 
     def close(self):
-        with self._lock:
-            readers = list(self._reader_processes.values())
-            self._reader_processes.clear()
-            for reader in readers:
-                reader.join()
+        self._reader_pool.close_file(self._filepath)
 
     def __enter__(self):
         return self
@@ -390,7 +598,7 @@ if __name__ == "__main__":
         whole_vol = mphf[datapath][:]
         assert (whole_vol == testvol).all()
 
-        print(mphf[u"mygroup"].name)
+        print(mphf["mygroup"].name)
         print(list(mphf[datapath].attrs.keys()))
         print(mphf[datapath].shape)
         print(mphf[datapath].dtype)
@@ -25,6 +25,8 @@ from builtins import range
 from builtins import object
 from future.utils import raise_with_traceback
 import sys
+import collections
+import threading
 from functools import partial
 
 import numpy
@@ -62,6 +64,7 @@ class RoiRequestBatch(object):
     >>> # Create a list of rois to iterate through.
     >>> # Typically you'll want to automate this
     >>> #  with e.g. lazyflow.roi.getIntersectingBlocks
+    >>> #  (and lazyflow.roi.orderBlocks, for a cache-friendly order)
     >>> rois = []
     >>> rois.append( ( (0, 0), (10,10) ) )
     >>> rois.append( ( (0,10), (10,20) ) )
@@ -95,9 +98,32 @@ class RoiRequestBatch(object):
     Progress: 0 20 40 60 80 100 100
     >>> print(f"Processed {result_count[0]} result blocks with a total sum of: {result_total_sum[0]}")
     Processed 5 result blocks with a total sum of: 14500
+
+    Read-ahead: if a ``prefetchSlot`` is given (typically the output of an upstream cache,
+    e.g. the ``OpBlockedArrayCache`` right behind a file reader), then the rois of the next
+    ``prefetchDepth`` blocks are requested from that slot with low priority while the current
+    blocks are being computed.  That way, disk reads overlap with the (CPU-bound) processing of
+    the current blocks, instead of alternating with it.  The prefetched data is discarded; the
+    upstream cache is expected to hold on to it until the block is actually requested.
     """
 
-    def __init__(self, outputSlot, roiIterator, totalVolume=None, batchSize=2, allowParallelResults=False):
+    #: Priority of read-ahead requests, relative to the requests for the output blocks (which use the default ``[0]``)
+    #: (Read-ahead requests are also in the Request.PREFETCH priority class.)
+    PREFETCH_PRIORITY = [1]
+
+    def __init__(
+        self,
+        outputSlot,
+        roiIterator,
+        totalVolume=None,
+        batchSize=2,
+        allowParallelResults=False,
+        prefetchSlot=None,
+        prefetchDepth=None,
+        prefetchRoi=None,
+        prefetchMemory=None,
+        priorityClass=None,
+    ):
         """
         Constructor.
 
@@ -109,6 +135,19 @@ class RoiRequestBatch(object):
         :param batchSize: The maximum number of requests to launch in parallel.
         :param allowParallelResults: If False, The resultSignal will not be called in parallel.
                                      In that case, your handler function has no need for locks.
+        :param prefetchSlot: Optional upstream slot to warm ahead of time (see class docs).
+                             If not provided, no read-ahead is done.
+        :param prefetchDepth: How many rois beyond the active ones to read ahead.  Defaults to ``batchSize``.
+        :param prefetchRoi: Optional callable ``f(roi) -> (start, stop)``, mapping an output roi to the roi
+                            that should be requested from ``prefetchSlot`` (e.g. to add a filter halo).
+                            The result is clipped to the shape of ``prefetchSlot``.
+                            Defaults to the identity.
+        :param prefetchMemory: Maximum number of bytes that may be read ahead of the active requests.
+                               Rois beyond that window are prefetched once earlier ones were activated.
+                               If not provided, only ``prefetchDepth`` limits the read-ahead.
+        :param priorityClass: Priority class of the block requests, e.g. ``Request.BATCH``
+                              (see :py:class:`Request<lazyflow.request.Request>`).
+                              By default, it is inherited from the calling request.
         """
         self._resultSignal = OrderedSignal()
         self._progressSignal = OrderedSignal()
@@ -120,6 +159,7 @@ class RoiRequestBatch(object):
         self._roiIter = roiIterator
         self._batchSize = batchSize
         self._allowParallelResults = allowParallelResults
+        self._priorityClass = priorityClass
 
         self._condition = SimpleRequestCondition()
 
@@ -132,6 +172,20 @@ class RoiRequestBatch(object):
         self._totalVolume = totalVolume
         self._processedVolume = 0
 
+        # Read-ahead bookkeeping (only touched while holding self._condition)
+        self._prefetchSlot = prefetchSlot
+        self._prefetchDepth = batchSize if prefetchDepth is None else prefetchDepth
+        self._prefetchRoi = prefetchRoi
+        self._prefetchMemory = prefetchMemory
+        assert self._prefetchDepth >= 0
+        # Entries are [roi, prefetch_roi, nbytes, prefetched]
+        self._lookahead = collections.deque()
+        self._prefetchedBytes = 0
+
+        # Prefetch requests that haven't finished yet, touched from their callbacks
+        self._prefetchLock = threading.Lock()
+        self._prefetchRequests = set()
+
     @property
     def resultSignal(self):
         """
@@ -204,6 +258,9 @@ class RoiRequestBatch(object):
             if self._failure_excinfo:
                 exc_type, exc_value, exc_tb = self._failure_excinfo
                 raise_with_traceback(exc_type(exc_value), exc_tb)
+        finally:
+            # Any remaining read-ahead is either redundant by now or moot (we failed).
+            self._cancelPrefetchRequests()
 
         self.progressSignal(100)
 
@@ -213,19 +270,100 @@ class RoiRequestBatch(object):
         Otherwise, raises StopIteration
         """
         # This could raise StopIteration
-        roi = next(self._roiIter)
+        roi = self._nextRoi()
         req = self._outputSlot(roi[0], roi[1])
 
         # We have to make sure that we didn't get a so-called "ValueRequest"
         # because those don't work the same way.
         # (This can happen if array data was given to a slot via setValue().)
         assert isinstance(req, Request), "Can't use RoiRequestBatch with non-standard requests.  See comment above."
+        if self._priorityClass is not None:
+            req.priority_class = self._priorityClass
 
         req.notify_finished(partial(self._handleCompletedRequest, roi))
         req.notify_failed(partial(self._handleFailedRequest, roi))
         req.notify_cancelled(partial(self._handleCancelledRequest, roi))
         req.submit()
 
+    def _nextRoi(self):
+        """
+        Return the next roi to process, reading ahead of it if a prefetchSlot was given.
+        Raises StopIteration if there are no more rois.
+        """
+        if self._prefetchSlot is None:
+            return next(self._roiIter)
+
+        if self._lookahead:
+            roi, _, nbytes, prefetched = self._lookahead.popleft()
+            if prefetched:
+                # From now on, the prefetched data is part of an active request.
+                self._prefetchedBytes -= nbytes
+        else:
+            roi = next(self._roiIter)
+
+        # Refill the lookahead window (the iterator is allowed to run dry here)
+        while len(self._lookahead) < self._prefetchDepth:
+            try:
+                next_roi = next(self._roiIter)
+            except StopIteration:
+                break
+            prefetch_roi = self._getPrefetchRoi(next_roi)
+            nbytes = int(numpy.prod(numpy.subtract(prefetch_roi[1], prefetch_roi[0])))
+            nbytes *= numpy.dtype(self._prefetchSlot.meta.dtype).itemsize
+            self._lookahead.append([next_roi, prefetch_roi, nbytes, False])
+
+        # Prefetch, in order, as long as the memory window allows
+        for entry in self._lookahead:
+            _, prefetch_roi, nbytes, prefetched = entry
+            if prefetched:
+                continue
+            if (
+                self._prefetchMemory is not None
+                and self._prefetchedBytes > 0
+                and self._prefetchedBytes + nbytes > self._prefetchMemory
+            ):
+                break
+            entry[3] = True
+            self._prefetchedBytes += nbytes
+            self._submitPrefetch(prefetch_roi)
+
+        return roi
+
+    def _getPrefetchRoi(self, roi):
+        start, stop = roi if self._prefetchRoi is None else self._prefetchRoi(roi)
+        start = numpy.maximum(start, 0)
+        stop = numpy.minimum(stop, self._prefetchSlot.meta.shape)
+        return (tuple(start), tuple(stop))
+
+    def _submitPrefetch(self, prefetch_roi):
+        def prefetch():
+            # The result is dropped: we only want the upstream cache to hold the data.
+            self._prefetchSlot(*prefetch_roi).wait()
+
+        req = Request(prefetch, root_priority=self.PREFETCH_PRIORITY, priority_class=Request.PREFETCH)
+        done = partial(self._handleFinishedPrefetch, req)
+        req.notify_finished(lambda result: done())
+        req.notify_failed(partial(self._handleFailedPrefetch, req, prefetch_roi))
+        req.notify_cancelled(done)
+        with self._prefetchLock:
+            self._prefetchRequests.add(req)
+        req.submit()
+
+    def _handleFinishedPrefetch(self, req):
+        with self._prefetchLock:
+            self._prefetchRequests.discard(req)
+
+    def _handleFailedPrefetch(self, req, prefetch_roi, exc, exc_info):
+        # Not fatal: if the data is really unavailable, the request for the block itself will fail.
+        logger.debug("Read-ahead failed for roi {}: {}".format(prefetch_roi, exc))
+        self._handleFinishedPrefetch(req)
+
+    def _cancelPrefetchRequests(self):
+        with self._prefetchLock:
+            pending = list(self._prefetchRequests)
+        for req in pending:
+            req.cancel()
+
     def _handleCompletedRequest(self, roi, result):
         try:
             if self._allowParallelResults:
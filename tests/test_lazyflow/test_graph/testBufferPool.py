@@ -0,0 +1,129 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import gc
+
+import numpy
+import pytest
+
+from lazyflow import bufferPool
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    bufferPool.disable()
+    bufferPool.enable()
+    bufferPool.resetStatistics()
+    yield
+    bufferPool.disable()
+
+
+def test_reuse():
+    a = bufferPool.allocate((100, 200), numpy.float32)
+    assert a.shape == (100, 200) and a.dtype == numpy.float32
+    address = a.__array_interface__["data"][0]
+    del a
+
+    b = bufferPool.allocate((200, 100), numpy.float32)
+    assert b.__array_interface__["data"][0] == address
+
+    stats = bufferPool.getStatistics()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["returned"] == 1
+    assert stats["outstanding_bytes"] == b.nbytes
+
+
+def test_views_keep_buffer():
+    a = bufferPool.allocate((100, 200), numpy.float32)
+    view = a[10:20].T
+    del a
+    gc.collect()
+    assert bufferPool.getStatistics()["returned"] == 0
+
+    view[:] = 1
+    b = bufferPool.allocate((100, 200), numpy.float32)
+    assert not numpy.shares_memory(b, view)
+
+    del view
+    assert bufferPool.getStatistics()["returned"] == 1
+
+
+def test_small_arrays_not_pooled():
+    a = bufferPool.allocate((10,), numpy.uint8)
+    assert a.base is None
+    assert bufferPool.getStatistics()["unpooled"] == 1
+
+
+def test_max_bytes():
+    nbytes = bufferPool.MIN_BYTES
+    bufferPool.enable(maxBytes=2 * nbytes)
+    arrays = [bufferPool.allocate((nbytes,), numpy.uint8) for _ in range(3)]
+    del arrays
+
+    stats = bufferPool.getStatistics()
+    assert stats["returned"] == 3
+    assert stats["released"] == 1
+    assert stats["free_bytes"] == 2 * nbytes
+
+
+def test_trim():
+    nbytes = bufferPool.MIN_BYTES
+    arrays = [bufferPool.allocate((nbytes,), numpy.uint8) for _ in range(3)]
+    del arrays
+    assert bufferPool.freeBytes() == 3 * nbytes
+
+    assert bufferPool.trim(nbytes) == 2 * nbytes
+    assert bufferPool.freeBytes() == nbytes
+    assert bufferPool.trim() == nbytes
+    assert bufferPool.freeBytes() == 0
+
+
+def test_disabled():
+    bufferPool.disable()
+    a = bufferPool.allocate((bufferPool.MIN_BYTES,), numpy.uint8)
+    assert a.base is None
+    assert bufferPool.getStatistics()["unpooled"] == 1
+
+
+def test_request_results():
+    data = numpy.random.random((100, 200)).astype(numpy.float32)
+    op = OpArrayPiper(graph=Graph())
+    op.Input.setValue(data)
+
+    req = op.Output[:]
+    result = req.wait()
+    numpy.testing.assert_array_equal(result, data)
+    stats = bufferPool.getStatistics()
+    assert stats["allocations"] == 1
+
+    # Still referenced by the caller
+    req.clean()
+    assert bufferPool.getStatistics()["returned"] == 0
+
+    del result
+    assert bufferPool.getStatistics()["returned"] == 1
+
+    numpy.testing.assert_array_equal(op.Output[:].wait(), data)
+    assert bufferPool.getStatistics()["hits"] == 1
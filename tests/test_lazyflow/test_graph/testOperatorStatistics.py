@@ -0,0 +1,140 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import json
+import threading
+
+import numpy
+import pytest
+import vigra
+
+from lazyflow import operatorStatistics
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper, OpBlockedArrayCache
+
+
+@pytest.fixture
+def statistics():
+    operatorStatistics.reset()
+    operatorStatistics.enable()
+    yield operatorStatistics
+    operatorStatistics.disable()
+    operatorStatistics.reset()
+
+
+@pytest.fixture
+def pipeline():
+    data = vigra.taggedView(numpy.random.random((100, 100)).astype(numpy.float32), "yx")
+    graph = Graph()
+    op_piper = OpArrayPiper(graph=graph)
+    op_piper.Input.setValue(data)
+    op_cache = OpBlockedArrayCache(graph=graph)
+    op_cache.BlockShape.setValue((50, 50))
+    op_cache.Input.connect(op_piper.Output)
+    return op_piper, op_cache
+
+
+def test_histogram_bucket():
+    assert operatorStatistics.histogramBucket(0.0) == 0
+    assert operatorStatistics.histogramBucket(1e-6) == 1
+    assert operatorStatistics.histogramBucket(3e-6) == 2
+    assert operatorStatistics.histogramBucket(1e-3) == 10
+    assert operatorStatistics.histogramBucket(1e9) == operatorStatistics.NUM_HISTOGRAM_BUCKETS - 1
+
+
+def test_disabled_by_default(pipeline):
+    op_piper, op_cache = pipeline
+    operatorStatistics.reset()
+    op_cache.Output[:].wait()
+    assert operatorStatistics.getStatistics() == []
+
+
+def test_execution_statistics(statistics, pipeline):
+    op_piper, op_cache = pipeline
+    op_piper.Output[:10, :20].wait()
+    op_piper.Output[:10, :10].wait()
+
+    (entry,) = statistics.getStatistics()
+    assert entry.operator_path == op_piper.name
+    assert entry.slot_name == "Output"
+    assert entry.calls == 2
+    assert entry.bytes == (200 + 100) * 4
+    assert sum(entry.histogram) == 2
+    assert entry.total_time >= entry.max_time > 0
+    assert entry.hit_ratio is None
+
+
+def test_threads_are_merged(statistics, pipeline):
+    op_piper, op_cache = pipeline
+
+    def record():
+        for _ in range(100):
+            statistics.recordExecution(op_piper, op_piper.Output, 1e-3, 8)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    (entry,) = statistics.getStatistics()
+    assert entry.calls == 400
+    assert entry.bytes == 400 * 8
+    assert entry.histogram[statistics.histogramBucket(1e-3)] == 400
+
+    statistics.reset()
+    assert statistics.getStatistics() == []
+    record()
+    (entry,) = statistics.getStatistics()
+    assert entry.calls == 100
+
+
+def test_cache_hit_ratio(statistics, pipeline):
+    op_piper, op_cache = pipeline
+    op_cache.Output[:].wait()  # 4 misses
+    op_cache.Output[:50, :50].wait()  # 1 hit (possibly served inline, or as a view)
+    op_cache.Output[:10, :10].wait()  # 1 hit
+
+    cache_entries = [entry for entry in statistics.getStatistics() if entry.hit_ratio is not None]
+    (entry,) = cache_entries
+    assert entry.operator_path.startswith(op_cache.name + "/")
+    assert (entry.cache_hits, entry.cache_misses) == (2, 4)
+
+    # The upstream operator only ever produced the data once
+    (piper_entry,) = [entry for entry in statistics.getStatistics() if entry.operator_path == op_piper.name]
+    assert piper_entry.bytes == 100 * 100 * 4
+
+
+def test_dump(statistics, pipeline):
+    op_piper, op_cache = pipeline
+    op_cache.Output[:].wait()
+
+    table = statistics.formatTable(limit=2)
+    lines = table.splitlines()
+    assert len(lines) == 3
+    assert lines[0].split()[:3] == ["operator", "slot", "calls"]
+
+    dumped = json.loads(statistics.toJson(sortBy="calls"))
+    paths = [d["operator_path"] for d in dumped]
+    assert op_piper.name in paths
+    assert any(path.startswith(op_cache.name + "/") for path in paths)
+    assert [d["calls"] for d in dumped] == sorted((d["calls"] for d in dumped), reverse=True)
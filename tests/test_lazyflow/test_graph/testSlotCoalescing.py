@@ -0,0 +1,141 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import threading
+import time
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot
+from lazyflow.operators import OpArrayPiper
+from lazyflow.request import Request
+
+
+class OpSlowAddOne(Operator):
+    Input = InputSlot()
+    Output = OutputSlot(coalesce=True)
+
+    def __init__(self, *args, **kwargs):
+        super(OpSlowAddOne, self).__init__(*args, **kwargs)
+        self.executed_rois = []
+        self.destinations = []
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom(self.Input.meta)
+
+    def execute(self, slot, subindex, roi, result):
+        self.executed_rois.append((tuple(roi.start), tuple(roi.stop)))
+        self.destinations.append(result)
+        time.sleep(0.2)
+        result[:] = self.Input(roi.start, roi.stop).wait() + 1
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.Output.setDirty(roi)
+
+
+def get_in_parallel(*requests):
+    results = [None] * len(requests)
+
+    def wait(i):
+        results[i] = requests[i].wait()
+
+    threads = [threading.Thread(target=wait, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestCoalescing(object):
+    def setup_method(self, method):
+        self.data = vigra.taggedView(numpy.random.random((100, 100)).astype(numpy.float32), "yx")
+        graph = Graph()
+        self.op_source = OpArrayPiper(graph=graph)
+        self.op_source.Input.setValue(self.data)
+        self.op = OpSlowAddOne(graph=graph)
+        self.op.Input.connect(self.op_source.Output)
+
+    def test_identical_rois(self):
+        result_a, result_b = get_in_parallel(self.op.Output[:50, :50], self.op.Output[:50, :50])
+        assert self.op.executed_rois == [((0, 0), (50, 50))]
+        assert (result_a == self.data[:50, :50] + 1).all()
+        assert (result_b == self.data[:50, :50] + 1).all()
+
+        # Every request got its own copy
+        assert result_a is not result_b
+        result_a[:] = 0
+        assert (result_b == self.data[:50, :50] + 1).all()
+
+    def test_enclosed_roi(self):
+        result_big, result_small = get_in_parallel(self.op.Output[:50, :50], self.op.Output[10:20, 30:40])
+        assert self.op.executed_rois == [((0, 0), (50, 50))]
+        assert (result_small == self.data[10:20, 30:40] + 1).all()
+        assert (result_big == self.data[:50, :50] + 1).all()
+
+    def test_partial_overlap_is_computed_separately(self):
+        get_in_parallel(self.op.Output[:50, :50], self.op.Output[40:60, 40:60])
+        assert sorted(self.op.executed_rois) == [((0, 0), (50, 50)), ((40, 40), (60, 60))]
+
+    def test_sequential_requests_are_not_cached(self):
+        self.op.Output[:50, :50].wait()
+        self.op.Output[:50, :50].wait()
+        assert len(self.op.executed_rois) == 2
+
+    def test_write_into_destination(self):
+        destinations = [numpy.zeros((50, 50), dtype=numpy.float32) for _ in range(2)]
+        get_in_parallel(*(self.op.Output[:50, :50].writeInto(d) for d in destinations))
+        assert len(self.op.executed_rois) == 1
+        for destination in destinations:
+            assert (destination == self.data[:50, :50] + 1).all()
+
+    def test_first_request_computes_into_its_destination(self):
+        destination = numpy.zeros((50, 50), dtype=numpy.float32)
+        result_a, result_b = get_in_parallel(self.op.Output[:50, :50].writeInto(destination), self.op.Output[:50, :50])
+        assert len(self.op.executed_rois) == 1
+        assert result_a is destination
+        assert numpy.shares_memory(self.op.destinations[0], destination)
+        assert not numpy.shares_memory(result_b, destination)
+        assert (result_b == self.data[:50, :50] + 1).all()
+
+    def test_dirty_data_is_not_shared(self):
+        req_before = self.op.Output[:50, :50]
+        self.op_source.Input.setValue(self.data + 1)
+        req_after = self.op.Output[:50, :50]
+        result_before, result_after = get_in_parallel(req_before, req_after)
+        assert len(self.op.executed_rois) == 2
+        assert (result_after == (self.data[:50, :50] + 1) + 1).all()
+
+    def test_within_requests(self):
+        def get_block():
+            return self.op.Output[:50, :50].wait()
+
+        requests = [Request(get_block) for _ in range(4)]
+        for req in requests:
+            req.submit()
+        results = [req.wait() for req in requests]
+        if Request.global_thread_pool.num_workers > 1:
+            assert len(self.op.executed_rois) < 4
+        for result in results:
+            assert (result == self.data[:50, :50] + 1).all()
@@ -0,0 +1,141 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import pytest
+
+from lazyflow.operators import cacheEvictionPolicies
+
+from lazyflow.operators.cacheEvictionPolicies import (
+    LRUEvictionPolicy,
+    LFUEvictionPolicy,
+    CostAwareEvictionPolicy,
+    ARCEvictionPolicy,
+)
+
+
+def drain(policy):
+    victims = []
+    while True:
+        key = policy.popVictim()
+        if key is None:
+            return victims
+        victims.append(key)
+
+
+@pytest.mark.parametrize(
+    "policy_class", [LRUEvictionPolicy, LFUEvictionPolicy, CostAwareEvictionPolicy, ARCEvictionPolicy]
+)
+def test_every_block_is_evicted_once(policy_class):
+    policy = policy_class()
+    for key in "abcde":
+        policy.blockAccessed(key, 10, computeTime=1.0)
+    policy.blockAccessed("c", 10)
+    policy.blockAccessed("a", 10)
+
+    assert len(policy) == 5
+    assert sorted(drain(policy)) == list("abcde")
+    assert policy.popVictim() is None
+    assert len(policy) == 0
+
+
+@pytest.mark.parametrize(
+    "policy_class", [LRUEvictionPolicy, LFUEvictionPolicy, CostAwareEvictionPolicy, ARCEvictionPolicy]
+)
+def test_removed_blocks_are_not_evicted(policy_class):
+    policy = policy_class()
+    for key in "abc":
+        policy.blockAccessed(key, 10)
+    policy.blockRemoved("b")
+    policy.blockRemoved("unknown")
+
+    assert sorted(drain(policy)) == ["a", "c"]
+
+
+def test_lru_evicts_least_recently_used_first(monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(cacheEvictionPolicies.time, "time", lambda: next(clock))
+
+    policy = LRUEvictionPolicy()
+    for key in "abc":
+        policy.blockAccessed(key, 10)
+    policy.blockAccessed("a", 10)
+
+    assert drain(policy) == ["b", "c", "a"]
+
+
+def test_lfu_evicts_least_frequently_used_first():
+    policy = LFUEvictionPolicy()
+    for key, count in [("a", 3), ("b", 1), ("c", 2)]:
+        for _ in range(count):
+            policy.blockAccessed(key, 10)
+
+    assert drain(policy) == ["b", "c", "a"]
+
+
+def test_cost_aware_keeps_expensive_blocks():
+    policy = CostAwareEvictionPolicy()
+    policy.blockAccessed("raw", 1000, computeTime=0.01)
+    policy.blockAccessed("features", 1000, computeTime=2.0)
+    policy.blockAccessed("small_features", 10, computeTime=0.1)
+
+    assert drain(policy) == ["raw", "features", "small_features"]
+
+
+def test_cost_aware_cost_is_remembered_across_accesses():
+    policy = CostAwareEvictionPolicy()
+    policy.blockAccessed("expensive", 100, computeTime=5.0)
+    policy.blockAccessed("cheap", 100, computeTime=0.1)
+    # Cache hits don't know the compute time
+    policy.blockAccessed("expensive", 100)
+
+    assert drain(policy) == ["cheap", "expensive"]
+
+
+def test_arc_prefers_evicting_blocks_seen_once():
+    policy = ARCEvictionPolicy()
+    policy.blockAccessed("hot", 10)
+    policy.blockAccessed("hot", 10)
+    for key in ["scan1", "scan2", "scan3"]:
+        policy.blockAccessed(key, 10)
+
+    assert drain(policy) == ["scan1", "scan2", "scan3", "hot"]
+
+
+def test_arc_ghost_hit_promotes_block():
+    policy = ARCEvictionPolicy()
+    policy.blockAccessed("a", 10)
+    policy.blockAccessed("b", 10)
+    assert policy.popVictim() == "a"
+
+    # "a" is stored again after it was evicted, so it goes to the frequency list
+    # and the recency list gets a bigger share of the budget
+    policy.blockAccessed("a", 10)
+    assert "a" in policy._t2
+    assert policy._p > 0
+
+
+def test_heap_is_compacted():
+    policy = LRUEvictionPolicy()
+    for _ in range(10000):
+        policy.blockAccessed("a", 10)
+    assert len(policy._heap) < 2000
+    assert drain(policy) == ["a"]
@@ -32,6 +32,7 @@ import pytest
 import unittest
 
 import lazyflow
+from lazyflow import bufferPool
 from lazyflow.graph import Graph
 from lazyflow.roi import enlargeRoiForHalo, roiToSlice
 from lazyflow.rtype import SubRegion
@@ -40,6 +41,7 @@ from lazyflow.utility import BigRequestStreamer
 from lazyflow.operators.cacheMemoryManager import _CacheMemoryManager
 from lazyflow.utility import Memory
 from lazyflow.operators.cacheMemoryManager import default_refresh_interval
+from lazyflow.operators.cacheEvictionPolicies import CostAwareEvictionPolicy
 from lazyflow.operators.opCache import Cache
 from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
 from lazyflow.operators.opSplitRequestsBlockwise import OpSplitRequestsBlockwise
@@ -200,6 +202,60 @@ class TestCacheMemoryManager:
         c = pipe.accessCount
         assert c > b, "did not clean up"
 
+    def testBufferPoolHandling(self, cacheMemoryManager):
+        bufferPool.enable()
+        try:
+            arrays = [bufferPool.allocate((bufferPool.MIN_BYTES,), np.uint8) for _ in range(3)]
+            del arrays
+            assert bufferPool.freeBytes() > 0
+
+            # unused pool buffers count towards the cache memory
+            Memory.setAvailableRamCaches(0)
+            cacheMemoryManager.setRefreshInterval(0.01)
+            cacheMemoryManager.enable()
+            time.sleep(0.5)
+
+            assert bufferPool.freeBytes() == 0
+        finally:
+            bufferPool.disable()
+
+    def testEvictionPolicyOrder(self, cacheMemoryManager):
+        class FakeBlockedCache(object):
+            name = "fake"
+
+        cheap = FakeBlockedCache()
+        expensive = FakeBlockedCache()
+
+        cacheMemoryManager.setEvictionPolicy(CostAwareEvictionPolicy())
+        cacheMemoryManager.reportBlockAccess(expensive, "b0", 100, computeTime=10.0)
+        cacheMemoryManager.reportBlockAccess(cheap, "b0", 100, computeTime=0.1)
+        cacheMemoryManager.reportBlockAccess(cheap, "b1", 100, computeTime=0.2)
+        cacheMemoryManager.reportBlocksFreed(cheap, ["b1"])
+
+        assert cacheMemoryManager._popEvictionVictim() == (cheap, "b0")
+        assert cacheMemoryManager._popEvictionVictim() == (expensive, "b0")
+        assert cacheMemoryManager._popEvictionVictim() is None
+
+        # blocks of garbage collected caches are never returned
+        cacheMemoryManager.reportBlockAccess(cheap, "b0", 100, computeTime=0.1)
+        del cheap
+        gc.collect()
+        assert cacheMemoryManager._popEvictionVictim() is None
+
+    def testBlockReportsAreQueued(self, cacheMemoryManager):
+        class FakeBlockedCache(object):
+            name = "fake"
+
+        cache = FakeBlockedCache()
+        with cacheMemoryManager._policy_lock:
+            # Caches don't wait for the eviction policy when they report accesses
+            cacheMemoryManager.reportBlockAccess(cache, "b0", 100)
+            cacheMemoryManager.reportBlocksFreed(cache, ["b0"])
+            cacheMemoryManager.reportBlockAccess(cache, "b1", 100)
+
+        assert cacheMemoryManager._popEvictionVictim() == (cache, "b1")
+        assert cacheMemoryManager._popEvictionVictim() is None
+
     def testBadMemoryConditions(self):
         """
         TestCacheMemoryManager.testBadMemoryConditions
@@ -0,0 +1,79 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import numpy
+import pytest
+
+from lazyflow.operators.cacheSpillStore import DiskSpillStore
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = DiskSpillStore(1000, str(tmpdir))
+    yield store
+    store.close()
+
+
+def test_put_and_get(store):
+    data = numpy.arange(100, dtype=numpy.uint8).reshape(10, 10)
+    assert store.put("a", data)
+    assert "a" in store
+    assert store.usedBytes() == 100
+
+    spilled = store.get("a")
+    assert (spilled == data).all()
+    assert not spilled.flags.writeable
+    assert store.get("b") is None
+
+
+def test_budget_evicts_least_recently_used(store):
+    for key in "abc":
+        assert store.put(key, numpy.zeros(400, dtype=numpy.uint8))
+    assert sorted(store.keys()) == ["b", "c"]
+
+    store.get("b")
+    store.put("d", numpy.zeros(400, dtype=numpy.uint8))
+    assert sorted(store.keys()) == ["b", "d"]
+    assert store.usedBytes() == 800
+
+
+def test_rejects_unsuitable_arrays(store):
+    assert not store.put("big", numpy.zeros(1001, dtype=numpy.uint8))
+    assert not store.put("objects", numpy.array([None, 1], dtype=object))
+    assert not store.put("masked", numpy.ma.masked_array(numpy.zeros(10), mask=False))
+    assert len(store) == 0
+
+
+def test_discard_and_clear(store, tmpdir):
+    store.put("a", numpy.zeros(10))
+    store.put("b", numpy.zeros(10))
+    store.discard("a")
+    store.discard("unknown")
+    assert store.keys() == ["b"]
+
+    store.clear()
+    assert len(store) == 0
+    assert store.usedBytes() == 0
+
+    store.put("c", numpy.zeros(10))
+    store.close()
+    assert tmpdir.listdir() == []
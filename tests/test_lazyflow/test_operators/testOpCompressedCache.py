@@ -49,6 +49,7 @@ from lazyflow.operators.opCache import MemInfoNode
 from lazyflow.operators.cacheMemoryManager import CacheMemoryManager
 
 from lazyflow.utility.testing import OpArrayPiperWithAccessCount
+from lazyflow.utility.compressionCodecs import availableCodecs, defaultCodec
 
 logger = logging.getLogger("tests.testOpCompressedCache")
 cacheLogger = logging.getLogger("lazyflow.operators.opCompressedCache")
@@ -926,6 +927,95 @@ class TestOpCompressedCache(object):
         finally:
             shutil.rmtree(tempdir)
 
+    def testCodec(self):
+        sampleData = numpy.indices((100, 200, 150), dtype=numpy.float32).sum(0)
+        sampleData = vigra.taggedView(sampleData, axistags="xyz")
+
+        graph = Graph()
+        opData = OpArrayPiperWithAccessCount(graph=graph)
+        opData.Input.setValue(sampleData)
+
+        op = OpCompressedCache(graph=graph)
+        op.BlockShape.setValue([100, 75, 50])
+        op.Codec.setValue(defaultCodec())
+        op.Input.connect(opData.Output)
+
+        slicing = numpy.s_[10:90, 50:150, 75:150]
+        readData = op.Output[slicing].wait()
+        assert (readData == sampleData[slicing].view(numpy.ndarray)).all(), "Incorrect output!"
+        assert opData.accessCount == 2 * 2, str(opData.accessCount)
+
+        # Memory accounting is exactly the size of the compressed chunks
+        chunkBytes = sum(
+            len(buf) for block in list(op._cacheFiles.values()) for buf in list(block["data"]._chunks.values())
+        )
+        assert op.usedMemory() == chunkBytes
+
+        # Cached now
+        readData = op.Output[slicing].wait()
+        assert (readData == sampleData[slicing].view(numpy.ndarray)).all(), "Incorrect output!"
+        assert opData.accessCount == 2 * 2, str(opData.accessCount)
+
+        # Changing the storage drops the cache
+        for codec in [None] + availableCodecs():
+            if codec is None:
+                op.Codec.disconnect()
+            else:
+                op.Codec.setValue(codec)
+            accessCount = opData.accessCount
+            readData = op.Output[...].wait()
+            assert (readData == sampleData.view(numpy.ndarray)).all(), "Incorrect output for {}".format(codec)
+            assert opData.accessCount == accessCount + 3 * 3, str(opData.accessCount)
+
+    def testCodec_masked(self):
+        sampleData = numpy.indices((100, 200, 150), dtype=numpy.float32).sum(0)
+        sampleData = sampleData.view(numpy.ma.masked_array)
+        sampleData.set_fill_value(numpy.float32(numpy.nan))
+        sampleData[0] = numpy.ma.masked
+
+        graph = Graph()
+        opData = OpArrayPiper(graph=graph)
+        opData.Input.meta.has_mask = True
+        opData.Input.meta.axistags = vigra.defaultAxistags("xyz")
+        opData.Input.setValue(sampleData)
+
+        op = OpCompressedCache(graph=graph)
+        op.BlockShape.setValue([100, 75, 50])
+        op.Codec.setValue(defaultCodec())
+        op.Input.connect(opData.Output)
+
+        slicing = numpy.s_[0:90, 50:150, 75:150]
+        expectedData = sampleData[slicing]
+        readData = op.Output[slicing].wait()
+        assert (readData == expectedData).all() and (readData.mask == expectedData.mask).all(), "Incorrect output!"
+        assert numpy.isnan(readData.fill_value), "Incorrect output!"
+
+    def testCodecHDF5(self):
+        sampleData = numpy.indices((150, 250, 150), dtype=numpy.float32).sum(0)
+        sampleData = vigra.taggedView(sampleData, axistags="xyz")
+
+        graph = Graph()
+        opData = OpArrayPiper(graph=graph)
+        opData.Input.setValue(sampleData)
+
+        op = OpCompressedCache(graph=graph)
+        op.BlockShape.setValue([75, 125, 150])
+        op.Codec.setValue(defaultCodec())
+        op.Input.connect(opData.Output)
+
+        slicing = numpy.s_[0:75, 125:250, 0:150]
+        slicing_str = str([list(_) for _ in zip(*[[_.start, _.stop] for _ in slicing])])
+        expectedData = sampleData[slicing].view(numpy.ndarray)
+
+        h5_file = h5py.File("cache.h5", "w", driver="core", backing_store=False)
+        op.OutputHdf5[slicing].writeInto(h5_file).wait()
+        assert slicing_str in h5_file, "Missing dataset!"
+        assert (h5_file[slicing_str][()] == expectedData).all(), "Incorrect output!"
+
+        # Import into another block
+        op.InputHdf5[75:150, 0:125, 0:150] = h5_file[slicing_str]
+        assert (op.Output[75:150, 0:125, 0:150].wait() == expectedData).all(), "Incorrect output!"
+
     def testIdealBlockShapeChoice(self):
         sampleData = numpy.indices((150, 250, 350), dtype=numpy.float32).sum(0)
         sampleData = vigra.taggedView(sampleData, axistags="xyz")
@@ -24,6 +24,7 @@ from builtins import object
 ###############################################################################
 import numpy
 import vigra
+import h5py
 from lazyflow.graph import Graph
 from lazyflow.operators.opArrayPiper import OpArrayPiper
 from lazyflow.operators import OpCompressedUserLabelArray
@@ -32,9 +33,12 @@ from lazyflow.utility.slicingtools import slicing2shape
 
 
 class TestOpCompressedUserLabelArray(object):
+    sparse = False
+
     def setup(self):
         graph = Graph()
         op = OpCompressedUserLabelArray(graph=graph)
+        op.SparseStorage.setValue(self.sparse)
         arrayshape = (1, 100, 100, 10, 1)
         op.inputs["shape"].setValue(arrayshape)
         blockshape = (1, 10, 10, 10, 1)  # Why doesn't this work if blockshape is an ndarray?
@@ -314,6 +318,42 @@ class TestOpCompressedUserLabelArray(object):
         assert ((summed_projection != 0) == (projected_data != 0)).all()
 
 
+class TestOpCompressedUserLabelArraySparse(TestOpCompressedUserLabelArray):
+    sparse = True
+
+    def testOnlyLabeledPixelsStored(self):
+        op = self.op
+        assert len(op.nonzeroBlocks.value) == 8
+        assert sum(len(block) for block in op._sparseBlocks.values()) == numpy.count_nonzero(self.data)
+
+    def testHdf5Roundtrip(self):
+        op = self.op
+        h5_file = h5py.File("labels.h5", "w", driver="core", backing_store=False)
+        slicings = op.nonzeroBlocks.value
+        for slicing in slicings:
+            op.OutputHdf5[slicing].writeInto(h5_file).wait()
+
+        opLoaded = OpCompressedUserLabelArray(graph=op.graph)
+        opLoaded.SparseStorage.setValue(True)
+        opLoaded.shape.setValue(op.shape.value)
+        opLoaded.blockShape.setValue(op.blockShape.value)
+        opLoaded.eraser.setValue(100)
+        opLoaded.Input.setValue(op.Input.value)
+
+        for slicing in slicings:
+            slicing_str = str([list(_) for _ in zip(*[[_.start, _.stop] for _ in slicing])])
+            opLoaded.InputHdf5[slicing] = h5_file[slicing_str]
+        assert (opLoaded.Output[:].wait() == self.data).all()
+
+    def testStorageChange(self):
+        try:
+            self.op.SparseStorage.setValue(False)
+        except RuntimeError:
+            pass
+        else:
+            assert False, "Changing the label storage with stored labels should raise"
+
+
 class TestOpCompressedUserLabelArray_masked(object):
     def setup(self):
         graph = Graph()
@@ -371,6 +371,97 @@ class TestLazy(TestVigra):
         )
 
 
+class TestTwoPass(TestVigra):
+    def setup_method(self, method):
+        self.method = np.asarray(["twopass"], dtype=np.object)
+
+    @unittest.skip("The input is read block by block with two-pass labeling")
+    def testCorrectBlocking(self):
+        pass
+
+    @unittest.skip("The input is read block by block with two-pass labeling")
+    def testNoRecomputation(self):
+        pass
+
+    def testMergeAcrossBlocks(self):
+        vol = np.random.randint(0, 3, size=(50, 40, 30)).astype(np.uint8)
+        vol = vigra.taggedView(vol, axistags="xyz")
+
+        g = Graph()
+        opPiper = OpArrayPiper(graph=g)
+        opPiper.Input.setValue(vol)
+        # many small blocks, objects span several of them
+        opPiper.Output.meta["ideal_blockshape"] = (16, 16, 8)
+
+        op = OpLabelVolume(graph=g)
+        op.Method.setValue(self.method)
+        op.Input.connect(opPiper.Output)
+
+        out = op.Output[...].wait()
+        out = vigra.taggedView(out, axistags=op.Output.meta.axistags)
+        expected = vigra.analysis.labelVolumeWithBackground(vol)
+        assertEquivalentLabeling(expected, out)
+        # labels are contiguous
+        assert_array_equal(np.unique(out), np.arange(out.max() + 1))
+
+    def testIncremental(self):
+        vol = np.zeros((60, 40, 20), dtype=np.uint8)
+        vol = vigra.taggedView(vol, axistags="xyz")
+        vol[5:15, 5:15, 5:15] = 1
+        vol[40:55, 25:35, 5:15] = 1
+
+        g = Graph()
+        opPiper = OpArrayPiper(graph=g)
+        opPiper.Input.setValue(vol)
+        opPiper.Output.meta["ideal_blockshape"] = (20, 20, 10)
+
+        op = OpLabelVolume(graph=g)
+        op.Method.setValue(self.method)
+        op.Incremental.setValue(True)
+        op.Input.connect(opPiper.Output)
+
+        opDirty = DirtyRecorder(graph=g)
+        opDirty.Input.connect(op.CachedOutput)
+
+        out1 = op.CachedOutput[...].wait()
+
+        # a new object next to the second one
+        vol[45:50, 5:10, 2:5] = 1
+        opPiper.Input.setDirty(SubRegion(opPiper.Input, start=(45, 5, 2), stop=(50, 10, 5)))
+
+        # only the block of the new object is dirty
+        assert len(opDirty.rois) > 0
+        for roi in opDirty.rois:
+            assert np.all(np.asarray(roi.start) >= (40, 0, 0)), roi
+            assert np.all(np.asarray(roi.stop) <= (60, 20, 10)), roi
+
+        out2 = op.CachedOutput[...].wait()
+        out2 = vigra.taggedView(out2, axistags=op.Output.meta.axistags)
+        assertEquivalentLabeling(vigra.analysis.labelVolumeWithBackground(vol), out2)
+        # the other objects keep their labels
+        assert out2[10, 10, 10] == out1[10, 10, 10]
+        assert out2[50, 30, 10] == out1[50, 30, 10]
+
+        # connect the objects
+        vol[45:50, 10:25, 2:6] = 1
+        opPiper.Input.setDirty(SubRegion(opPiper.Input, start=(45, 10, 2), stop=(50, 25, 6)))
+        out3 = op.CachedOutput[...].wait()
+        out3 = vigra.taggedView(out3, axistags=op.Output.meta.axistags)
+        assertEquivalentLabeling(vigra.analysis.labelVolumeWithBackground(vol), out3)
+        assert out3[10, 10, 10] == out1[10, 10, 10]
+
+
+class DirtyRecorder(Operator):
+    Input = InputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super(DirtyRecorder, self).__init__(*args, **kwargs)
+        self.rois = []
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.rois.append(roi)
+
+
 class DirtyAssert(Operator):
     Input = InputSlot()
 
@@ -30,6 +30,7 @@ from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 from lazyflow.utility.testing import assertEquivalentLabeling
 from lazyflow.operators.opLazyConnectedComponents import OpLazyConnectedComponents as OpLazyCC
+from lazyflow.operators.opLazyConnectedComponents import UnionFindArray
 
 from lazyflow.graph import Graph
 from lazyflow.operator import Operator
@@ -460,6 +461,37 @@ class TestOpLazyCC(unittest.TestCase):
         assert len(blocks) == 100, "Got {} clean blocks (expected {}".format(len(blocks), 100)
 
 
+class TestUnionFindArray(unittest.TestCase):
+    def testMakeUnions(self):
+        n = 1000
+        uf = UnionFindArray(1)
+        assert uf.makeNewIndices(n - 1) == 1
+
+        rng = np.random.RandomState(0)
+        a = rng.randint(1, n, size=500)
+        b = rng.randint(1, n, size=500)
+        uf.makeUnions(a, b)
+
+        # reference: one union at a time
+        ref = UnionFindArray(1)
+        ref.makeNewIndices(n - 1)
+        for x, y in zip(a, b):
+            ref.makeUnion(x, y)
+
+        expected = np.asarray([ref.findIndex(i) for i in range(n)])
+        assert_array_equal(uf.findIndices(np.arange(n)), expected)
+        # the smallest index represents the region
+        assert np.all(expected <= np.arange(n))
+
+    def testGrow(self):
+        uf = UnionFindArray(1)
+        first = uf.makeNewIndices(5000)
+        last = uf.makeNewIndex()
+        assert last == first + 5000
+        uf.makeUnion(last, first)
+        assert uf.findIndex(last) == first
+
+
 class OpExecuteCounter(OpArrayPiper):
     def __init__(self, *args, **kwargs):
         self.numCalls = 0
@@ -3,6 +3,7 @@ import vigra
 
 from lazyflow.graph import Graph
 from lazyflow.operators import OpPixelFeaturesPresmoothed
+from lazyflow.operators.filterOperators import WITH_FAST_FILTERS
 
 DEBUG = False
 
@@ -76,6 +77,59 @@ class TestOpPixelFeaturesPresmoothed(object):
         assert computed_whole.shape == computed_per_slice.shape
         assert numpy.allclose(computed_whole, computed_per_slice), abs(computed_whole - computed_per_slice).max()
 
+    def test_cache_presmoothed(self):
+        def make_op(cache_presmoothed):
+            op = OpPixelFeaturesPresmoothed(graph=Graph())
+            # Smaller than the halos of the larger scales
+            op.PRESMOOTHED_BLOCK_SHAPE = (4, 8, 8)
+            op.Scales.setValue([0.7, 1.6, 2.0])
+            op.FeatureIds.setValue(["GaussianSmoothing", "LaplacianOfGaussian", "HessianOfGaussianEigenvalues"])
+            op.SelectionMatrix.setValue(
+                numpy.array([[True, False, True], [False, True, False], [True, False, True]], dtype=bool)
+            )
+            op.ComputeIn2d.setValue([False, True, False])
+            op.CachePresmoothed.setValue(cache_presmoothed)
+            op.Input.setValue(self.data)
+            return op
+
+        expected = make_op(False).Output[:].wait()
+
+        op = make_op(True)
+        assert len(op._presmoothingCaches) == 3
+
+        # Request adjacent tiles, which share their halos via the pre-smoothing caches
+        computed = numpy.zeros_like(expected)
+        for z in range(0, self.data.shape[2], 5):
+            for y in range(0, self.data.shape[3], 10):
+                tile = numpy.s_[:, :, z : z + 5, y : y + 10, :]
+                computed[tile] = op.Output[tile].wait()
+
+        assert numpy.allclose(computed, expected, atol=1e-5), abs(computed - expected).max()
+
+    def test_share_derivatives(self):
+        def make_op(share_derivatives):
+            op = OpPixelFeaturesPresmoothed(graph=Graph())
+            op.Scales.setValue([0.7, 1.0, 1.6])
+            # all features at all scales, the default FeatureIds
+            op.SelectionMatrix.setValue(numpy.ones((6, 3), dtype=bool))
+            op.ComputeIn2d.setValue([False, True, False])
+            op.ShareDerivatives.setValue(share_derivatives)
+            op.Input.setValue(self.data)
+            return op
+
+        expected = make_op(False).Output[:].wait()
+        op = make_op(True)
+
+        # the kernels of fastfilters differ slightly from vigra's
+        atol = 1e-3 if WITH_FAST_FILTERS else 1e-4
+        computed = op.Output[:].wait()
+        assert numpy.allclose(computed, expected, atol=atol), abs(computed - expected).max()
+
+        # Channel ranges that start and stop within the multi-channel eigenvalue features
+        tile = numpy.s_[1:, 5:40, 2:7, 3:15, :]
+        computed = op.Output[tile].wait()
+        assert numpy.allclose(computed, expected[tile], atol=atol), abs(computed - expected[tile]).max()
+
 
 if __name__ == "__main__":
     import sys
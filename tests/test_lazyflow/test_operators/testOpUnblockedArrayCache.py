@@ -3,10 +3,14 @@ from builtins import object
 import numpy as np
 import vigra
 
-from lazyflow.request import RequestPool
+from lazyflow.request import Request, RequestPool
+from lazyflow.request.request import _InlineRequest
 from lazyflow.graph import Graph
 from lazyflow.roi import roiToSlice
 from lazyflow.operators.opUnblockedArrayCache import OpUnblockedArrayCache
+from lazyflow.operators.opSimpleBlockedArrayCache import OpSimpleBlockedArrayCache
+from lazyflow.operators.opBlockedArrayCache import OpBlockedArrayCache
+from lazyflow.utility import BigRequestStreamer
 from lazyflow.utility.testing import OpArrayPiperWithAccessCount
 
 import logging
@@ -78,6 +82,92 @@ class TestOpUnblockedArrayCacheCache(object):
         assert opDataProvider.accessCount == 0
         assert opCache.CleanBlocks.value == [roiToSlice(*roi)]
 
+    def testCacheHitExecutesInline(self):
+        graph = Graph()
+        opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opCache = OpUnblockedArrayCache(graph=graph)
+
+        data = np.random.random((100, 100, 100)).astype(np.float32)
+        opDataProvider.Input.setValue(vigra.taggedView(data, "zyx"))
+        opCache.Input.connect(opDataProvider.Output)
+
+        roi = ((30, 30, 30), (50, 50, 50))
+        assert isinstance(opCache.Output(*roi), Request)
+        opCache.Output(*roi).wait()
+
+        inner_roi = ((35, 35, 35), (45, 45, 45))
+        req = opCache.Output(*inner_roi)
+        assert isinstance(req, _InlineRequest)
+
+        result = np.zeros((10, 10, 10), dtype=np.float32)
+        req.writeInto(result).wait()
+        assert (result == data[roiToSlice(*inner_roi)]).all()
+        assert opDataProvider.accessCount == 1
+
+    def testZeroCopyHits(self):
+        graph = Graph()
+        opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opCache = OpUnblockedArrayCache(graph=graph)
+        opCache.ZeroCopyEnabled.setValue(True)
+
+        data = np.random.random((100, 100, 100)).astype(np.float32)
+        opDataProvider.Input.setValue(vigra.taggedView(data, "zyx"))
+        opCache.Input.connect(opDataProvider.Output)
+
+        roi = ((30, 30, 30), (50, 50, 50))
+        opCache.Output(*roi).wait()
+
+        inner_roi = ((35, 35, 35), (45, 45, 45))
+        view = opCache.Output(*inner_roi).wait()
+        assert (view == data[roiToSlice(*inner_roi)]).all()
+        assert not view.flags.writeable
+        assert np.shares_memory(view, opCache._block_data[roi])
+        assert opDataProvider.accessCount == 1
+
+        # Given destinations are still filled
+        result = np.zeros((10, 10, 10), dtype=np.float32)
+        opCache.Output(*inner_roi).writeInto(result).wait()
+        assert (result == data[roiToSlice(*inner_roi)]).all()
+
+        # Compressed blocks are copied (only the requested part is decompressed)
+        opCache.CompressionEnabled.setValue(True)
+        opDataProvider.Input.setDirty(slice(None))
+        opCache.Output(*roi).wait()
+        cache_data = opCache.Output(*inner_roi).wait()
+        assert (cache_data == data[roiToSlice(*inner_roi)]).all()
+        assert cache_data.flags.writeable
+        assert opDataProvider.accessCount == 2
+
+    def testStreamWarmCache(self):
+        """
+        Exporting after viewing: cache hits (inline requests) must work with BigRequestStreamer.
+        """
+        data = np.random.random((100, 100, 100)).astype(np.float32)
+        for opClass in (OpUnblockedArrayCache, OpSimpleBlockedArrayCache, OpBlockedArrayCache):
+            graph = Graph()
+            opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
+            opDataProvider.Input.setValue(vigra.taggedView(data, "zyx"))
+            opCache = opClass(graph=graph)
+            opCache.Input.connect(opDataProvider.Output)
+            if opClass is not OpUnblockedArrayCache:
+                opCache.BlockShape.setValue((50, 50, 50))
+
+            # Warm the cache
+            opCache.Output[:].wait()
+            accessCount = opDataProvider.accessCount
+
+            result = np.zeros_like(data)
+
+            def handleResult(roi, block):
+                result[roiToSlice(*roi)] = block
+
+            streamer = BigRequestStreamer(opCache.Output, [(0, 0, 0), (100, 100, 100)], (25, 25, 25), batchSize=4)
+            streamer.resultSignal.subscribe(handleResult)
+            streamer.execute()
+
+            assert (result == data).all(), opClass.__name__
+            assert opDataProvider.accessCount == accessCount, opClass.__name__
+
     def testSetInSlot(self):
         graph = Graph()
         opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
@@ -169,6 +259,72 @@ class TestOpUnblockedArrayCacheCache(object):
         assert (cache_data == data[roiToSlice(*inner_roi)]).all()
         assert opDataProvider.accessCount == 0
 
+    def testDiskSpill(self, tmpdir):
+        graph = Graph()
+        opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opCache = OpUnblockedArrayCache(graph=graph)
+        opCache.SpillBudget.setValue(10 * 1024 ** 2)
+        opCache.SpillDirectory.setValue(str(tmpdir))
+
+        data = np.random.random((100, 100, 100)).astype(np.float32)
+        opDataProvider.Input.setValue(vigra.taggedView(data, "zyx"))
+        opCache.Input.connect(opDataProvider.Output)
+
+        roi = ((30, 30, 30), (50, 50, 50))
+        opCache.Output(*roi).wait()
+        assert opDataProvider.accessCount == 1
+
+        # Evict the block: it is written to disk instead of being dropped
+        block_key = opCache.getBlockAccessTimes()[0][0]
+        assert opCache.freeBlock(block_key) == 20 ** 3 * 4
+        assert opCache.CleanBlocks.value == []
+        (scratch_dir,) = tmpdir.listdir()
+        assert len(scratch_dir.listdir()) == 1
+
+        # Inner rois of spilled blocks are read back from disk, too
+        inner_roi = ((35, 35, 35), (45, 45, 45))
+        cache_data = opCache.Output(*inner_roi).wait()
+        assert (cache_data == data[roiToSlice(*inner_roi)]).all()
+        assert opDataProvider.accessCount == 1
+        assert opCache.CleanBlocks.value == [roiToSlice(*roi)]
+
+        # Dirty blocks are removed from disk as well
+        opCache.freeBlock(block_key)
+        opDataProvider.Input.setDirty((30, 30, 30), (31, 31, 31))
+        cache_data = opCache.Output(*roi).wait()
+        assert (cache_data == data[roiToSlice(*roi)]).all()
+        assert opDataProvider.accessCount == 2
+
+    def testDiskSpillBudget(self, tmpdir):
+        graph = Graph()
+        opDataProvider = OpArrayPiperWithAccessCount(graph=graph)
+        opCache = OpUnblockedArrayCache(graph=graph)
+        # Room for a single block on disk
+        opCache.SpillBudget.setValue(20 ** 3 * 4)
+        opCache.SpillDirectory.setValue(str(tmpdir))
+
+        data = np.random.random((100, 100, 100)).astype(np.float32)
+        opDataProvider.Input.setValue(vigra.taggedView(data, "zyx"))
+        opCache.Input.connect(opDataProvider.Output)
+
+        first_roi = ((0, 0, 0), (20, 20, 20))
+        second_roi = ((20, 0, 0), (40, 20, 20))
+        opCache.Output(*first_roi).wait()
+        opCache.Output(*second_roi).wait()
+        opCache.freeBlock(first_roi)
+        opCache.freeBlock(second_roi)
+        assert opDataProvider.accessCount == 2
+
+        # The store deleted the first block to make room for the second one
+        inner_roi = ((5, 5, 5), (10, 10, 10))
+        assert opCache._get_containing_spilled_roi(inner_roi) is None
+        assert first_roi not in opCache._spill_index
+        assert opCache._get_containing_spilled_roi(((25, 5, 5), (30, 10, 10))) == second_roi
+
+        cache_data = opCache.Output(*inner_roi).wait()
+        assert (cache_data == data[roiToSlice(*inner_roi)]).all()
+        assert opDataProvider.accessCount == 3
+
 
 if __name__ == "__main__":
     # Set up logging for debug
@@ -0,0 +1,104 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+
+import os
+
+import numpy
+import pytest
+
+from lazyflow.request import Request, RequestPool
+from lazyflow.request import processPool
+from lazyflow.request.processPool import offloadable
+
+
+@offloadable
+def getpid():
+    return os.getpid()
+
+
+@offloadable
+def scaled(a, factor):
+    return a * factor
+
+
+@offloadable
+def fill(value, out):
+    out[...] = value
+    return out
+
+
+@offloadable
+def fail():
+    raise ValueError("failed in worker")
+
+
+@pytest.fixture
+def process_pool():
+    processPool.enable(2)
+    yield
+    processPool.disable()
+
+
+def test_disabled_runs_inline():
+    assert not processPool.isEnabled()
+    assert getpid() == os.getpid()
+
+    a = numpy.arange(10)
+    assert (scaled(a, 2) == 2 * a).all()
+
+
+def test_offloaded(process_pool):
+    assert processPool.isEnabled()
+    assert getpid() != os.getpid()
+
+    a = numpy.random.random((20, 30)).astype(numpy.float32)
+    result = scaled(a, 3)
+    assert result.dtype == numpy.float32
+    numpy.testing.assert_array_equal(result, 3 * a)
+
+    # Non-contiguous arrays are copied into the shared segments, too
+    numpy.testing.assert_array_equal(scaled(a[::2, ::3], 2), 2 * a[::2, ::3])
+
+
+def test_out_argument(process_pool):
+    out = numpy.zeros((5, 6), dtype=numpy.uint8)
+    result = fill(7, out=out)
+    assert result is out
+    assert (out == 7).all()
+
+
+def test_exception(process_pool):
+    with pytest.raises(ValueError):
+        fail()
+
+
+def test_from_requests(process_pool):
+    a = numpy.arange(1000)
+    pool = RequestPool()
+    requests = [Request(lambda i=i: scaled(a, i)) for i in range(10)]
+    for req in requests:
+        pool.add(req)
+    pool.wait()
+
+    for i, req in enumerate(requests):
+        numpy.testing.assert_array_equal(req.wait(), i * a)
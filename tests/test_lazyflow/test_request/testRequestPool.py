@@ -19,10 +19,13 @@ from builtins import range
 
 import sys
 import time
+import itertools
+import threading
 from functools import partial
 import numpy
+import pytest
 
-from lazyflow.request.request import Request, RequestPool
+from lazyflow.request.request import Request, RequestPool, RequestStream
 
 from lazyflow.testing import fail_after_timeout
 
@@ -168,6 +171,84 @@ def test_pool_results_discarded_REQUEST_CONTEXT():
     mainreq.wait()
 
 
+def _impl_test_stream_basic():
+    alive = [0, 0]  # (current, max)
+    lock = threading.Lock()
+
+    def items():
+        for i in range(200):
+            with lock:
+                alive[0] += 1
+                alive[1] = max(alive)
+            yield i
+
+    def square(x):
+        time.sleep(0.001)
+        return x * x
+
+    results = {}
+    for item, result in RequestStream(square, items(), max_active=4):
+        results[item] = result
+        with lock:
+            alive[0] -= 1
+
+    assert results == {i: i * i for i in range(200)}
+    # Items are pulled lazily: never more than max_active items (and their requests) alive
+    assert alive[1] <= 4
+
+
+def test_stream_basic_THREAD_CONTEXT():
+    _impl_test_stream_basic()
+
+
+def test_stream_basic_REQUEST_CONTEXT():
+    mainreq = Request(_impl_test_stream_basic)
+    mainreq.submit()
+    mainreq.wait()
+
+
+def test_stream_failure_stops_early():
+    class SpecialException(Exception):
+        pass
+
+    pulled = itertools.count()
+
+    def items():
+        for i in range(100000):
+            next(pulled)
+            yield i
+
+    def fail_on_10(x):
+        if x == 10:
+            raise SpecialException()
+        time.sleep(0.001)
+        return x
+
+    with pytest.raises(SpecialException):
+        for _ in RequestStream(fail_on_10, items(), max_active=4):
+            pass
+
+    # The generator was not drained after the failure
+    assert next(pulled) < 100
+
+
+def test_stream_abandoned():
+    executed = itertools.count()
+
+    def work(x):
+        next(executed)
+        time.sleep(0.01)
+        return x
+
+    stream = RequestStream(work, range(1000), max_active=2)
+    for item, result in stream:
+        break
+
+    time.sleep(0.1)
+    assert next(executed) < 10
+    assert len(stream) == 0
+
+
 if __name__ == "__main__":
     # Logging is OFF by default when running from command-line nose, i.e.:
     # nosetests thisFile.py)
@@ -0,0 +1,120 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import json
+import time
+
+import numpy
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.request import Request, RequestTracer
+
+
+def parent_workload():
+    def child_workload():
+        time.sleep(0.01)
+        return 1
+
+    children = [Request(child_workload) for _ in range(3)]
+    for child in children:
+        child.submit()
+    return sum(child.wait() for child in children)
+
+
+def run_parent():
+    # Submit first, so the parent runs in a worker (children of requests that are
+    # executed directly within a foreign thread don't know their parent).
+    req = Request(parent_workload)
+    req.submit()
+    return req.wait()
+
+
+def test_not_traced_by_default():
+    req = Request(lambda: 42)
+    assert req._trace_id is None
+    assert req.wait() == 42
+
+
+def test_request_relationships():
+    with RequestTracer() as tracer:
+        assert run_parent() == 3
+    assert Request._tracer is None
+
+    requests = tracer.requests
+    assert len(requests) == 4
+    (parent,) = [info for info in requests.values() if info.parent_id is None]
+    assert parent.name == "parent_workload"
+    children = [info for info in requests.values() if info.parent_id == parent.trace_id]
+    assert len(children) == 3
+    assert all(info.name == "parent_workload.<locals>.child_workload" for info in children)
+
+
+def test_chrome_trace_export(tmpdir):
+    with RequestTracer() as tracer:
+        run_parent()
+
+    path = str(tmpdir.join("trace.json"))
+    tracer.exportChromeTrace(path)
+    with open(path) as f:
+        trace = json.load(f)
+
+    slices = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert {e["name"] for e in slices} == {"parent_workload", "parent_workload.<locals>.child_workload"}
+    # Every child ran for at least 10ms (possibly split up by suspensions)
+    child_durations = {}
+    for e in slices:
+        if e["name"] != "parent_workload":
+            child_durations[e["args"]["request"]] = child_durations.get(e["args"]["request"], 0) + e["dur"]
+    assert len(child_durations) == 3
+    assert all(dur >= 10000 for dur in child_durations.values())
+    assert all(e["dur"] >= 0 for e in slices)
+
+
+def test_collapsed_stacks(tmpdir):
+    with RequestTracer() as tracer:
+        run_parent()
+
+    stacks = tracer.collapsedStacks()
+    child_stack = "parent_workload;parent_workload.<locals>.child_workload"
+    assert child_stack in stacks
+    assert stacks[child_stack] >= 3 * 10000
+
+    path = str(tmpdir.join("trace.folded"))
+    tracer.exportCollapsedStacks(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert "{} {}".format(child_stack, stacks[child_stack]) in lines
+
+
+def test_slot_requests_name_operator_and_slot():
+    op = OpArrayPiper(graph=Graph())
+    op.Input.setValue(numpy.zeros((10, 10)))
+
+    with RequestTracer() as tracer:
+        op.Output[:].wait()
+
+    infos = [info for info in tracer.requests.values() if info.operator is not None]
+    assert infos
+    assert infos[0].operator == op.name
+    assert infos[0].slot == "Output"
+    assert infos[0].name == "{}.Output".format(op.name)
@@ -24,12 +24,12 @@ import threading
 
 import pytest
 
-from lazyflow.request.threadPool import ThreadPool
+from lazyflow.request.threadPool import ThreadPool, WorkStealingThreadPool
 
 
-@pytest.fixture
-def pool():
-    p = ThreadPool(num_workers=4)
+@pytest.fixture(params=[ThreadPool, WorkStealingThreadPool])
+def pool(request):
+    p = request.param(num_workers=4)
     yield p
     p.stop()
 
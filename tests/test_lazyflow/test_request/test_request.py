@@ -1,3 +1,4 @@
+import asyncio
 import time
 import threading
 from unittest import mock
@@ -294,3 +295,219 @@ class TestRequestWithValue:
         assert arr.get_fill_value() == dst.get_fill_value()
         assert_array_equal(np.array([12, 10, 42]), arr.filled())
         assert_array_equal(arr.filled(), dst.filled())
+
+
+class TestInlineRequest:
+    def test_return_value(self):
+        req = Request.inline(lambda: 42)
+        assert not req.started
+        assert req.wait() == 42
+        assert req.started
+
+    def test_executes_once(self):
+        fn = mock.Mock(return_value=42)
+        req = Request.inline(fn)
+        req.submit()
+        assert req.wait() == 42
+        assert req.wait() == 42
+        fn.assert_called_once_with()
+
+    def test_executes_in_calling_thread(self):
+        req = Request.inline(threading.current_thread)
+        assert req.wait() is threading.current_thread()
+
+    def test_is_request(self):
+        assert isinstance(Request.inline(lambda: 42), Request)
+
+    def test_notify_finished(self):
+        cb = mock.Mock()
+        req = Request.inline(lambda: 42)
+        req.notify_finished(cb)
+        cb.assert_not_called()
+        assert req.wait() == 42
+        cb.assert_called_once_with(42)
+
+    def test_submit_defers_callbacks(self):
+        calls = []
+        submitted = threading.Event()
+
+        def fn():
+            # Don't finish before submit() has returned
+            submitted.wait()
+            return 42
+
+        req = Request.inline(fn)
+        req.notify_finished(lambda result: calls.append((result, threading.current_thread())))
+        req.submit()
+        submitted.set()
+        assert req.wait() == 42
+        [(result, thread)] = calls
+        assert result == 42
+        assert thread is not threading.current_thread()
+
+    def test_exception_raised_on_wait_and_notified(self):
+        def broken_fn():
+            raise TExc()
+
+        failed_cb = mock.Mock()
+        finished_cb = mock.Mock()
+        req = Request.inline(broken_fn)
+        req.notify_failed(failed_cb)
+        req.notify_finished(finished_cb)
+
+        with pytest.raises(TExc):
+            req.wait()
+
+        failed_cb.assert_called_once()
+        finished_cb.assert_not_called()
+
+    def test_direct_wait_is_lightweight(self):
+        req = Request.inline(lambda: 42)
+        assert req.wait() == 42
+        assert "finished_event" not in vars(req)
+        assert "_sig_finished" not in vars(req)
+
+    def test_wait_within_request(self):
+        def parent():
+            req = Request.inline(lambda: 42)
+            assert req.wait() == 42
+            # Finished inline requests don't linger as children of the parent
+            return req not in Request._current_request().child_requests
+
+        req = Request(parent)
+        req.submit()
+        assert req.wait()
+
+    def test_concurrent_wait(self):
+        started = threading.Event()
+        gate = threading.Event()
+
+        def fn():
+            started.set()
+            gate.wait()
+            return 42
+
+        req = Request.inline(fn)
+        results = []
+        first = threading.Thread(target=lambda: results.append(req.wait()))
+        first.start()
+        started.wait()
+        # The second thread waits for the execution in the first one
+        second = threading.Thread(target=lambda: results.append(req.wait()))
+        second.start()
+        gate.set()
+        first.join()
+        second.join()
+        assert results == [42, 42]
+
+    def test_write_into(self):
+        dst = np.zeros(3)
+
+        def fn(destination):
+            destination[:] = 7
+            return destination
+
+        req = Request.inline(fn)
+        assert req.writeInto(dst).wait() is dst
+        assert_array_equal(dst, [7, 7, 7])
+
+
+class TestPriorityClass:
+    def test_root_requests_are_interactive_by_default(self):
+        assert Request(lambda: None).priority_class == Request.INTERACTIVE
+
+    def test_thread_default(self):
+        with Request.using_priority_class(Request.BATCH):
+            assert Request(lambda: None).priority_class == Request.BATCH
+        assert Request(lambda: None).priority_class == Request.INTERACTIVE
+
+    def test_children_inherit_priority_class(self):
+        def spawn_children():
+            inherited = Request(lambda: None)
+            explicit = Request(lambda: None, priority_class=Request.PREFETCH)
+            return inherited.priority_class, explicit.priority_class
+
+        parent = Request(spawn_children, priority_class=Request.BATCH)
+        parent.submit()
+        assert parent.wait() == (Request.BATCH, Request.PREFETCH)
+
+
+class TestAsyncio:
+    def test_await_request(self):
+        async def main():
+            return await Request(lambda: 42)
+
+        assert asyncio.run(main()) == 42
+
+    def test_many_concurrent_requests(self):
+        async def main():
+            return await asyncio.gather(*(Request(partial(lambda i: i * 2, i)).as_awaitable() for i in range(200)))
+
+        assert asyncio.run(main()) == [i * 2 for i in range(200)]
+
+    def test_failure(self):
+        def broken_fn():
+            raise TExc()
+
+        async def main():
+            await Request(broken_fn)
+
+        with pytest.raises(TExc):
+            asyncio.run(main())
+
+    def test_pseudo_requests(self):
+        def broken_fn():
+            raise TExc()
+
+        async def main():
+            assert await Request.with_value(42) == 42
+            assert await Request.inline(lambda: 7) == 7
+            with pytest.raises(TExc):
+                await Request.inline(broken_fn)
+
+        asyncio.run(main())
+
+    def test_cancelling_task_cancels_request(self):
+        started = threading.Event()
+        cancelled = threading.Event()
+
+        def work():
+            started.set()
+            while True:
+                time.sleep(0.01)
+                if Request.current_request_is_cancelled():
+                    cancelled.set()
+                    Request.raise_if_cancelled()
+
+        req = Request(work)
+
+        async def main():
+            task = asyncio.ensure_future(req.as_awaitable())
+            await asyncio.get_running_loop().run_in_executor(None, started.wait)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+        assert cancelled.wait(5)
+        assert req.cancelled
+
+    def test_cancelled_request_cancels_future(self):
+        started = threading.Event()
+
+        def work():
+            started.set()
+            while True:
+                time.sleep(0.01)
+                Request.raise_if_cancelled()
+
+        req = Request(work)
+
+        async def main():
+            future = req.as_awaitable()
+            await asyncio.get_running_loop().run_in_executor(None, started.wait)
+            req.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await future
+
+        asyncio.run(main())
@@ -1,3 +1,4 @@
+import queue
 import threading
 import time
 import random
@@ -5,8 +6,7 @@ import itertools
 
 import pytest
 
-from lazyflow.request.threadPool import ThreadPool
-
+from lazyflow.request.threadPool import ThreadPool, WorkStealingThreadPool, FairShareQueue
 
 NUM_WORKERS = 4
 
@@ -26,9 +26,9 @@ class Task:
         self.fn()
 
 
-@pytest.fixture
-def pool():
-    return ThreadPool(NUM_WORKERS)
+@pytest.fixture(params=[ThreadPool, WorkStealingThreadPool])
+def pool(request):
+    return request.param(NUM_WORKERS)
 
 
 def test_thread_pool_starts_workers(pool: ThreadPool):
@@ -79,8 +79,9 @@ def test_wake_task_executes_task_on_assigned_worker(pool: ThreadPool):
     assert worker == task.assigned_worker
 
 
-def test_exception_does_not_kill_worker():
-    pool = ThreadPool(1)
+@pytest.mark.parametrize("pool_class", [ThreadPool, WorkStealingThreadPool])
+def test_exception_does_not_kill_worker(pool_class):
+    pool = pool_class(1)
     stop = threading.Event()
     order = []
 
@@ -99,6 +100,93 @@ def test_exception_does_not_kill_worker():
     assert order == [1, 2]
 
 
+def test_work_stealing_pool_respects_priority():
+    pool = WorkStealingThreadPool(1)
+    blocker_started = threading.Event()
+    release_blocker = threading.Event()
+    stop = threading.Event()
+    order = []
+
+    class PrioritizedTask:
+        def __init__(self, priority, fn):
+            self.priority = priority
+            self.fn = fn
+            self.assigned_worker = None
+
+        def __lt__(self, other):
+            return self.priority < other.priority
+
+        def __call__(self):
+            self.fn()
+
+    def blocker():
+        blocker_started.set()
+        release_blocker.wait()
+
+    pool.wake_up(PrioritizedTask(0, blocker))
+    assert blocker_started.wait(timeout=1)
+
+    for priority in [3, 1, 2]:
+        pool.wake_up(PrioritizedTask(priority, lambda p=priority: order.append(p)))
+    pool.wake_up(PrioritizedTask(4, stop.set))
+
+    release_blocker.set()
+    assert stop.wait(timeout=1)
+    assert order == [1, 2, 3]
+    pool.stop()
+
+
+def test_work_stealing_pool_shares_workers_between_priority_classes():
+    pool = WorkStealingThreadPool(1, priority_shares={"interactive": 2, "prefetch": 1})
+    blocker_started = threading.Event()
+    release_blocker = threading.Event()
+    stop = threading.Event()
+    order = []
+
+    def blocker():
+        blocker_started.set()
+        release_blocker.wait()
+
+    pool.wake_up(Task(blocker))
+    assert blocker_started.wait(timeout=1)
+
+    def run(priority_class):
+        order.append(priority_class)
+        if len(order) == 6:
+            stop.set()
+
+    for priority_class in ["interactive"] * 4 + ["prefetch"] * 2:
+        task = Task(lambda c=priority_class: run(c))
+        task.priority_class = priority_class
+        pool.wake_up(task)
+
+    release_blocker.set()
+    assert stop.wait(timeout=1)
+    # Not all interactive tasks first: prefetch gets its share (1 out of 3)
+    assert order == ["interactive", "prefetch", "interactive", "interactive", "prefetch", "interactive"]
+    pool.stop()
+
+
+def test_work_stealing_idle_worker_steals_from_busy_worker():
+    pool = WorkStealingThreadPool(2)
+    done = threading.Event()
+    worker = None
+
+    def task():
+        nonlocal worker
+        worker = threading.current_thread()
+        done.set()
+
+    # Queue the task on one worker without waking it, then wake up the other one.
+    victim, thief = sorted(pool.workers, key=lambda w: w.name)
+    victim.push_unassigned(Task(task))
+    thief.notify()
+
+    assert done.wait(timeout=1)
+    assert worker is thief
+    pool.stop()
+
+
 @pytest.mark.xfail(reason="grpc=0.16.0 reconfigures the root logger.")
 def test_exception_in_task_logged(caplog, pool):
     stop = threading.Event()
@@ -119,3 +207,78 @@ def test_exception_in_task_logged(caplog, pool):
     record = caplog.records[0]
 
     assert issubclass(record.exc_info[0], MyExc)
+
+
+class ClassTask(Task):
+    def __init__(self, priority_class, fn=lambda: None):
+        super().__init__(fn)
+        self.priority_class = priority_class
+
+    def __lt__(self, other):
+        return self.priority < other.priority
+
+
+def test_fair_share_queue_serves_classes_by_share():
+    q = FairShareQueue({"a": 3, "b": 1})
+    for _ in range(8):
+        q.put_nowait(ClassTask("b"))
+    for _ in range(8):
+        q.put_nowait(ClassTask("a"))
+
+    served = [q.get_nowait().priority_class for _ in range(8)]
+    assert served.count("a") == 6
+    assert served.count("b") == 2
+    # Within a class, tasks come out in priority order
+    remaining = [q.get_nowait() for _ in range(8)]
+    for priority_class in "ab":
+        priorities = [t.priority for t in remaining if t.priority_class == priority_class]
+        assert priorities == sorted(priorities)
+
+    with pytest.raises(queue.Empty):
+        q.get_nowait()
+
+
+def test_fair_share_queue_idle_class_gets_no_credit():
+    q = FairShareQueue({"a": 1, "b": 1})
+    for _ in range(10):
+        q.put_nowait(ClassTask("a"))
+    for _ in range(10):
+        q.get_nowait()
+
+    # "b" was idle while "a" was served, so it doesn't get to catch up now.
+    for _ in range(4):
+        q.put_nowait(ClassTask("a"))
+        q.put_nowait(ClassTask("b"))
+    served = [q.get_nowait().priority_class for _ in range(4)]
+    assert served.count("a") == 2
+
+
+def test_interactive_tasks_overtake_batch_tasks():
+    pool = ThreadPool(1)
+    started = threading.Event()
+    release = threading.Event()
+    executed = []
+    done = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait()
+
+    pool.wake_up(ClassTask("interactive", blocker))
+    assert started.wait(timeout=1)
+
+    def record(priority_class):
+        executed.append(priority_class)
+        if len(executed) == 22:
+            done.set()
+
+    for _ in range(20):
+        pool.wake_up(ClassTask("batch", lambda: record("batch")))
+    for _ in range(2):
+        pool.wake_up(ClassTask("interactive", lambda: record("interactive")))
+    release.set()
+
+    assert done.wait(timeout=5)
+    pool.stop()
+    # Both interactive tasks are served right away, not after the 20 batch tasks
+    assert executed[:3].count("interactive") == 2
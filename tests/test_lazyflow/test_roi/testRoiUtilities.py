@@ -12,6 +12,8 @@ from lazyflow.roi import (
     nonzero_bounding_box,
     containing_rois,
     getIntersectingBlocks,
+    RoiIndex,
+    orderBlocks,
 )
 
 
@@ -140,6 +142,75 @@ class TestContainingRois(object):
         assert result.shape == (0,)
 
 
+class TestRoiIndex(object):
+    def testContaining(self):
+        rois = [((0, 0, 0), (10, 10, 10)), ((5, 3, 2), (11, 12, 13)), ((4, 6, 4), (5, 9, 9))]
+        index = RoiIndex()
+        for roi in rois:
+            index.add(roi)
+
+        assert index.containing(((4, 7, 6), (5, 8, 8))) in (rois[0], rois[2])
+        assert index.containing(((9, 9, 9), (11, 12, 13))) == rois[1]
+        assert index.containing(((100, 100, 100), (200, 200, 200))) is None
+
+        index.remove(rois[1])
+        index.remove(rois[1])
+        assert index.containing(((9, 9, 9), (11, 12, 13))) is None
+        assert len(index) == 2
+
+    def testMatchesBruteForce(self):
+        rng = numpy.random.RandomState(0)
+        index = RoiIndex()
+        rois = set()
+        for _ in range(200):
+            start = rng.randint(0, 100, size=3)
+            stop = start + rng.choice([1, 10, 10, 10, 50], size=3)
+            roi = (tuple(start), tuple(stop))
+            index.add(roi)
+            rois.add(roi)
+
+        for _ in range(200):
+            start = rng.randint(0, 120, size=3)
+            query = (tuple(start), tuple(start + rng.randint(1, 30, size=3)))
+
+            expected = {(tuple(a), tuple(b)) for a, b in containing_rois(list(rois), query)}
+            result = index.containing(query)
+            assert result in expected if expected else result is None
+
+            expected = {roi for roi in rois if getIntersection(roi, query, assertIntersect=False) is not None}
+            assert set(index.intersecting(query)) == expected
+
+    def testEmpty(self):
+        index = RoiIndex()
+        assert index.containing(((0, 0), (1, 1))) is None
+        assert index.intersecting(((0, 0), (1, 1))) == []
+
+
+class TestOrderBlocks(object):
+    def testAllOrdersArePermutations(self):
+        blockshape = (10, 7, 3)
+        block_starts = getIntersectingBlocks(blockshape, ((3, 2, 0), (95, 60, 10)))
+        expected = sorted(map(tuple, block_starts.tolist()))
+        for order in ["c", "zorder", "hilbert", "slab"]:
+            ordered = orderBlocks(block_starts, blockshape, order, slab_shape=(20, 14, None))
+            assert sorted(map(tuple, ordered.tolist())) == expected, order
+
+    def testHilbertVisitsNeighbors(self):
+        for shape in [(8, 8), (4, 4, 4)]:
+            block_starts = numpy.indices(shape).reshape(len(shape), -1).T
+            ordered = orderBlocks(block_starts, (1,) * len(shape), "hilbert")
+            steps = numpy.abs(numpy.diff(ordered, axis=0)).sum(axis=1)
+            assert (steps == 1).all()
+
+    def testSlabsAreContiguous(self):
+        block_starts = numpy.indices((8, 8)).reshape(2, -1).T * 10
+        ordered = orderBlocks(block_starts, (10, 10), "slab", slab_shape=(40, 40))
+        slabs = [tuple(start // 40) for start in ordered]
+        # Each slab is visited exactly once, i.e. all its blocks are in one run
+        runs = [slab for i, slab in enumerate(slabs) if i == 0 or slab != slabs[i - 1]]
+        assert len(runs) == len(set(slabs)) == 4
+
+
 class TestGetIntersectionBlocks(TestCase):
     def test_invalid_parameters(self):
         with self.assertRaises(AssertionError):
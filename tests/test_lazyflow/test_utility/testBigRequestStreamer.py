@@ -34,6 +34,7 @@ from lazyflow.operators import OpArrayPiper
 from lazyflow.request import Request
 
 from lazyflow.utility import BigRequestStreamer
+from lazyflow.utility.bigRequestStreamer import AdaptiveBlockshapeController
 
 import logging
 
@@ -118,6 +119,62 @@ class TestBigRequestStreamer(unittest.TestCase):
 
         logger.debug("FINISHED")
 
+    def testBlockOrders(self):
+        op = OpArrayPiper(graph=Graph())
+        inputData = numpy.indices((100, 100)).sum(0)
+        op.Input.setValue(inputData)
+
+        for blockOrder in ["c", "zorder", "hilbert", "slab"]:
+            results = numpy.zeros((100, 100), dtype=numpy.int32)
+            rois = []
+
+            def handleResult(roi, result):
+                results[roiToSlice(*roi)] = result
+                rois.append(tuple(map(tuple, roi)))
+
+            batch = BigRequestStreamer(
+                op.Output, [(5, 0), (100, 100)], (10, 10), blockOrder=blockOrder, slabShape=(20, 20)
+            )
+            batch.resultSignal.subscribe(handleResult)
+            batch.execute()
+
+            assert (results[5:] == inputData[5:]).all(), blockOrder
+            assert len(rois) == len(set(rois)) == 100, blockOrder
+
+    def testAdaptiveBlockshape(self):
+        op = OpArrayPiper(graph=Graph())
+        inputData = numpy.indices((100, 100)).sum(0)
+        op.Input.setValue(inputData)
+
+        results = numpy.zeros((100, 100), dtype=numpy.int32)
+        hits = numpy.zeros((100, 100), dtype=numpy.int32)
+        block_volumes = []
+
+        def handleResult(roi, result):
+            results[roiToSlice(*roi)] = result
+            hits[roiToSlice(*roi)] += 1
+            block_volumes.append(numpy.prod(numpy.subtract(roi[1], roi[0])))
+
+        batch = BigRequestStreamer(op.Output, [(0, 0), (100, 100)], (2, 2), batchSize=2, adaptiveBlockshape=True)
+        batch.resultSignal.subscribe(handleResult)
+        batch.execute()
+
+        assert (results == inputData).all()
+        assert (hits == 1).all(), "Blocks must tile the roi exactly, even if the blockshape changes"
+        # Such tiny blocks are very fast, so the blockshape should have grown
+        assert max(block_volumes) > 4
+
+
+def test_adaptive_blockshape_shrinks_when_out_of_ram():
+    controller = AdaptiveBlockshapeController(
+        (10, 10, 10), ((0, 0, 0), (100, 100, 100)), batchSize=2, fixedAxes=[0], ramBudget=1
+    )
+    for i in range(2):
+        roi = ((i, 0, 0), (i + 1, 1, 1))
+        controller.blockIssued(roi)
+        controller.blockCompleted(roi)
+    assert controller.blockshape == (10, 5, 10)
+
 
 def test_pool_results_discarded():
     """
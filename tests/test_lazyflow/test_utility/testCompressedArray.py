@@ -0,0 +1,77 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import numpy
+import pytest
+
+from lazyflow.utility.compressedArray import CompressedArray
+from lazyflow.utility.compressionCodecs import availableCodecs, getCodec
+
+
+@pytest.mark.parametrize("codec", availableCodecs())
+@pytest.mark.parametrize("dtype", [numpy.uint8, numpy.float32, bool])
+def test_readWrite(codec, dtype):
+    rng = numpy.random.RandomState(0)
+    shape = (13, 17, 5)
+    array = CompressedArray(shape, dtype, (4, 8, 5), codec)
+    expected = numpy.zeros(shape, dtype=dtype)
+
+    def randomSlicing():
+        start = [rng.randint(0, s) for s in shape]
+        stop = [rng.randint(a + 1, s + 1) for a, s in zip(start, shape)]
+        return tuple(slice(a, b) for a, b in zip(start, stop))
+
+    for i in range(50):
+        slicing = randomSlicing()
+        value = (5 * rng.random_sample(expected[slicing].shape)).astype(dtype)
+        array[slicing] = value
+        expected[slicing] = value
+
+        slicing = randomSlicing()
+        assert (array[slicing] == expected[slicing]).all()
+
+        destination = numpy.empty_like(expected[slicing])
+        array.readInto(slicing, destination)
+        assert (destination == expected[slicing]).all()
+
+    assert (array[...] == expected).all()
+
+
+def test_storageSize():
+    array = CompressedArray((20, 20), numpy.uint32, (10, 10))
+    assert array.nbytes == 20 * 20 * 4
+    assert array.storage_size == 0
+
+    array[0:10, 0:10] = 1
+    array[15, 15:17] = 2
+    assert len(array._chunks) == 2
+    assert array.storage_size == sum(len(buf) for buf in array._chunks.values())
+
+    # Chunks without data are dropped
+    array[...] = 0
+    assert len(array._chunks) == 0
+    assert array.storage_size == 0
+
+
+def test_unknownCodec():
+    with pytest.raises(KeyError):
+        getCodec("no-such-codec")
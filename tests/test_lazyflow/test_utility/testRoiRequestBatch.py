@@ -108,6 +108,51 @@ class TestRoiRequestBatch(object):
         with pytest.raises(SpecialException):
             batch.execute()
 
+    def testPrefetch(self):
+        graph = Graph()
+        opUpstream = OpArrayPiper(graph=graph)
+        inputData = numpy.indices((100, 100)).sum(0)
+        opUpstream.Input.setValue(inputData)
+        op = OpArrayPiper(graph=graph)
+        op.Input.connect(opUpstream.Output)
+
+        roiList = []
+        block_starts = getIntersectingBlocks([10, 10], ([0, 0], [100, 100]))
+        for block_start in block_starts:
+            roiList.append(getBlockBounds([100, 100], [10, 10], block_start))
+
+        prefetched = []
+
+        def prefetchRoi(roi):
+            prefetched.append(roi)
+            # With a halo, which is clipped to the upstream shape
+            return numpy.subtract(roi[0], 2), numpy.add(roi[1], 2)
+
+        # Room for the read-ahead of two blocks (with halo)
+        prefetchMemory = 2 * 14 * 14 * inputData.dtype.itemsize
+        results = numpy.zeros((100, 100), dtype=numpy.int32)
+
+        def handleResult(roi, result):
+            results[roiToSlice(*roi)] = result
+            assert 0 <= batch._prefetchedBytes <= prefetchMemory
+
+        batch = RoiRequestBatch(
+            op.Output,
+            iter(roiList),
+            batchSize=2,
+            prefetchSlot=opUpstream.Output,
+            prefetchDepth=5,
+            prefetchRoi=prefetchRoi,
+            prefetchMemory=prefetchMemory,
+        )
+        batch.resultSignal.subscribe(handleResult)
+        batch.execute()
+
+        assert (results == inputData).all()
+        # Every roi but the first one was read ahead, in order
+        assert [tuple(map(tuple, roi)) for roi in prefetched] == [tuple(map(tuple, roi)) for roi in roiList[1:]]
+        assert batch._prefetchedBytes == 0
+
 
 if __name__ == "__main__":
     # Run this file independently to see debug output.
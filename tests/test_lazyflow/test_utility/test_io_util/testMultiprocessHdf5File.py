@@ -0,0 +1,139 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+# 		   http://ilastik.org/license/
+###############################################################################
+
+import threading
+
+import h5py
+import numpy
+import pytest
+
+from lazyflow.request import Request
+from lazyflow.utility.io_util.multiprocessHdf5File import MultiProcessHdf5File, ReaderPool, sharedArray
+
+
+@pytest.fixture
+def h5_paths(tmp_path):
+    paths = []
+    for i in range(2):
+        path = str(tmp_path / "data{}.h5".format(i))
+        data = (numpy.indices((20, 30, 40)).sum(0) + i).astype(numpy.uint16)
+        with h5py.File(path, "w") as f:
+            f.create_dataset("group/data", data=data, chunks=(10, 10, 10), compression="gzip")
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def reader_pool():
+    pool = ReaderPool(2)
+    yield pool
+    pool.shutdown()
+
+
+def expected(i):
+    return (numpy.indices((20, 30, 40)).sum(0) + i).astype(numpy.uint16)
+
+
+def test_getitem(h5_paths, reader_pool):
+    with MultiProcessHdf5File(h5_paths[0], reader_pool=reader_pool) as f:
+        dataset = f["group/data"]
+        assert dataset.shape == (20, 30, 40)
+        assert dataset.dtype == numpy.uint16
+
+        numpy.testing.assert_array_equal(dataset[:], expected(0))
+        numpy.testing.assert_array_equal(dataset[3:7, 5, ...], expected(0)[3:7, 5, ...])
+        numpy.testing.assert_array_equal(f["group"]["data"][2], expected(0)[2])
+
+
+def test_read_direct(h5_paths, reader_pool):
+    with MultiProcessHdf5File(h5_paths[0], reader_pool=reader_pool) as f:
+        out = numpy.zeros((5, 30, 40), dtype=numpy.uint16)
+        f["group/data"].read_direct(out, numpy.s_[10:15])
+        numpy.testing.assert_array_equal(out, expected(0)[10:15])
+
+
+def test_read_direct_into_shared_array(h5_paths, reader_pool):
+    out = sharedArray((20, 30, 40), numpy.uint16)
+    out[:] = 0
+    with MultiProcessHdf5File(h5_paths[0], reader_pool=reader_pool) as f:
+        # A contiguous view into the shared array, written by the reader process without a transfer buffer
+        f["group/data"].read_direct(out[10:15], numpy.s_[0:5])
+        numpy.testing.assert_array_equal(out[10:15], expected(0)[0:5])
+        assert (out[:10] == 0).all() and (out[15:] == 0).all()
+        assert all(reader._transfer_segment is None for reader in reader_pool._readers)
+
+
+def test_parallel_reads(h5_paths, reader_pool):
+    files = [MultiProcessHdf5File(path, reader_pool=reader_pool) for path in h5_paths]
+    errors = []
+
+    def read(i, z):
+        try:
+            numpy.testing.assert_array_equal(files[i]["group/data"][z : z + 2], expected(i)[z : z + 2])
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=read, args=(z % 2, z)) for z in range(18)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for f in files:
+        f.close()
+
+    assert not errors
+    # Both files were read through the same (bounded) pool of processes
+    assert len(reader_pool._readers) <= 2
+
+
+def test_waiting_requests_yield_their_worker(reader_pool):
+    readers = [reader_pool.acquire() for _ in range(2)]
+
+    def use_reader():
+        reader = reader_pool.acquire()
+        reader_pool.release(reader)
+        return reader
+
+    # More requests waiting for a reader than there are workers
+    waiting = [Request(use_reader) for _ in range(Request.global_thread_pool.num_workers + 1)]
+    for req in waiting:
+        req.submit()
+
+    # ... don't keep other requests from running
+    req = Request(lambda: 42)
+    req.submit()
+    assert req.wait(timeout=10) == 42
+
+    for reader in readers:
+        reader_pool.release(reader)
+    assert all(req.wait(timeout=10) in readers for req in waiting)
+    assert len(reader_pool._idle_readers) == 2
+
+
+def test_read_error(h5_paths, reader_pool):
+    with MultiProcessHdf5File(h5_paths[0], reader_pool=reader_pool) as f:
+        with pytest.raises(Exception):
+            f["group/data"].read_direct(numpy.zeros((3,), dtype=numpy.uint16), numpy.s_[0:5])
+
+        # The reader survives the failed request
+        numpy.testing.assert_array_equal(f["group/data"][0], expected(0)[0])